@@ -11,8 +11,11 @@
 
 import libminetest.map
 import libminetest.utils
-from libminetest.nodes import Node
+from libminetest.content import ContentRegistry
+from libminetest import arrays
 import time
+import functools
+import operator
 
 def removeUnknowns():
     import sys
@@ -35,43 +38,38 @@ def removeUnknowns():
     print("{0} nodes known".format(len(nodes)))
 
     u = libminetest.map.MapVessel(sys.argv[1])
-    ids = u.get_all_mapblock_ids()
-    nids = len(ids)
-    print("{0} mapblocks to inspect".format(nids))
+    known = set(["air"] + nodes)
 
+    # Only the palettes are read here, the mapblocks holding unknown nodes are decoded later
     s = time.time()
-    eta = 0
+    ids = [blockID for blockID, summary in u.scan_blocks()
+        if any(not name in known for name in summary["name_id_mappings"].values())]
+    print("{0} mapblocks to inspect, found in {1:.2f}s".format(len(ids), time.time() - s))
 
-    for index in range(len(ids)):
-        i = ids[index]
-        k = u.load(i)
-        absi = libminetest.utils.posFromInt(i, 4096)
-        pct = index/nids * 100
-        if index % 10 == 0:
-            eta = ((time.time() - s) / (index+1)) * (nids - index)
-            etastring = "[ETA {0}:{1:2d}]".format(int(eta/60), int(eta%60))
+    # Known nodes and air are registered first, so they get the lowest global ids
+    registry = ContentRegistry(["air"] + nodes)
+    s = time.time()
+    removed = u.map_blocks(functools.partial(cleanMapBlock, registry, len(registry)), ids = ids, reduce = operator.add, initial = 0)
+    print("{0} unknown nodes removed in {1:.2f}s".format(removed, time.time() - s))
 
-        print("[{0:3.2f}%]{1} Checking mapblock {2} ({3})".format(pct, etastring, i, absi), end = "     \r")
-        unknowns = []
-        for id in k.name_id_mappings:
-            node = k.name_id_mappings[id]
-            if node != "air":
-                if not node in nodes:
-                    unknowns.append(node)
+def cleanMapBlock(registry, known, k):
+    # Ran in worker processes, modified mapblocks are written back by the main one
+    unknowns = [node for node in k.name_id_mappings.values() if registry.get_id(node) >= known]
 
-        if len(unknowns) > 0:
-            for x in range(16):
-                for y in range(16):
-                    for z in range(16):
-                        noderef = k.get_node(x + y * 16 + z * 16 * 16)
-                        if noderef.get_name() in unknowns:
-                            k.set_node(x + y * 16 + z * 16 * 16, Node("air"))
+    removed = 0
+    if len(unknowns) > 0:
+        keep = registry.isin(k.get_global_ids(registry), registry.names[:known])
+        removed = len(keep) - sum(keep)
+        # Like set_node with air : params are reset, and metadata and timers are dropped
+        k.param0 = arrays.where(keep, k.param0, arrays.full("H", len(keep), k.get_content_id("air")))
+        k.param1 = arrays.masked(k.param1, keep)
+        k.param2 = arrays.masked(k.param2, keep)
+        k.clear_node_data(i for i, kept in enumerate(keep) if not kept)
+        k.modified = True
 
-            print("\n[{0:3.2f}%] {1} nodes removed".format(pct, len(unknowns)))
-            print("[{0:3.2f}%] Saving mapblock {1}".format(pct, absi))
-            u.write(i, k.implode())
+        print("{0} ({1} nodes) removed from mapblock {2}".format(", ".join(unknowns), removed, libminetest.utils.posFromInt(k.abspos, 4096)))
 
-    u.commit()
+    return removed
 
 if __name__ == "__main__":
     removeUnknowns()
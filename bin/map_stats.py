@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+############################
+## Tool of Python-Minetest :
+## Computes node histograms by Y layer and mapblock statistics of a map
+##
+## args :
+## ./map_stats.py <path to sqlite file> <json|csv> [x1 y1 z1 x2 y2 z2]
+##
+#
+
+import libminetest.map
+import libminetest.utils
+import sys
+
+def mapStats():
+    if len(sys.argv) < 3 or not sys.argv[2] in ("json", "csv") or not len(sys.argv) in (3, 9):
+        print("./map_stats.py <path to sqlite file> <json|csv> [x1 y1 z1 x2 y2 z2]")
+        return
+
+    minp = maxp = None
+    if len(sys.argv) == 9:
+        try:
+            coords = [int(c) for c in sys.argv[3:9]]
+        except ValueError as err:
+            print("Invalid coordinates : {0}".format(err))
+            return
+        minp, maxp = libminetest.utils.Pos(*coords[:3]), libminetest.utils.Pos(*coords[3:])
+
+    try:
+        open(sys.argv[1])
+    except Exception as err:
+        print("Couldn't open db file {0} : {1}".format(sys.argv[1], err))
+        return
+
+    stats = libminetest.map.MapVessel(sys.argv[1]).stats(minp, maxp)
+    if sys.argv[2] == "json":
+        stats.to_json(sys.stdout)
+    else:
+        stats.to_csv(sys.stdout)
+
+if __name__ == "__main__":
+    mapStats()
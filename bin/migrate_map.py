@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+############################
+## Tool of Python-Minetest :
+## Copies all the mapblocks of a map to another storage backend
+##
+## args :
+## ./migrate_map.py <sqlite3|sharded> <source path> <sqlite3|sharded> <destination path> [shards]
+##
+#
+
+import libminetest.map
+import libminetest.backends
+import time
+import sys
+
+def migrateMap():
+    if not len(sys.argv) in (5, 6) or not sys.argv[1] in ("sqlite3", "sharded") or not sys.argv[3] in ("sqlite3", "sharded"):
+        print("./migrate_map.py <sqlite3|sharded> <source path> <sqlite3|sharded> <destination path> [shards]")
+        return
+
+    srcbackend, srcpath, dstbackend, dstpath = sys.argv[1:5]
+    if len(sys.argv) == 6:
+        if dstbackend != "sharded" or not sys.argv[5].isdigit() or int(sys.argv[5]) < 1:
+            print("The number of shards must be a positive integer, for a sharded destination")
+            return
+        dstbackend = libminetest.backends.ShardedSQLiteBackend(dstpath, shards = int(sys.argv[5]))
+
+    source = libminetest.map.MapVessel(srcpath, srcbackend, readonly = True)
+    destination = libminetest.map.MapVessel.create(dstpath, profile = "bulk", backend = dstbackend)
+
+    s = time.time()
+    count = libminetest.backends.migrate(source, destination)
+    print("{0} mapblocks copied in {1:.2f}s".format(count, time.time() - s))
+
+    source.close()
+    destination.close()
+
+if __name__ == "__main__":
+    migrateMap()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Packed arrays for Python-MT
+##
+## NumPy is used when it is installed, the
+## standard `array` module otherwise
+##
+#
+
+import sys
+from array import array
+from collections import Counter
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+HAS_NUMPY = numpy is not None
+
+# array typecode -> numpy dtype (native byte order)
+_DTYPES = {"B": "u1", "H": "u2", "I": "u4", "i": "i4", "q": "i8"}
+
+
+def zeros(typecode, count):
+	"""
+	Return a packed array of `count` zeroes
+
+	Arguments :
+	 - typecode, mandatory, is one of "B" (u8), "H" (u16), "I" (u32), "i" (s32) or "q" (s64)
+	 - count, mandatory, is the length of the array
+	"""
+
+	return full(typecode, count, 0)
+
+def full(typecode, count, value):
+	"""
+	Return a packed array of `count` elements all set to `value`
+	"""
+
+	if HAS_NUMPY:
+		return numpy.full(count, value, dtype=_DTYPES[typecode])
+
+	return array(typecode, [value]) * count
+
+def fromlist(typecode, values):
+	"""
+	Build a packed array from a sequence of integers
+	"""
+
+	if HAS_NUMPY:
+		return numpy.array(values, dtype=_DTYPES[typecode])
+
+	return array(typecode, values)
+
+def frombytes(typecode, data):
+	"""
+	Build a packed array from big-endian binary data (as found in Minetest's files)
+
+	Arguments :
+	 - typecode, mandatory, is the typecode of the elements stored in `data`
+	 - data, mandatory, is a bytes-like object whose length is a multiple of the element size
+	"""
+
+	if HAS_NUMPY:
+		return numpy.frombuffer(data, dtype=">" + _DTYPES[typecode]).astype(_DTYPES[typecode])
+
+	arr = array(typecode)
+	arr.frombytes(data)
+	if arr.itemsize > 1 and sys.byteorder == "little":
+		arr.byteswap()
+
+	return arr
+
+def tobytes(arr):
+	"""
+	Return the big-endian binary representation of a packed array
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return arr.astype(arr.dtype.newbyteorder(">")).tobytes()
+
+	if arr.itemsize > 1 and sys.byteorder == "little":
+		arr = array(arr.typecode, arr)
+		arr.byteswap()
+
+	return arr.tobytes()
+
+def astype(arr, typecode):
+	"""
+	Return a copy of `arr` converted to elements of type `typecode`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return arr.astype(_DTYPES[typecode])
+
+	return array(typecode, arr)
+
+def copy(arr):
+	"""
+	Return a copy of a packed array
+	"""
+
+	return astype(arr, typecode(arr))
+
+def equal(arr, other):
+	"""
+	Return whether two packed arrays hold the same values
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return bool(numpy.array_equal(arr, other))
+
+	return list(arr) == list(other)
+
+def typecode(arr):
+	"""
+	Return the `array` typecode of a packed array
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return {v: k for k, v in _DTYPES.items()}[arr.dtype.str[1:]]
+
+	return arr.typecode
+
+def unique(arr):
+	"""
+	Return the sorted list of the distinct values of a packed array
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return numpy.unique(arr).tolist()
+
+	return sorted(set(arr))
+
+def remap(arr, table):
+	"""
+	Return a copy of `arr` where every value `v` is replaced by `table[v]`
+
+	Arguments :
+	 - arr, mandatory, is the packed array to remap
+	 - table, mandatory, is a list long enough to be indexed by every value of `arr`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return numpy.asarray(table, dtype=arr.dtype)[arr]
+
+	return array(arr.typecode, map(table.__getitem__, arr))
+
+def blit(dst, dst_start, src, src_start, length, skip = None, key = None):
+	"""
+	Copy `length` elements of `src` starting at `src_start` into `dst` starting at `dst_start`
+
+	Arguments :
+	 - skip, key, optional : when `key` (a packed array indexed like `src`) is provided, elements
+	   whose key equals `skip` are not copied, leaving `dst` untouched there
+	"""
+
+	if key is None or not skip in key[src_start:src_start + length]:
+		dst[dst_start:dst_start + length] = src[src_start:src_start + length]
+		return
+
+	if HAS_NUMPY and isinstance(dst, numpy.ndarray):
+		keep = key[src_start:src_start + length] != skip
+		dst[dst_start:dst_start + length][keep] = src[src_start:src_start + length][keep]
+		return
+
+	for i in range(length):
+		if key[src_start + i] != skip:
+			dst[dst_start + i] = src[src_start + i]
+
+def masked(arr, key, value = 0):
+	"""
+	Return a copy of `arr` where the elements whose `key` (a packed array as long as `arr`) is 0 are set to `value`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		arr = arr.copy()
+		arr[numpy.asarray(key) == 0] = value
+		return arr
+
+	return array(arr.typecode, (v if k else value for v, k in zip(arr, key)))
+
+def byteview(arr):
+	"""
+	Return a writable memoryview over the raw bytes of a packed array
+	"""
+
+	return memoryview(arr).cast("B")
+
+def from_big_endian(arr):
+	"""
+	Convert, in place, a packed array whose raw bytes were filled with big-endian data (see byteview)
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		if arr.dtype.itemsize > 1 and sys.byteorder == "little":
+			arr.byteswap(inplace = True)
+		return
+
+	if arr.itemsize > 1 and sys.byteorder == "little":
+		arr.byteswap()
+
+def where(key, arr, other):
+	"""
+	Return a packed array holding the elements of `arr` where `key` is not 0, and those of `other` elsewhere
+
+	All three arrays must have the same length, the result having the type of `arr`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return numpy.where(numpy.asarray(key) != 0, arr, other).astype(arr.dtype)
+
+	return array(arr.typecode, (a if k else o for k, a, o in zip(key, arr, other)))
+
+def add(arr, other):
+	"""
+	Return the element-wise sum of `arr` and `other` (a packed array as long as `arr`, or an integer)
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return (arr + other).astype(arr.dtype)
+
+	if isinstance(other, int):
+		return array(arr.typecode, (v + other for v in arr))
+
+	return array(arr.typecode, map(int.__add__, arr, other))
+
+def floordiv(arr, divisor):
+	"""
+	Return the element-wise floor division of `arr` by the integer `divisor`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return arr // divisor
+
+	return array(arr.typecode, (v // divisor for v in arr))
+
+def mod(arr, divisor):
+	"""
+	Return the element-wise (positive) modulo of `arr` by the integer `divisor`
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		return arr % divisor
+
+	return array(arr.typecode, (v % divisor for v in arr))
+
+def combine(typecode, arrs, factors):
+	"""
+	Return the packed array of type `typecode` holding the sums of the elements of `arrs` times `factors`
+
+	Arguments :
+	 - arrs, mandatory, is a sequence of packed arrays of the same length
+	 - factors, mandatory, is the sequence of the integers each array is multiplied by
+	"""
+
+	if HAS_NUMPY and all(isinstance(arr, numpy.ndarray) for arr in arrs):
+		result = numpy.zeros(len(arrs[0]), dtype = _DTYPES[typecode])
+		for arr, factor in zip(arrs, factors):
+			result += arr.astype(_DTYPES[typecode]) * factor
+		return result
+
+	return array(typecode, (sum(v * f for v, f in zip(values, factors)) for values in zip(*arrs)))
+
+def counts(arr):
+	"""
+	Return a dictionary of the number of occurrences of every distinct value of a packed array
+	"""
+
+	if HAS_NUMPY and isinstance(arr, numpy.ndarray):
+		values, occurrences = numpy.unique(arr, return_counts = True)
+		return dict(zip(values.tolist(), occurrences.tolist()))
+
+	return dict(Counter(arr))
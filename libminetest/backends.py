@@ -0,0 +1,742 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Map storage backends for Python-MT
+##
+##
+#
+
+import sqlite3 as _sql
+import abc
+import os
+import queue
+import threading
+import functools
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+from .errors import MapError
+from .logger import logger
+
+# Maximum number of mapblock ids bound in a single query
+SQL_CHUNK_SIZE = 500
+
+# Number of files a new sharded map is spread over
+DEFAULT_SHARDS = 4
+
+# SQLite connection settings MapVessel can tune, with the names of their numeric values
+SQLITE_SETTINGS = {
+	"journal_mode": {},
+	"synchronous": {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"},
+	"cache_size": {},
+	"mmap_size": {},
+	"temp_store": {0: "DEFAULT", 1: "FILE", 2: "MEMORY"},
+	"busy_timeout": {},
+}
+
+# Connection profiles
+SQLITE_PROFILES = {
+	# Offline rewrite of a whole map : no server may use the map meanwhile, and
+	# the map can be lost if the machine crashes, so keep a backup around
+	"bulk": {
+		"journal_mode": "MEMORY",
+		"synchronous": "OFF",
+		"cache_size": -262144, # KiB, ie. 256 MiB
+		"mmap_size": 1 << 30,
+		"temp_store": "MEMORY",
+		"busy_timeout": 5000,
+	},
+	# Working alongside a running server : the journal mode is left as the
+	# server uses it, and locks held by the server are waited for
+	"live": {
+		"journal_mode": None,
+		"synchronous": "FULL",
+		"cache_size": -65536, # KiB, ie. 64 MiB
+		"mmap_size": 1 << 28,
+		"temp_store": "MEMORY",
+		"busy_timeout": 10000,
+	},
+}
+
+def _items(items):
+	if isinstance(items, dict):
+		return items.items()
+	return items
+
+def _in_ranges(blockID, ranges):
+	return any(lo <= blockID <= hi for lo, hi in ranges)
+
+class ConnectionPool:
+	"""
+	Pool of database connections shared between threads, each connection being used by one thread at a time
+	"""
+
+	def __init__(self, connect, size):
+		"""
+		Constructor for ConnectionPool
+
+		Arguments :
+		 - connect, mandatory, is a function returning a new connection
+		 - size, mandatory, is the maximum number of connections opened
+		"""
+
+		self.connect = connect
+		self.size = size
+		self.connections = []
+		self.idle = queue.LifoQueue()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		"""
+		Return an idle connection, opening a new one if the pool is not full, or waiting for one otherwise
+		"""
+
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			pass
+
+		with self.lock:
+			if len(self.connections) < self.size:
+				conn = self.connect()
+				self.connections.append(conn)
+				return conn
+
+		return self.idle.get()
+
+	def release(self, conn):
+		self.idle.put(conn)
+
+	@contextmanager
+	def connection(self):
+		conn = self.acquire()
+		try:
+			yield conn
+		finally:
+			self.release(conn)
+
+	def close(self):
+		for conn in self.connections:
+			conn.close()
+		self.connections = []
+		self.idle = queue.LifoQueue()
+
+class MapBackend(abc.ABC):
+	"""
+	Storage of the binary blobs of a map's mapblocks, indexed by mapblock id (see MapVessel)
+
+	Backends must implement read_many, write_many, remove, iter_ids, iter_blocks, commit and rollback
+	(abstract methods : a backend missing one of them cannot be instantiated).
+	The other methods have generic implementations built on top of those, which backends may override
+
+	Writes are part of a pending transaction until commit() is called, and are dropped by rollback()
+	"""
+
+	def create(self):
+		"""
+		Create the storage of the map if it does not exist yet
+		"""
+
+		pass
+
+	def close(self):
+		pass
+
+	def opener(self):
+		"""
+		Return a picklable callable opening this map again, read-only, in another process (see
+		libminetest.parallel), or None if the map cannot be shared between processes
+		"""
+
+		return None
+
+	def read(self, blockID):
+		"""
+		Return the binary blob of a mapblock, or None if it does not exist
+		"""
+
+		return self.read_many([blockID]).get(blockID)
+
+	@abc.abstractmethod
+	def read_many(self, blockIDs):
+		"""
+		Return a dictionary of the binary blobs of several mapblocks, indexed by mapblock id. Mapblocks that do not exist are left out
+		"""
+
+		raise NotImplementedError
+
+	def write(self, blockID, data):
+		self.write_many([(blockID, data)])
+
+	@abc.abstractmethod
+	def write_many(self, items):
+		"""
+		Write the binary blobs of several mapblocks
+
+		Arguments :
+		 - items, mandatory, is either a dictionary of binary blobs indexed by mapblock id,
+		   or an iterable of (mapblock id, binary blob) tuples
+
+		Returns the number of mapblocks written
+		"""
+
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def remove(self, blockID):
+		raise NotImplementedError
+
+	def remove_all(self):
+		for blockID in list(self.iter_ids()):
+			self.remove(blockID)
+
+	@abc.abstractmethod
+	def iter_ids(self, batch_size = 1024):
+		"""
+		Generator streaming the ids of all the mapblocks of the map
+		"""
+
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def iter_blocks(self, batch_size = 256, ranges = None):
+		"""
+		Generator streaming (mapblock id, binary blob) tuples, `batch_size` mapblocks being fetched at once
+
+		Arguments :
+		 - ranges, optional, is a list of (lowest id, highest id) tuples : only the mapblocks whose id is in one of them are streamed
+		"""
+
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def commit(self):
+		raise NotImplementedError
+
+	@abc.abstractmethod
+	def rollback(self):
+		raise NotImplementedError
+
+	@contextmanager
+	def transaction(self):
+		"""
+		Context manager committing the writes made in it, or rolling them back if an exception is raised
+		"""
+
+		try:
+			yield self
+		except BaseException:
+			self.rollback()
+			raise
+
+		self.commit()
+
+	def configure(self, profile = None, **settings):
+		"""
+		Tune the connection to the map (see SQLiteBackend.configure)
+		"""
+
+		if profile or settings:
+			raise MapError("The {0} backend has no connection settings".format(type(self).__name__))
+
+		return dict()
+
+	def get_setting(self, name):
+		return None
+
+	def get_settings(self):
+		return dict()
+
+class SQLiteBackend(MapBackend):
+	"""
+	Map stored in a single SQLite database, as Minetest does
+	"""
+
+	def __init__(self, mapfile, readonly = False, immutable = False, pool_size = 4):
+		"""
+		Constructor for SQLiteBackend
+
+		Arguments :
+		 - mapfile, mandatory, is the path to the map's database
+		 - readonly, immutable, pool_size, optional, see MapVessel
+		"""
+
+		self.mapfile = mapfile
+		self.readonly = readonly or immutable
+		self.immutable = immutable
+		self.pool_size = pool_size
+		self.settings = dict()
+		self.pool = None
+		self.conn = self._connect(mapfile)
+		self.cur = self.conn.cursor()
+
+		if self.readonly:
+			self.pool = ConnectionPool(lambda: self._connect(mapfile, self.settings), self.pool_size)
+
+	def __str__(self):
+		return "sqlite3 backend for {0}".format(self.mapfile)
+
+	def _connect(self, mapfile, settings = None):
+		"""
+		Open a new connection to `mapfile`, applying the connection settings provided
+		"""
+
+		try:
+			if self.readonly:
+				uri = "file:{0}?mode=ro".format(pathname2url(os.path.abspath(mapfile)))
+				if self.immutable:
+					uri += "&immutable=1"
+				conn = _sql.connect(uri, uri = True, check_same_thread = False)
+			else:
+				conn = _sql.connect(mapfile)#, 10)
+		except _sql.OperationalError as err:
+			raise MapError("Error opening database : {0}".format(err))
+
+		for name, value in (settings or {}).items():
+			if value is None:
+				continue
+
+			try:
+				conn.execute("PRAGMA {0} = {1}".format(name, value))
+			except _sql.OperationalError as err:
+				logger.warning("Couldn't set {0} to {1} : {2}".format(name, value, err))
+
+		return conn
+
+	@contextmanager
+	def reader(self):
+		"""
+		Context manager providing a cursor to read from the database
+
+		In read-only mode, the cursor comes from a pooled connection used by no other thread meanwhile
+		"""
+
+		if self.pool is None:
+			yield self.conn.cursor()
+			return
+
+		with self.pool.connection() as conn:
+			yield conn.cursor()
+
+	def create(self):
+		try:
+			self.cur.execute("CREATE TABLE IF NOT EXISTS `blocks` (\n`pos` INT PRIMARY KEY,\n`data` BLOB\n);\n")
+		except _sql.OperationalError as err:
+			raise MapError("Couln't create database : {}".format(err))
+
+	def close(self):
+		if self.pool:
+			self.pool.close()
+		self.conn.close()
+
+	def opener(self):
+		return functools.partial(SQLiteBackend, self.mapfile, readonly = True, immutable = self.immutable, pool_size = 1)
+
+	def configure(self, profile = None, **settings):
+		"""
+		Tune the database connection with a connection profile
+
+		Arguments :
+		 - profile, optional, is either the name of a preset of SQLITE_PROFILES or a dictionary of settings
+		 - settings, optional, are keyword arguments overriding the settings of the profile
+		   (journal_mode, synchronous, cache_size, mmap_size, temp_store, busy_timeout)
+
+		Settings set to None are left untouched. Changing journal_mode is not possible while a transaction is pending
+
+		Note : in read-only mode, the settings also apply to the pooled connections, so configure should not
+		be called while other threads are reading
+
+		Returns a dictionary of the values in effect for the settings applied, as reported by SQLite
+		"""
+
+		if isinstance(profile, str):
+			if not profile in SQLITE_PROFILES:
+				raise MapError("Unknown connection profile : {0}".format(profile))
+			profile = SQLITE_PROFILES[profile]
+
+		applied = dict()
+		for name, value in dict(profile or {}, **settings).items():
+			if not name in SQLITE_SETTINGS:
+				raise MapError("Unknown connection setting : {0}".format(name))
+			if value is None:
+				continue
+			if not str(value).lstrip("-").isalnum():
+				raise MapError("Invalid value for {0} : {1}".format(name, value))
+
+			try:
+				self.cur.execute("PRAGMA {0} = {1}".format(name, value))
+				for conn in (self.pool.connections if self.pool else []):
+					conn.execute("PRAGMA {0} = {1}".format(name, value))
+			except _sql.OperationalError as err:
+				raise MapError("Couldn't set {0} to {1} : {2}".format(name, value, err))
+
+			applied[name] = self.get_setting(name)
+			if str(applied[name]).lower() != str(value).lower():
+				logger.warning("Connection setting {0} is {1} instead of {2}".format(name, applied[name], value))
+
+		self.settings.update(applied)
+		return applied
+
+	def get_setting(self, name):
+		"""
+		Return the value in effect for one of the connection settings (see configure)
+		"""
+
+		if not name in SQLITE_SETTINGS:
+			raise MapError("Unknown connection setting : {0}".format(name))
+
+		self.cur.execute("PRAGMA {0}".format(name))
+		row = self.cur.fetchone()
+		if row is None:
+			# Not supported for that database (eg. mmap_size for in-memory ones)
+			return None
+
+		return SQLITE_SETTINGS[name].get(row[0], row[0])
+
+	def get_settings(self):
+		return {name: self.get_setting(name) for name in SQLITE_SETTINGS}
+
+	def read(self, blockID):
+		with self.reader() as cur:
+			try:
+				cur.execute("SELECT `data` FROM `blocks` WHERE `pos` = ?", [blockID])
+			except _sql.OperationalError as err:
+				raise MapError(err)
+
+			data = cur.fetchone()
+
+		if data:
+			return data[0]
+
+	def read_many(self, blockIDs):
+		blockIDs = list(blockIDs)
+		blobs = dict()
+		with self.reader() as cur:
+			for start in range(0, len(blockIDs), SQL_CHUNK_SIZE):
+				chunk = blockIDs[start:start + SQL_CHUNK_SIZE]
+				try:
+					cur.execute("SELECT `pos`, `data` FROM `blocks` WHERE `pos` IN ({0})".format(", ".join("?" * len(chunk))), chunk)
+				except _sql.OperationalError as err:
+					raise MapError(err)
+
+				blobs.update(cur.fetchall())
+
+		return blobs
+
+	def write(self, blockID, data):
+		try:
+			self.cur.execute("REPLACE INTO `blocks` (`pos`, `data`) VALUES (?, ?)", [blockID, data])
+		except _sql.OperationalError as err:
+			raise MapError(err)
+
+	def write_many(self, items):
+		try:
+			self.cur.executemany("REPLACE INTO `blocks` (`pos`, `data`) VALUES (?, ?)", _items(items))
+		except _sql.OperationalError as err:
+			raise MapError(err)
+
+		return self.cur.rowcount
+
+	def remove(self, blockID):
+		try:
+			self.cur.execute("DELETE FROM `blocks` WHERE `pos` = ?", [blockID])
+		except _sql.OperationalError as err:
+			raise MapError(err)
+
+	def remove_all(self):
+		try:
+			self.cur.execute("DELETE from `blocks` where pos or pos == 0")
+		except _sql.OperationalError as err:
+			raise MapError("Error while removing all mapblock : {0}".format(err))
+
+	def iter_ids(self, batch_size = 1024):
+		for blockID, _ in self.iter_rows("SELECT `pos`, NULL FROM `blocks`", (), batch_size):
+			yield blockID
+
+	def iter_blocks(self, batch_size = 256, ranges = None, where = None, params = ()):
+		"""
+		Generator streaming (mapblock id, binary blob) tuples straight from a cursor, `batch_size` at a time
+
+		Arguments :
+		 - ranges, optional, see MapBackend.iter_blocks. They are looked up on the primary key
+		 - where, optional, is an SQL condition on `pos` and `data` restricting the mapblocks streamed, eg. "`pos` < ?"
+		 - params, optional, are the values bound to the placeholders of `where`
+		"""
+
+		query = "SELECT `pos`, `data` FROM `blocks`"
+		if where:
+			query += " WHERE " + where
+
+		if ranges is None:
+			yield from self.iter_rows(query, params, batch_size)
+			return
+
+		step = SQL_CHUNK_SIZE // 2
+		for start in range(0, len(ranges), step):
+			chunk = ranges[start:start + step]
+			condition = " OR ".join(["`pos` BETWEEN ? AND ?"] * len(chunk))
+			bounds = [bound for bounds in chunk for bound in bounds]
+			if where:
+				yield from self.iter_rows("{0} AND ({1})".format(query, condition), list(params) + bounds, batch_size)
+			else:
+				yield from self.iter_rows("{0} WHERE {1}".format(query, condition), bounds, batch_size)
+
+	def iter_rows(self, query, params, batch_size):
+		with self.reader() as cur:
+			try:
+				cur.execute(query, params)
+				rows = cur.fetchmany(batch_size)
+				while rows:
+					yield from rows
+					rows = cur.fetchmany(batch_size)
+			except _sql.OperationalError as err:
+				raise MapError("Error streaming mapblocks : {0}".format(err))
+
+	def commit(self):
+		self.conn.commit()
+
+	def rollback(self):
+		self.conn.rollback()
+
+class MemoryBackend(MapBackend):
+	"""
+	Map kept in a dictionary, for tests and for staging changes before writing them to another backend (see migrate)
+
+	Nothing is ever written to disk, and the map cannot be shared with worker processes
+	"""
+
+	def __init__(self, mapfile = None, readonly = False, immutable = False, pool_size = 4):
+		self.mapfile = mapfile
+		self.readonly = readonly or immutable
+		self.blocks = dict()
+		# Blobs (or None) the mapblocks modified since the last commit had at that commit
+		self.journal = dict()
+
+	def __str__(self):
+		return "memory backend"
+
+	def _check_writable(self):
+		if self.readonly:
+			raise MapError("The map is opened read-only")
+
+	def read(self, blockID):
+		return self.blocks.get(blockID)
+
+	def read_many(self, blockIDs):
+		return {blockID: self.blocks[blockID] for blockID in blockIDs if blockID in self.blocks}
+
+	def write_many(self, items):
+		self._check_writable()
+		count = 0
+		for blockID, data in _items(items):
+			self.journal.setdefault(blockID, self.blocks.get(blockID))
+			self.blocks[blockID] = bytes(data)
+			count += 1
+
+		return count
+
+	def remove(self, blockID):
+		self._check_writable()
+		if blockID in self.blocks:
+			self.journal.setdefault(blockID, self.blocks.pop(blockID))
+
+	def iter_ids(self, batch_size = 1024):
+		# Copied, so that the map can be written to while iterating
+		yield from list(self.blocks)
+
+	def iter_blocks(self, batch_size = 256, ranges = None):
+		for blockID in list(self.blocks):
+			if ranges is None or _in_ranges(blockID, ranges):
+				data = self.blocks.get(blockID)
+				if data is not None:
+					yield blockID, data
+
+	def commit(self):
+		self.journal = dict()
+
+	def rollback(self):
+		for blockID, data in self.journal.items():
+			if data is None:
+				self.blocks.pop(blockID, None)
+			else:
+				self.blocks[blockID] = data
+		self.journal = dict()
+
+class ShardedSQLiteBackend(MapBackend):
+	"""
+	Map spread over several SQLite databases (the shards) in a directory, named 0.sqlite, 1.sqlite, ...
+
+	Every shard holds the mapblocks whose id modulo the number of shards is its number (see shard_of),
+	so that bulk writes can be split by shard and done in parallel by several processes, each holding
+	the write lock of its own file only
+
+	Note : transactions are committed shard by shard, a crash during a commit can leave some shards behind
+	"""
+
+	def __init__(self, mapfile, readonly = False, immutable = False, pool_size = 4, shards = DEFAULT_SHARDS):
+		"""
+		Constructor for ShardedSQLiteBackend
+
+		Arguments :
+		 - mapfile, mandatory, is the path to the directory of the shards, created if needed
+		 - readonly, immutable, pool_size, optional, see MapVessel
+		 - shards, optional, is the number of shards of a new map. The shards of an existing map are all opened
+		"""
+
+		self.mapfile = mapfile
+		self.readonly = readonly or immutable
+		self.immutable = immutable
+
+		count = 0
+		while os.path.exists(self.get_shard_path(count)):
+			count += 1
+
+		if count == 0:
+			if self.readonly:
+				raise MapError("No shard found in {0}".format(mapfile))
+			os.makedirs(mapfile, exist_ok = True)
+			count = shards
+
+		self.shards = [SQLiteBackend(self.get_shard_path(i), readonly, immutable, pool_size) for i in range(count)]
+		logger.debug("{0} shards opened in {1}".format(count, mapfile))
+
+	def __str__(self):
+		return "sharded sqlite3 backend for {0} ({1} shards)".format(self.mapfile, len(self.shards))
+
+	def get_shard_path(self, shard):
+		return os.path.join(self.mapfile, "{0}.sqlite".format(shard))
+
+	def shard_of(self, blockID):
+		"""
+		Return the number of the shard holding the mapblock `blockID`
+		"""
+
+		return blockID % len(self.shards)
+
+	def _split(self, items):
+		split = [[] for _ in self.shards]
+		for item in items:
+			split[self.shard_of(item[0] if isinstance(item, tuple) else item)].append(item)
+
+		return zip(self.shards, split)
+
+	def create(self):
+		for shard in self.shards:
+			shard.create()
+
+	def close(self):
+		for shard in self.shards:
+			shard.close()
+
+	def opener(self):
+		return functools.partial(ShardedSQLiteBackend, self.mapfile, readonly = True, immutable = self.immutable, pool_size = 1)
+
+	def configure(self, profile = None, **settings):
+		applied = dict()
+		for shard in self.shards:
+			applied = shard.configure(profile, **settings)
+
+		return applied
+
+	def get_setting(self, name):
+		return self.shards[0].get_setting(name)
+
+	def get_settings(self):
+		return self.shards[0].get_settings()
+
+	def read(self, blockID):
+		return self.shards[self.shard_of(blockID)].read(blockID)
+
+	def read_many(self, blockIDs):
+		blobs = dict()
+		for shard, chunk in self._split(blockIDs):
+			if chunk:
+				blobs.update(shard.read_many(chunk))
+
+		return blobs
+
+	def write_many(self, items):
+		count = 0
+		for shard, chunk in self._split(_items(items)):
+			if chunk:
+				count += shard.write_many(chunk)
+
+		return count
+
+	def remove(self, blockID):
+		self.shards[self.shard_of(blockID)].remove(blockID)
+
+	def remove_all(self):
+		for shard in self.shards:
+			shard.remove_all()
+
+	def iter_ids(self, batch_size = 1024):
+		for shard in self.shards:
+			yield from shard.iter_ids(batch_size)
+
+	def iter_blocks(self, batch_size = 256, ranges = None, where = None, params = ()):
+		for shard in self.shards:
+			yield from shard.iter_blocks(batch_size, ranges, where, params)
+
+	def commit(self):
+		for shard in self.shards:
+			shard.commit()
+
+	def rollback(self):
+		for shard in self.shards:
+			shard.rollback()
+
+# Backends MapVessel can open by name
+BACKENDS = {
+	"sqlite3": SQLiteBackend,
+	"memory": MemoryBackend,
+	"sharded": ShardedSQLiteBackend,
+}
+
+def open_backend(backend, mapfile, readonly = False, immutable = False, pool_size = 4):
+	"""
+	Open the storage of a map
+
+	Arguments :
+	 - backend, mandatory, is either the name of one of BACKENDS or a MapBackend, returned as is
+	 - mapfile, readonly, immutable, pool_size, see MapVessel
+	"""
+
+	if isinstance(backend, MapBackend):
+		return backend
+
+	if not backend in BACKENDS:
+		raise MapError("Unknown backend : {0}".format(backend))
+
+	return BACKENDS[backend](mapfile, readonly = readonly, immutable = immutable, pool_size = pool_size)
+
+def migrate(source, destination, batch_size = 1000, ranges = None):
+	"""
+	Copy the mapblocks of a map into another, streaming them in batches
+
+	Arguments :
+	 - source, mandatory, is the MapVessel or MapBackend read from
+	 - destination, mandatory, is the MapVessel or MapBackend written to. Mapblocks already there are replaced
+	 - batch_size, optional, is the number of mapblocks written and committed at once
+	 - ranges, optional, restricts the copy to some mapblock ids (see MapBackend.iter_blocks)
+
+	Returns the number of mapblocks copied
+	"""
+
+	count = 0
+	batch = []
+	for item in source.iter_blocks(batch_size, ranges = ranges):
+		batch.append(item)
+		if len(batch) >= batch_size:
+			destination.write_many(batch)
+			destination.commit()
+			count += len(batch)
+			batch = []
+
+	if batch:
+		destination.write_many(batch)
+		destination.commit()
+		count += len(batch)
+
+	logger.debug("{0} mapblocks migrated".format(count))
+	return count
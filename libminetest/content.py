@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Content registry for Python-MT
+##
+##
+#
+
+from . import arrays
+
+class ContentRegistry:
+	"""
+	Registry giving every node name a global integer content id, stable for the registry's lifetime
+
+	Mapblocks each have their own name-id mappings ; translating them once into global ids (see
+	MapBlock.get_global_ids) lets whole blocks be compared and filtered as integer arrays.
+	Ids are given in registration order, so registries built from the same list of names agree
+	(which is how worker processes can share one, see save and load)
+	"""
+
+	def __init__(self, names = ()):
+		"""
+		Constructor for ContentRegistry
+
+		Arguments :
+		 - names, optional, is an iterable of node names to register first, in that order
+		"""
+
+		self.names = []
+		self.ids = {}
+		for name in names:
+			self.get_id(name)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self, name):
+		return name in self.ids
+
+	def __iter__(self):
+		return iter(self.names)
+
+	def get_id(self, name):
+		"""
+		Return the global content id of `name`, registering it if needed
+		"""
+
+		content_id = self.ids.get(name)
+		if content_id is None:
+			content_id = self.ids[name] = len(self.names)
+			self.names.append(name)
+
+		return content_id
+
+	def get_name(self, content_id):
+		return self.names[content_id]
+
+	def translate(self, name_id_mappings):
+		"""
+		Return the list translating the local content ids of a mapblock into global ones
+
+		Arguments :
+		 - name_id_mappings, mandatory, is a dictionary of names indexed by local content id
+		"""
+
+		table = [0] * (max(name_id_mappings, default = 0) + 1)
+		for content_id, name in name_id_mappings.items():
+			table[content_id] = self.get_id(name)
+
+		return table
+
+	def flags(self, names):
+		"""
+		Return a list, indexed by global content id, holding 1 for the ids of `names` and 0 elsewhere
+
+		Every name is registered first, so the list covers all the ids given so far
+		"""
+
+		ids = set(self.get_id(name) for name in names)
+		return [int(content_id in ids) for content_id in range(len(self.names))]
+
+	def isin(self, ids, names):
+		"""
+		Return a packed array as long as `ids` (an array of global content ids), holding 1 where the id
+		is the one of a name in `names`, and 0 elsewhere
+		"""
+
+		return arrays.remap(ids, self.flags(names))
+
+	def save(self, filename):
+		"""
+		Write the registered names to a file, one per line, in id order
+		"""
+
+		with open(filename, "w") as ofile:
+			ofile.write("".join(name + "\n" for name in self.names))
+
+	@classmethod
+	def load(cls, filename):
+		"""
+		Build a registry from a file written by save
+		"""
+
+		with open(filename) as ifile:
+			return cls(line.rstrip("\n") for line in ifile if line.strip())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Sidecar index of mapblock contents for Python-MT
+##
+##
+#
+
+import sqlite3 as _sql
+import hashlib
+import functools
+
+from .parallel import map_blocks
+from .errors import MapError
+from .logger import logger
+from . import arrays
+
+# Number of index rows written at once
+INDEX_BATCH_SIZE = 1000
+
+def blobHash(data):
+	"""
+	Return the hash of a mapblock's binary blob stored in the index
+	"""
+
+	return hashlib.blake2b(data, digest_size = 16).digest()
+
+def _index_mapblock(hashes, mapblock):
+	# Ran in worker processes : returns None when the blob did not change since the last scan
+	digest = blobHash(mapblock.get_blob())
+	if hashes.get(mapblock.abspos) == digest:
+		return None
+
+	contents = dict()
+	for content_id, count in arrays.counts(mapblock.param0).items():
+		name = mapblock.name_id_mappings.get(content_id, "unknown")
+		contents[name] = contents.get(name, 0) + count
+
+	return digest, contents
+
+class MapIndex:
+	"""
+	Optional SQLite database, kept next to a map, recording for every mapblock the node names
+	it contains, how many of each, and a hash of its blob
+
+	Questions like "where is this node" or "which mapblocks hold unknown nodes" are then indexed
+	queries instead of a decoding of the whole map. The index is filled and refreshed by update,
+	which only decodes the mapblocks whose blob changed since the previous update
+	"""
+
+	def __init__(self, indexfile):
+		"""
+		Constructor for MapIndex, creating the index if needed
+
+		Arguments :
+		 - indexfile, mandatory, is the path to the index database (eg. "map.sqlite.index")
+		"""
+
+		self.indexfile = indexfile
+		try:
+			self.conn = _sql.connect(indexfile)
+		except _sql.OperationalError as err:
+			raise MapError("Error opening index : {0}".format(err))
+
+		self.conn.execute("CREATE TABLE IF NOT EXISTS blocks (pos INTEGER PRIMARY KEY, hash BLOB NOT NULL)")
+		self.conn.execute("CREATE TABLE IF NOT EXISTS contents (name TEXT NOT NULL, pos INTEGER NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (name, pos)) WITHOUT ROWID")
+		self.conn.execute("CREATE INDEX IF NOT EXISTS contents_pos ON contents (pos)")
+		self.conn.commit()
+
+	def close(self):
+		self.conn.close()
+
+	def get_hashes(self):
+		"""
+		Return a dictionary of the blob hashes of the indexed mapblocks, indexed by mapblock id
+		"""
+
+		return dict(self.conn.execute("SELECT pos, hash FROM blocks"))
+
+	def update(self, vessel, ids = None, workers = None, chunk_size = 256):
+		"""
+		Bring the index up to date with a map, scanning it in parallel (see libminetest.parallel.map_blocks)
+
+		Arguments :
+		 - vessel, mandatory, is the MapVessel of the indexed map
+		 - ids, optional, is an iterable of the ids of the mapblocks to refresh. By default, the whole map is
+		   scanned, and the mapblocks that were removed from it are dropped from the index
+		 - workers, chunk_size, optional, are passed to map_blocks
+
+		Only the mapblocks whose blob hash changed are decoded and reindexed
+
+		Returns the number of mapblocks reindexed
+		"""
+
+		hashes = self.get_hashes()
+		full_scan = ids is None
+		if full_scan:
+			ids = vessel.get_all_mapblock_ids()
+
+		changed = map_blocks(vessel, functools.partial(_index_mapblock, hashes), ids = ids, workers = workers, chunk_size = chunk_size)
+		items = list(changed.items())
+		for start in range(0, len(items), INDEX_BATCH_SIZE):
+			self._write(items[start:start + INDEX_BATCH_SIZE])
+
+		if full_scan:
+			self._remove(set(hashes) - set(ids))
+
+		self.conn.commit()
+		logger.debug("{0} mapblocks reindexed".format(len(changed)))
+		return len(changed)
+
+	def _write(self, items):
+		blockIDs = [(blockID,) for blockID, _ in items]
+		self.conn.executemany("DELETE FROM contents WHERE pos = ?", blockIDs)
+		self.conn.executemany("INSERT OR REPLACE INTO blocks (pos, hash) VALUES (?, ?)",
+			((blockID, digest) for blockID, (digest, _) in items))
+		self.conn.executemany("INSERT INTO contents (name, pos, count) VALUES (?, ?, ?)",
+			((name, blockID, count) for blockID, (_, contents) in items for name, count in contents.items()))
+
+	def _remove(self, blockIDs):
+		blockIDs = [(blockID,) for blockID in blockIDs]
+		self.conn.executemany("DELETE FROM contents WHERE pos = ?", blockIDs)
+		self.conn.executemany("DELETE FROM blocks WHERE pos = ?", blockIDs)
+
+	def where(self, name):
+		"""
+		Return a dictionary of the number of `name` nodes in every mapblock holding some, indexed by mapblock id
+		"""
+
+		return dict(self.conn.execute("SELECT pos, count FROM contents WHERE name = ? ORDER BY pos", (name,)))
+
+	def get_contents(self, blockID):
+		"""
+		Return a dictionary of the number of nodes of every name in the mapblock `blockID`, indexed by name
+		"""
+
+		return dict(self.conn.execute("SELECT name, count FROM contents WHERE pos = ?", (blockID,)))
+
+	def get_names(self):
+		"""
+		Return a dictionary of the total number of nodes of every name found in the map, indexed by name
+		"""
+
+		return dict(self.conn.execute("SELECT name, SUM(count) FROM contents GROUP BY name"))
+
+	def blocks_with_unknown(self, known):
+		"""
+		Return the sorted list of the ids of the mapblocks holding nodes whose name is not in `known`
+		"""
+
+		unknown = [name for name in self.get_names() if not name in known]
+		blockIDs = set()
+		for name in unknown:
+			blockIDs.update(self.where(name))
+
+		return sorted(blockIDs)
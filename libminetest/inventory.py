@@ -9,10 +9,17 @@
 from io import StringIO
 
 from .errors import InventoryDeserializationError
-from .utils import readU8
+from .utils import readU8, BinaryReader
 
 def getSerializedInventory(strm):
     # serialized inventory
+    if isinstance(strm, BinaryReader):
+        end = strm.find(b"EndInventory\n")
+        if end < 0:
+            raise InventoryDeserializationError("No end of inventory found")
+
+        return strm.read(end + len(b"EndInventory\n") - strm.tell()).decode("latin-1")
+
     inv = "".join([chr(readU8(strm)) for _ in range(len(b"EndInventory\n"))])
     while not "EndInventory\n" in inv:
         inv += chr(readU8(strm))
@@ -72,6 +79,8 @@ def deserializeInventory(serializat):
 
 
 class ItemStack:
+    __slots__ = ("name", "count")
+
     def __init__(self, deft):
         if not deft or deft == "":
             self.name = ""
@@ -6,9 +6,8 @@
 ##
 #
 
-import sqlite3 as _sql
 import zlib
-from io import BytesIO
+from collections import OrderedDict
 import math
 import logging
 
@@ -16,9 +15,13 @@ from .errors import MapError, IgnoreContentReplacementError, EmptyMapVesselError
 from .utils import *
 from .metadata import NodeMetaRef
 from .inventory import getSerializedInventory, deserializeInventory, InvRef
-from .nodes import NodeTimerRef, Node
+from .nodes import NodeTimerRef, Node, intern_node
 from .schematics import Schematic
+from .region import Region
+from .content import ContentRegistry
+from .backends import open_backend, SQLiteBackend, ShardedSQLiteBackend, SQL_CHUNK_SIZE, SQLITE_SETTINGS
 from .logger import logger
+from . import arrays
 
 logger.debug("Map Loaded")
 
@@ -31,15 +34,144 @@ GENERATED = 8
 # Protocol Version
 PROTOCOL_VERSION = 27
 
+# Size of the pieces in which scan_mapblock inflates the sections it skips
+SCAN_CHUNK_SIZE = 4096
+
+# Attributes of the MapBlock sections that are decoded on demand
+LAZY_SECTIONS = {
+	"nodes": ("param0", "param1", "param2"),
+	"meta": ("meta_version", "node_meta"),
+	"tail": ("static_object_version", "static_object_count", "static_objects", "timestamp",
+		"name_id_mapping_version", "num_name_id_mappings", "name_id_mappings",
+		"single_timer_data_length", "timer_counts", "node_timers"),
+}
+_LAZY_FIELDS = {field: section for section, fields in LAZY_SECTIONS.items() for field in fields}
+# Position of the inflated bytes of the sections in MapBlock._sections
+_SECTION_BYTES = {"nodes": 0, "meta": 1}
+
+def _inflate(data):
+	"""
+	Decompress the zlib stream found at the start of `data` (a bytes-like object), in a single pass
+
+	Returns a tuple (decompressed bytes, data found after the end of the stream)
+	"""
+
+	decompressor = zlib.decompressobj()
+	try:
+		result = decompressor.decompress(data)
+	except zlib.error as err:
+		raise MapError("Invalid zlib stream : {0}".format(err))
+
+	if not decompressor.eof:
+		raise MapError("Truncated zlib stream")
+
+	return result, decompressor.unused_data
+
+def _skip_zlib(data):
+	"""
+	Inflate the zlib stream found at the start of `data` (a memoryview) piece by piece, dropping
+	the output, only to find where the stream ends
+
+	Returns the offset of the first byte after the stream
+	"""
+
+	decompressor = zlib.decompressobj()
+	try:
+		for start in range(0, len(data), SCAN_CHUNK_SIZE):
+			chunk = data[start:start + SCAN_CHUNK_SIZE]
+			decompressor.decompress(chunk, SCAN_CHUNK_SIZE)
+			# unconsumed_tail is left as is once the end of the stream is reached
+			while decompressor.unconsumed_tail and not decompressor.eof:
+				decompressor.decompress(decompressor.unconsumed_tail, SCAN_CHUNK_SIZE)
+
+			if decompressor.eof:
+				return start + len(chunk) - len(decompressor.unused_data)
+	except zlib.error as err:
+		raise MapError("Invalid zlib stream : {0}".format(err))
+
+	raise MapError("Truncated zlib stream")
+
+def scan_mapblock(blob):
+	"""
+	Read the palette and a few counters of a mapblock from its binary blob, without decoding it
+
+	The node data and metadata are only inflated (piece by piece, and thrown away) to find where they
+	end : no param arrays, metadata or Node objects are built, which makes audits of the node names
+	of a map much cheaper than with MapBlock
+
+	Arguments :
+	 - blob, mandatory, is the binary form of the mapblock
+
+	Returns a dictionary with the "version", "name_id_mappings" (names indexed by content id),
+	"timestamp", "static_object_count" and "timer_count" of the mapblock
+	"""
+
+	data = BinaryReader(blob)
+	version = data.readU8()
+	data.readU8() # bitmask
+	if version >= 27:
+		data.readU16() # lighting_complete
+	data.readU8() # content_width
+	data.readU8() # param_width
+
+	for _ in range(2): # Node data, then metadata
+		data.seek(data.tell() + _skip_zlib(data.view[data.tell():]))
+
+	data.readU8() # static_object_version
+	static_object_count = data.readU16()
+	for _ in range(static_object_count):
+		# u8 type, s32 pos_x_nodes, s32 pos_y_nodes, s32 pos_z_nodes, u16 data_size, u8[data_size] data
+		data.seek(data.tell() + 13)
+		size = data.readU16()
+		data.seek(data.tell() + size)
+
+	timestamp = data.readU32()
+	data.readU8() # name_id_mapping_version
+
+	name_id_mappings = dict()
+	for _ in range(data.readU16()):
+		content_id = data.readU16()
+		name_id_mappings[content_id] = data.readString16()
+
+	timer_count = 0
+	if version >= 25:
+		data.readU8() # single_timer_data_length
+		timer_count = data.readU16()
+
+	return {
+		"version": version,
+		"name_id_mappings": name_id_mappings,
+		"timestamp": timestamp,
+		"static_object_count": static_object_count,
+		"timer_count": timer_count,
+	}
+
+def _meta_value_bytes(value):
+	"""
+	Return the binary form of a metadata value
+
+	Values are usually lists of byte values (see NodeMetaRef.set_string), but can also
+	be strings or numbers, which Minetest stores as strings
+	"""
+
+	if isinstance(value, str):
+		return value.encode("utf8")
+	elif isinstance(value, (int, float)):
+		return str(value).encode("utf8")
+
+	return bytes(value)
+
 class MapBlock:
 	def __init__(self, data = None, abspos = 0):
 		self.abspos = abspos
 		self.mapblockpos = posFromInt(self.abspos, 4096)
+		self._content_ids = dict()
+		self._pending = set()
+		self.modified = False
 		logger.debug("MapBlock object initiated at {0}".format(self.mapblockpos))
 		if data:
 			self.explode(data)
 		else:
-			self.nodes = dict()
 			self.version = PROTOCOL_VERSION
 			self.mapblocksize = 16 # Normally
 			self.bitmask = GENERATED | LIGHTING_EXPIRED
@@ -51,148 +183,217 @@ class MapBlock:
 			self.static_objects = [] #u8, s32, s32, s32, u16, u8
 			self.timestamp = 0 #u32
 			self.name_id_mapping_version = 0 #u8
-			self.num_name_id_mappings = 0 #u16
-			self.name_id_mappings = dict() #u16, u8[u16]
 			self.single_timer_data_length = 10 #u8
 			self.timer_counts = 0 #u16
 			self.node_timers = dict() #u16, s32, s32
 
-			for x in range(4096):
-				# Bypass position verification
-				self.nodes[x] = Node("air")
-
-			self.name_id_mappings = self.create_name_id_mappings()
+			# Node params are kept packed, content ids index name_id_mappings
+			self.param0 = arrays.zeros("H", 4096)
+			self.param1 = arrays.zeros("B", 4096)
+			self.param2 = arrays.zeros("B", 4096)
+			self.name_id_mappings = {0: "air"} #u16, u8[u16]
 			self.num_name_id_mappings = len(self.name_id_mappings)
 
 			self.lighting_complete = 0
 
 	def set_lighting_complete(self, tbl):
 		self.lighting_complete = int("".join([str(x) for x in tbl]), base = 2)
+		self.modified = True
 
 	def get_lighting_complete(self):
 		return [(self.lighting_complete & pow(2, 15-i)) >> (15-i) for i in range(16)]
 
 	def create_name_id_mappings(self):
+		"""
+		Return the list of node names used in the mapblock, ordered by content id
+		"""
+
 		names = []
-		for node in self.nodes.values():
-			if not node.itemstring in names:
-				names.append(node.itemstring)
+		for content_id in arrays.unique(self.param0):
+			name = self.name_id_mappings[content_id]
+			if not name in names:
+				names.append(name)
 
 		return names
 
+	def get_content_id(self, name):
+		"""
+		Return the content id of `name` in the mapblock's name_id_mappings,
+		registering it with a new id if needed
+		"""
+
+		if len(self._content_ids) != len(self.name_id_mappings):
+			self._content_ids = {name: id for id, name in self.name_id_mappings.items()}
+
+		content_id = self._content_ids.get(name)
+		if content_id is None:
+			content_id = max(self.name_id_mappings, default=-1) + 1
+			self.name_id_mappings[content_id] = name
+			self._content_ids[name] = content_id
+			self.num_name_id_mappings = len(self.name_id_mappings)
+
+		return content_id
+
+	def get_global_ids(self, registry):
+		"""
+		Return the packed array (typecode "I") of the global content ids of the mapblock's nodes
+
+		Arguments :
+		 - registry, mandatory, is the `libminetest.content.ContentRegistry` giving the global ids
+		"""
+
+		return arrays.remap(arrays.astype(self.param0, "I"), registry.translate(self.name_id_mappings))
+
 	def implode(self):
-		data = BytesIO(b"")
-		writeU8(data, self.version)
-		writeU8(data, self.bitmask)
+		data = BinaryWriter()
+		data.writeU8(self.version)
+		data.writeU8(self.bitmask)
 		if self.version >= 27:
-			writeU16(data, self.lighting_complete)
-		writeU8(data, self.content_width)
-		writeU8(data, self.param_width)
+			data.writeU16(self.lighting_complete)
+		data.writeU8(self.content_width)
+		data.writeU8(self.param_width)
 
 		# Node params
-		node_data = {"param0": [], "param1": [], "param2": []}
-		self.name_id_mappings = self.create_name_id_mappings()
+		# Only the names still in use are kept, and renumbered from 0
+		palette = {name: id for id, name in enumerate(self.create_name_id_mappings())}
+		used = arrays.unique(self.param0)
+		table = [0] * (used[-1] + 1)
+		for content_id in used:
+			table[content_id] = palette[self.name_id_mappings[content_id]]
+
+		if any(table[content_id] != content_id for content_id in used):
+			self.param0 = arrays.remap(self.param0, table)
+		self.name_id_mappings = {id: name for name, id in palette.items()}
 		self.num_name_id_mappings = len(self.name_id_mappings)
+		self._content_ids = palette
 
-		for node in self.nodes.values():
-			node_data["param0"].append(self.name_id_mappings.index(node.itemstring))
-			#node_data["param0"].append(node.param0)
-			node_data["param1"].append(node.param1)
-			node_data["param2"].append(node.param2)
-
-		c_width_data = BytesIO(b"")
-		for b in node_data["param0"]:
-			writeU16(c_width_data, b)
-
-		for b in node_data["param1"]:
-			writeU8(c_width_data, b)
+		if self.content_width == 1 and len(palette) > 0x100:
+			self.content_width = 2
 
-		for b in node_data["param2"]:
-			writeU8(c_width_data, b)
+		if self.content_width == 1:
+			param0 = arrays.tobytes(arrays.astype(self.param0, "B"))
+		else:
+			param0 = arrays.tobytes(self.param0)
 
-		data.write(zlib.compress(c_width_data.getvalue()))
+		node_data = param0 + arrays.tobytes(self.param1) + arrays.tobytes(self.param2)
+		c_node_data = zlib.compress(node_data)
+		data.write(c_node_data)
 
 		# Metadata
 		# Meta version
-		meta_data = BytesIO(b"")
-		writeU8(meta_data, 1)
-		writeU16(meta_data, len(self.node_meta))
-		for meta_key in self.node_meta.keys():
-
-			meta = self.node_meta[meta_key]
-			writeU16(meta_data, meta.pos.getAsInt())
-			writeU32(meta_data, len(meta.data.keys()))
-
-			for meta_key in list(meta.data.keys()):
-				writeU16(meta_data, len(meta_key))
+		meta_data = BinaryWriter()
+		meta_data.writeU8(1)
+		meta_data.writeU16(len(self.node_meta))
+		for meta in self.node_meta.values():
+			meta_data.writeU16(meta.pos.getAsInt())
+			meta_data.writeU32(len(meta.data))
 
-				for b in meta_key:
-					writeU8(meta_data, ord(b))
+			for meta_key, value in meta.data.items():
+				meta_data.writeString16(meta_key)
 
-				writeU32(meta_data, len(meta.data[meta_key]))
-				for b in meta.data[meta_key]:
-					writeU8(meta_data, b)
+				value = _meta_value_bytes(value)
+				meta_data.writeU32(len(value))
+				meta_data.write(value)
 
-			for c in meta.get_inventory().to_string():
-				meta_data.write(c.encode("utf8"))
+			meta_data.write(meta.get_inventory().to_string().encode("utf8"))
 
-		data.write(zlib.compress(meta_data.getvalue()))
+		c_meta_data = zlib.compress(meta_data.buffer)
+		data.write(c_meta_data)
 
 		# Static object version
-		writeU8(data, 0)
-		writeU16(data, self.static_object_count)
+		data.writeU8(0)
+		data.writeU16(self.static_object_count)
 
 		for obj in self.static_objects:
-			writeU8(data, obj["type"])
-			writeU32(data, obj["pos"].x * 1000) # Should be S32 but it has the same result
-			writeU32(data, obj["pos"].y * 1000)
-			writeU32(data, obj["pos"].z * 1000)
-			writeU16(data, len(obj["data"]))
-			for b in obj["data"]:
-				writeU8(data, ord(b))
+			data.writeU8(obj["type"])
+			# Rounded, as positions were divided by 10000 when read and truncating would drift them
+			data.writeS32(round((obj["pos"].x - self.mapblockpos.x) * 10000))
+			data.writeS32(round((obj["pos"].y - self.mapblockpos.y) * 10000))
+			data.writeS32(round((obj["pos"].z - self.mapblockpos.z) * 10000))
+			data.writeString16(obj["data"])
 
 		# Last time it was modified
-		writeU32(data, self.timestamp)
+		data.writeU32(self.timestamp)
 
 		# ID mappings starts here
-		writeU8(data, self.name_id_mapping_version)
+		data.writeU8(self.name_id_mapping_version)
 		self.num_name_id_mappings = len(self.name_id_mappings)
-		writeU16(data, self.num_name_id_mappings)
+		data.writeU16(self.num_name_id_mappings)
 		for i in range(self.num_name_id_mappings):
-			writeU16(data, i)
-			writeU16(data, len(self.name_id_mappings[i]))
-			for b in self.name_id_mappings[i]:
-				writeU8(data, ord(b))
+			data.writeU16(i)
+			data.writeString16(self.name_id_mappings[i])
 
 		# Node timers
-		writeU8(data, self.single_timer_data_length) # Always 2+4+4=10
-		writeU16(data, len(self.node_timers))
+		data.writeU8(self.single_timer_data_length) # Always 2+4+4=10
+		data.writeU16(len(self.node_timers))
 		for timer in self.node_timers.values():
-			writeU16(data, timer.pos.getAsInt())
-			writeU32(data, int(timer.timeout * 1000))
-			writeU32(data, int(timer.elapsed * 1000))
+			data.writeU16(timer.pos.getAsInt())
+			data.writeU32(int(timer.timeout * 1000))
+			data.writeU32(int(timer.elapsed * 1000))
 
 		# EOF.
-		return data.getvalue()
+		blob = data.getvalue()
+		self._inflated_size = len(blob) - len(c_node_data) - len(c_meta_data) + len(node_data) + len(meta_data.buffer)
+		return blob
 
 	def check_pos(self, mapblockpos):
 		if mapblockpos < 0 or mapblockpos >= 4096:
 			raise OutOfBordersCoordinates("Invalid position : " + str(mapblockpos))
 
-	def get_node(self, mapblockpos):
+	def get_node(self, mapblockpos, interned = False):
+		"""
+		Return a Node built from the params stored at `mapblockpos`
+
+		Arguments :
+		 - interned, optional, is a boolean ; when True, the shared read-only node (without position)
+		   from `libminetest.nodes.intern_node` is returned instead of a new one
+
+		Note : the Node is a copy, changes made to it are only stored by calling set_node
+		"""
+
 		self.check_pos(mapblockpos)
+		if interned:
+			return intern_node(self.name_id_mappings[self.param0[mapblockpos]], int(self.param1[mapblockpos]), int(self.param2[mapblockpos]))
+
+		pos = posFromInt(mapblockpos, self.mapblocksize) + self.mapblockpos
+
+		return Node(self.name_id_mappings[self.param0[mapblockpos]],
+			param1 = int(self.param1[mapblockpos]),
+			param2 = int(self.param2[mapblockpos]),
+			pos = pos)
 
-		return self.nodes[mapblockpos]
+	def clear_node_data(self, indexes):
+		"""
+		Drop the metadata and timers of some nodes of the mapblock
+
+		Arguments :
+		 - indexes, mandatory, is an iterable of indexes of nodes in the mapblock (see Pos.getAsInt)
+
+		Returns the number of metadata and timers dropped
+		"""
+
+		indexes = set(indexes)
+		removed = 0
+		for table in (self.node_meta, self.node_timers):
+			# Keys are indexes, or (x, y, z) tuples for timers and old metadata
+			for key in [key for key in table if (key if isinstance(key, int) else Pos(*key).getAsInt()) in indexes]:
+				del table[key]
+				removed += 1
+
+		if removed:
+			self.modified = True
+
+		return removed
 
 	def set_node(self, mapblockpos, node):
 		self.check_pos(mapblockpos)
 
-		if self.node_meta.get(mapblockpos):
-			del self.node_meta[mapblockpos]
-		if self.node_timers.get(mapblockpos):
-			del self.node_timers[mapblockpos]
+		self.clear_node_data((mapblockpos,))
 
-		self.nodes[mapblockpos] = node
+		self.param0[mapblockpos] = self.get_content_id(node.get_name())
+		self.param1[mapblockpos] = node.get_param1()
+		self.param2[mapblockpos] = node.get_param2()
+		self.modified = True
 
 		return True
 
@@ -200,76 +401,162 @@ class MapBlock:
 		self.set_node(self, mapblockpos, node)
 
 	def explode(self, bytelist):
-		data = BytesIO(bytelist)
+		"""
+		Load the mapblock from its binary form
+
+		Only the fixed header is parsed here. Node data, metadata and the trailing
+		sections (static objects, name-id mappings, timers) are decoded the first
+		time one of their attributes is accessed
+		"""
+
+		data = BinaryReader(bytelist)
 
 		self.mapblocksize = 16 # Normally
-		self.version = readU8(data)
-		self.bitmask = readU8(data)
+		self.version = data.readU8()
+		self.bitmask = data.readU8()
 		if self.version >= 27:
-			self.lighting_complete = readU16(data)
-		self.content_width = readU8(data)
-		self.param_width = readU8(data)
-
-		self.nodes = dict()
-		node_data = dict()
-
-		k = b""
-		while True:
-			oldklen = len(k)
-			k += data.read(1)
-
-			try:
-				c_width_data = BytesIO(zlib.decompress(k))
-			except zlib.error as err:
-				if len(k) > oldklen:
-					continue
-			else:
-				break
+			self.lighting_complete = data.readU16()
+		self.content_width = data.readU8()
+		self.param_width = data.readU8()
+
+		self._blob = bytelist
+		self._body_offset = data.tell()
+		self._sections = None
+		self._inflated_size = None
+
+		for fields in LAZY_SECTIONS.values():
+			for field in fields:
+				self.__dict__.pop(field, None)
+		self._pending = set(LAZY_SECTIONS)
+
+		self.modified = False
+		self.loaded = True
+
+	def __getattr__(self, name):
+		# Only reached for missing attributes, ie. those of sections not decoded yet
+		section = _LAZY_FIELDS.get(name)
+		if section is None or section not in self.__dict__.get("_pending", ()):
+			raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+		self.decode_section(section)
+		return getattr(self, name)
+
+	def get_blob(self):
+		"""
+		Return the binary form of the mapblock
+
+		That is the blob it was read from as long as it is kept (until all the sections are decoded)
+		and the mapblock was not modified, and the result of implode otherwise
+		"""
+
+		blob = self.__dict__.get("_blob")
+		if blob is not None and not self.modified:
+			return blob
 
-		node_data["param0"] = []
-		for _ in range(4096):
-			if self.content_width == 1:
-				b = readU8(c_width_data)
+		return self.implode()
+
+	def get_inflated_size(self):
+		"""
+		Return the size the binary form of the mapblock last returned by get_blob has with its node
+		data and metadata not compressed
+
+		The size is recorded when these sections are inflated (for the lazy decoding) or compressed
+		(by implode), so that this never inflates them a second time
+		"""
+
+		if self.__dict__.get("_inflated_size") is None:
+			if self.__dict__.get("_blob") is not None and not self.modified:
+				self._locate_sections()
 			else:
-				b = readU16(c_width_data)
+				self.implode()
+
+		return self._inflated_size
+
+	def decode_section(self, section):
+		"""
+		Decode one of the lazily loaded sections of the mapblock
 
-			node_data["param0"].append(int(b))
+		Arguments :
+		 - section, mandatory, is one of "nodes", "meta" or "tail"
+
+		Note : attributes of the section that were set before it got decoded are kept
+		"""
 
-		node_data["param1"] = [ int(b) for b in c_width_data.read(4096) ]
-		node_data["param2"] = [ int(b) for b in c_width_data.read(4096) ]
+		if section not in self._pending:
+			return
 
+		self._pending.discard(section)
+		preset = {field: self.__dict__[field] for field in LAZY_SECTIONS[section] if field in self.__dict__}
 		try:
-			assert(len(node_data["param0"]) == 4096)
-			assert(len(node_data["param1"]) == 4096)
-			assert(len(node_data["param2"]) == 4096)
-		except AssertionError:
+			getattr(self, "_explode_" + section)()
+		except Exception:
+			self._pending.add(section)
+			raise
+
+		self.__dict__.update(preset)
+
+		if not self._pending:
+			# Everything is decoded, the binary form is not needed anymore
+			self._blob = None
+			self._sections = None
+		elif section in _SECTION_BYTES and self._sections is not None:
+			# Neither are the inflated bytes of the section
+			self._sections[_SECTION_BYTES[section]] = None
+
+	def decode_all(self):
+		"""
+		Decode all the sections of the mapblock that are not decoded yet
+		"""
+
+		for section in list(self._pending):
+			self.decode_section(section)
+
+	def _locate_sections(self):
+		"""
+		Inflate the node data and metadata, and find the offset of the trailing sections
+
+		Returns a list [node data, metadata, offset]. The bytes of the sections already decoded are None
+		"""
+
+		if self._sections is None:
+			c_width_data, rest = _inflate(memoryview(self._blob)[self._body_offset:])
+			node_meta_list, rest = _inflate(rest)
+			self._sections = [c_width_data, node_meta_list, len(self._blob) - len(rest)]
+			self._inflated_size = len(rest) + self._body_offset + len(c_width_data) + len(node_meta_list)
+
+		return self._sections
+
+	def _explode_nodes(self):
+		c_width_data = self._locate_sections()[0]
+
+		# Node params, stored as packed arrays
+		p0_size = 4096 * self.content_width
+		if len(c_width_data) != p0_size + 2 * 4096:
 			raise InvalidParamLengthError()
 
-		k = b""
-		while True:
-			oldklen = len(k)
-			k += data.read(1)
+		if self.content_width == 1:
+			self.param0 = arrays.astype(arrays.frombytes("B", c_width_data[:p0_size]), "H")
+		else:
+			self.param0 = arrays.frombytes("H", c_width_data[:p0_size])
+
+		self.param1 = arrays.frombytes("B", c_width_data[p0_size:p0_size + 4096])
+		self.param2 = arrays.frombytes("B", c_width_data[p0_size + 4096:])
 
-			try:
-				node_meta_list = BytesIO(zlib.decompress(k))
-			except zlib.error as err:
-				if len(k) > oldklen:
-					continue
-			else:
-				break
+	def _explode_meta(self):
+		node_meta_list = BinaryReader(self._locate_sections()[1])
 
 		self.node_meta = dict()
 		if self.version <= 22:
-			self.meta_version = readU16(node_meta_list)
-			metadata_count = readU16(node_meta_list)
+			self.meta_version = node_meta_list.readU16()
+			metadata_count = node_meta_list.readU16()
 
 			for i in range(metadata_count):
-				pos = posFromInt(readU16(node_meta_list), self.mapblocksize).getAsTuple()
+				pos = posFromInt(node_meta_list.readU16(), self.mapblocksize).getAsTuple()
 				self.node_meta[pos] = NodeMetaRef(pos)
 
-				type_id = readU16(node_meta_list)
-				c_size = readU16(node_meta_list)
-				meta = [readU8(node_meta_list) for _ in range(c_size)]
+				type_id = node_meta_list.readU16()
+				c_size = node_meta_list.readU16()
+				meta = list(node_meta_list.view_bytes(c_size))
 
 				if type_id == 1:
 					# It is "generic" metadata
@@ -278,42 +565,42 @@ class MapBlock:
 					self.node_meta[pos].get_inventory().from_list(getSerializedInventory(node_meta_list))
 
 					# u8[u32 len] text
-					self.node_meta[pos].set_raw("text", "".join([ readU8(node_meta_list) for _ in range(readU32(node_meta_list))]))
+					self.node_meta[pos].set_raw("text", node_meta_list.readString32())
 
 					# u8[u16 len] owner
-					self.node_meta[pos].set_raw("owner", "".join([ readU8(node_meta_list) for _ in range(readU16(node_meta_list))]))
+					self.node_meta[pos].set_raw("owner", node_meta_list.readString16())
 
 					# u8[u16 len] infotext
-					self.node_meta[pos].set_raw("infotext", "".join([ readU8(node_meta_list) for _ in range(readU16(node_meta_list))]))
+					self.node_meta[pos].set_raw("infotext", node_meta_list.readString16())
 
 					# u8[u16 len] inventory_drawspec
-					self.node_meta[pos].set_raw("formspec", "".join([ readU8(node_meta_list) for _ in range(readU16(node_meta_list))]))
+					self.node_meta[pos].set_raw("formspec", node_meta_list.readString16())
 
 					# u8 allow_text_input
-					self.node_meta[pos].set_raw("allow_text_input", readU8(node_meta_list))
+					self.node_meta[pos].set_raw("allow_text_input", node_meta_list.readU8())
 
 					# u8 removeal_disabled
-					self.node_meta[pos].set_raw("removal_disabled", readU8(node_meta_list))
+					self.node_meta[pos].set_raw("removal_disabled", node_meta_list.readU8())
 
 					# u8 enforce_owner
-					self.node_meta[pos].set_raw("enforce_owner", readU8(node_meta_list))
+					self.node_meta[pos].set_raw("enforce_owner", node_meta_list.readU8())
 
 					# u32 num_vars
-					num_vars = readU32(node_meta_list)
+					num_vars = node_meta_list.readU32()
 
 					for _ in range(num_vars):
 						# u8 [u16 len] name
-						name = [readU8(node_meta_list) for _ in range(readU16(node_meta_list))]
+						name = node_meta_list.readString16()
 
 						# u8 [u32 len] value
-						value = [readU8(node_meta_list) for _ in range(readU32(node_meta_list))]
+						value = list(node_meta_list.view_bytes(node_meta_list.readU32()))
 
 						self.node_meta[pos].set_raw(name, value)
 
 				elif type_id == 14:
 					# Sign metadata
 					# u8 [u16 text_len] text
-					self.node_meta[pos].set_raw("text", "".join([ readU8(node_meta_list) for _ in range(readU16(node_meta_list)) ]))
+					self.node_meta[pos].set_raw("text", node_meta_list.readString16())
 
 				elif type_id == 15 or type_id == 16:
 					# Chest metadata
@@ -330,7 +617,7 @@ class MapBlock:
 					# Locked Chest metadata
 
 					# u8 [u16 len] owner
-					self.node_meta[pos].set_raw("owner", "".join([ readU8(node_meta_list) for _ in range(readU16(node_meta_list)) ]))
+					self.node_meta[pos].set_raw("owner", node_meta_list.readString16())
 
 					# serialized inventory
 					self.node_meta[pos].get_inventory().from_string(getSerializedInventory(node_meta_list))
@@ -339,7 +626,7 @@ class MapBlock:
 					raise UnknownMetadataTypeIDError("Unknown metadata type ID: {0}".format(type_id))
 
 		else:
-			self.meta_version = readU8(node_meta_list)
+			self.meta_version = node_meta_list.readU8()
 			if self.meta_version == 0:# and self.bitmask & GENERATED == 0:
 				# Mapblock was probably not generated
 				# It is CONTENT_IGNORE
@@ -348,99 +635,89 @@ class MapBlock:
 				pass
 
 			else:
-				metadata_count = readU16(node_meta_list)
+				metadata_count = node_meta_list.readU16()
 
 				for _ in range(metadata_count):
-					posObj = posFromInt(readU16(node_meta_list), self.mapblocksize)
+					posObj = posFromInt(node_meta_list.readU16(), self.mapblocksize)
 					pos = posObj.getAsInt()
 					self.node_meta[pos] = NodeMetaRef(posObj)
 
-					num_vars = readU32(node_meta_list)
+					num_vars = node_meta_list.readU32()
 					for _ in range(num_vars):
-						key_len = readU16(node_meta_list)
-						key = "".join([chr(readU8(node_meta_list)) for _ in range(key_len)])
-
-						val_len = readU32(node_meta_list)
-						val = [readU8(node_meta_list) for _ in range(val_len)]
+						key = node_meta_list.readString16()
+						val = list(node_meta_list.view_bytes(node_meta_list.readU32()))
 						self.node_meta[pos].set_raw(key, val)
 
 					self.node_meta[pos].get_inventory().from_string(getSerializedInventory(node_meta_list))
 
+	def _explode_tail(self):
+		data = BinaryReader(self._blob, self._locate_sections()[2])
+
 		# We skip node_timers for now, not used in v23, v24 never released, and v25 has them later
 
 		# u8 static_object_version
-		self.static_object_version = readU8(data)
+		self.static_object_version = data.readU8()
 
 		# u16 static_object_count
-		self.static_object_count = readU16(data)
+		self.static_object_count = data.readU16()
 
 		self.static_objects = []
 		for _ in range(self.static_object_count):
 			# u8 type
-			otype = readU8(data)
+			otype = data.readU8()
 
 			# s32 pos_x_nodes
-			pos_x_nodes = readS32(data) / 10000
+			pos_x_nodes = data.readS32() / 10000
 
 			# s32 pos_y_nodes
-			pos_y_nodes = readS32(data) / 10000
+			pos_y_nodes = data.readS32() / 10000
 
 			# s32 pos_z_nodes
-			pos_z_nodes = readS32(data) / 10000
+			pos_z_nodes = data.readS32() / 10000
 
 
 			# u8 [u16 data_size] data
-			odata = [ readU8(data) for _ in range(readU16(data)) ]
+			odata = data.readString16()
 
 			self.static_objects.append({
 				"type": otype,
 				"pos": Pos(pos_x_nodes + self.mapblockpos.x,pos_y_nodes + self.mapblockpos.y, pos_z_nodes + self.mapblockpos.z),
-				"data": str(odata),
+				"data": odata,
 			})
 
 		# u32 timestamp
-		self.timestamp = readU32(data)
+		self.timestamp = data.readU32()
 
 		# u8 name_id_mapping_version
-		self.name_id_mapping_version = readU8(data)
+		self.name_id_mapping_version = data.readU8()
 
 		# u16 num_name_id_mappings
-		self.num_name_id_mappings = readU16(data)
+		self.num_name_id_mappings = data.readU16()
 
 		self.name_id_mappings = dict()
 		for _ in range(self.num_name_id_mappings):
 			# u16 id, u8 [u16 name_len] name
-			id = readU16(data)
-			name = "".join([ chr(readU8(data)) for _ in range(readU16(data)) ])
+			id = data.readU16()
+			name = data.readString16()
 			self.name_id_mappings[id] = name
 
+		self.single_timer_data_length = 10
+		self.timer_counts = 0
+		self.node_timers = dict()
 		if self.version >= 25:
 			# u8 single_timer_data_length
-			self.single_timer_data_length = readU8(data)
+			self.single_timer_data_length = data.readU8()
 
 			# u16 num_of_timers
-			self.timer_counts = readU16(data)
+			self.timer_counts = data.readU16()
 
 			self.node_timers = dict()
 			for _ in range(self.timer_counts):
-				pos = posFromInt(readU16(data), 16).getAsTuple()
-				timeout = readS32(data) / 1000
-				elapsed = readS32(data) / 1000
+				pos = posFromInt(data.readU16(), 16).getAsTuple()
+				timeout = data.readS32() / 1000
+				elapsed = data.readS32() / 1000
 				self.node_timers[pos] = NodeTimerRef(Pos(0, 0, 0).fromTuple(pos), timeout, elapsed)
 
-		for id in range(4096):
-			itemstring = self.name_id_mappings[node_data["param0"][id]]
-			param1 = node_data["param1"][id]
-			param2 = node_data["param2"][id]
-			pos = posFromInt(id, self.mapblocksize)
-			pos.x += self.mapblockpos.x
-			pos.z += self.mapblockpos.z
-			pos.y += self.mapblockpos.y
-			self.nodes[id] = Node(itemstring, param1 = param1, param2 = param2, pos = pos)
-
-		# EOF!
-		self.loaded = True
-
 	def get_meta(self, abspos):
 		self.check_pos(abspos)
 
@@ -465,61 +742,167 @@ class MapBlock:
 			raise MapError("Invalid bitmask : {}".format(bitmask))
 
 		self.bitmask = bitmask
+		self.modified = True
 
 
 """
 	MapVessel
 """
 class MapVessel:
-	def __init__(self, mapfile, backend = "sqlite3"):
+	def __init__(self, mapfile, backend = "sqlite3", profile = None, readonly = False, immutable = False, pool_size = 4):
+		"""
+		Constructor for MapVessel
+
+		Arguments :
+		 - mapfile, mandatory, is the path to the map's database (see libminetest.backends for what it is to other backends)
+		 - backend, optional, is either the name of a backend of libminetest.backends.BACKENDS ("sqlite3",
+		   "memory" or "sharded") or a MapBackend object
+		 - profile, optional, is a connection profile (see configure)
+		 - readonly, optional, opens the database in read-only mode : no write lock is ever taken,
+		   and reads are spread over a pool of connections so that several threads can read at once
+		 - immutable, optional, tells SQLite that nothing (not even a server) will change the database
+		   while it is open, which skips locking altogether. Implies readonly
+		 - pool_size, optional, is the maximum number of connections opened for reading in read-only mode
+		"""
+
 		self.mapfile = mapfile
-		self.open(mapfile, backend)
+		self.readonly = readonly or immutable
+		self.immutable = immutable
+		self.pool_size = pool_size
+		self.open(mapfile, backend, profile)
 
 	def __str__(self):
 		return "mapfile vessel for {0}".format(self.mapfile)
 
 	@classmethod
-	def create(cls, path):
-		k = cls(path)
-		try:
-			k.cur.execute("CREATE TABLE IF NOT EXISTS `blocks` (\n`pos` INT PRIMARY KEY,\n`data` BLOB\n);\n")
-
-		except _sql.OperationalError as err:
-			raise MapError("Couln't create database : {}".format(err))
-
+	def create(cls, path, profile = None, backend = "sqlite3"):
+		k = cls(path, backend, profile = profile)
+		k.backend.create()
 		return k
 
 	def get_all_mapblock_ids(self):
-		try:
-			self.cur.execute("SELECT \"pos\" from \"blocks\"")
-		except _sql.OperationalError as err:
-			raise MapError("Error retrieving all mapblock pos : {0}".format(err))
+		return list(self.backend.iter_ids())
+
+	def iter_mapblock_ids(self, batch_size = 1024):
+		"""
+		Generator streaming the ids of all the mapblocks of the map, fetched `batch_size` at a time
+		"""
 
-		return [id[0] for id in self.cur.fetchall()]
+		return self.backend.iter_ids(batch_size)
 
-	def open(self, mapfile, backend = "sqlite3"):
-		try:
-			self.conn = _sql.connect(mapfile)#, 10)
-			self.cur = self.conn.cursor()
-		except _sql.OperationalError as err:
-			raise MapError("Error opening database : {0}".format(err))
+	def iter_blocks(self, batch_size = 256, where = None, params = (), decode = False, ranges = None):
+		"""
+		Generator streaming the mapblocks of the map straight from the backend, `batch_size` at a time
+
+		Arguments :
+		 - batch_size, optional, is the number of mapblocks fetched at once
+		 - where, optional, is an SQL condition on `pos` and `data` restricting the mapblocks streamed, eg. "`pos` < ?".
+		   Only the SQLite backends support it
+		 - params, optional, are the values bound to the placeholders of `where`
+		 - decode, optional, yields (lazily decoded) MapBlock objects instead of (mapblock id, binary blob) tuples
+		 - ranges, optional, is a list of (lowest id, highest id) tuples restricting the mapblocks streamed
+
+		Note : the map should not be written to until the iteration is over
+		"""
+
+		if where:
+			if not isinstance(self.backend, (SQLiteBackend, ShardedSQLiteBackend)):
+				raise MapError("SQL conditions are not supported by {0}".format(self.backend))
+			blocks = self.backend.iter_blocks(batch_size, ranges, where = where, params = params)
+		else:
+			blocks = self.backend.iter_blocks(batch_size, ranges = ranges)
+
+		for blockID, data in blocks:
+			if decode:
+				yield MapBlock(data, abspos = blockID)
+			else:
+				yield blockID, data
+
+	def scan_blocks(self, batch_size = 256, where = None, params = ()):
+		"""
+		Generator streaming the palette and counters of the mapblocks of the map (see scan_mapblock)
+
+		Arguments are the same as iter_blocks'. Yields (mapblock id, dictionary) tuples
+		"""
+
+		for blockID, data in self.iter_blocks(batch_size, where, params):
+			yield blockID, scan_mapblock(data)
+
+	def blocks_in_area(self, minp, maxp, batch_size = 256, decode = False):
+		"""
+		Generator streaming the mapblocks that exist in an area of the map
+
+		The area is turned into ranges of mapblock ids (see getMapBlockRanges), looked up on the
+		database's primary key, so that only mapblocks that exist are ever fetched
+
+		Arguments :
+		 - minp, mandatory, is the Pos of a corner of the area, in nodes
+		 - maxp, mandatory, is the Pos of the opposite corner, in nodes
+		 - batch_size, optional, is the number of mapblocks fetched at once
+		 - decode, optional, yields (lazily decoded) MapBlock objects instead of (mapblock id, binary blob) tuples
+		"""
+
+		ranges = getMapBlockRanges(determineMapBlock(minp), determineMapBlock(maxp))
+		yield from self.iter_blocks(batch_size = batch_size, decode = decode, ranges = ranges)
+
+	def open(self, mapfile, backend = "sqlite3", profile = None):
+		self.backend = open_backend(backend, mapfile, readonly = self.readonly, immutable = self.immutable, pool_size = self.pool_size)
+
+		if profile:
+			self.configure(profile)
+
+	def configure(self, profile = None, **settings):
+		"""
+		Tune the database connection with a connection profile
+
+		See libminetest.backends.SQLiteBackend.configure. Backends other than the SQLite ones have no settings
+		"""
+
+		return self.backend.configure(profile, **settings)
+
+	def get_setting(self, name):
+		"""
+		Return the value in effect for one of the connection settings (see configure)
+		"""
+
+		if not name in SQLITE_SETTINGS:
+			raise MapError("Unknown connection setting : {0}".format(name))
+
+		return self.backend.get_setting(name)
+
+	def get_settings(self):
+		"""
+		Return a dictionary of the values in effect for all the connection settings
+		"""
+
+		return self.backend.get_settings()
 
 	def close(self):
-		self.conn.close()
+		self.backend.close()
 		self.mapblocks = None
 		self.mapfile = None
 		self.cache = dict()
 
 	def read(self, blockID):
-		try:
-			self.cur.execute("SELECT * from blocks where pos = {0}".format(blockID))
-		except _sql.OperationalError as err:
-			raise MapError(err)
-
-		data = self.cur.fetchall()
-		if len(data) == 1:
+		data = self.backend.read(blockID)
+		if data:
 			logger.debug("Binary blob for mapblock {0} read".format(blockID))
-			return data[0][1]
+			return data
+
+	def read_many(self, blockIDs):
+		"""
+		Read the binary blobs of several mapblocks, using as few queries as possible
+
+		Arguments :
+		 - blockIDs, mandatory, is an iterable of mapblock ids
+
+		Returns a dictionary of binary blobs, indexed by mapblock id. Mapblocks that do not exist are left out
+		"""
+
+		blockIDs = list(blockIDs)
+		blobs = self.backend.read_many(blockIDs)
+		logger.debug("Binary blobs for {0} out of {1} mapblocks read".format(len(blobs), len(blockIDs)))
+		return blobs
 
 	def load(self, blockID):
 		data = self.read(blockID)
@@ -530,23 +913,70 @@ class MapVessel:
 		logger.debug("Building mapblock {0} from binary blob".format(blockID))
 		return MapBlock(data, abspos = blockID)
 
-	def write(self, blockID, data):
-		try:
-			self.cur.execute("REPLACE INTO `blocks` (`pos`, `data`) VALUES ({0}, ?)".format(blockID), [data])
+	def load_many(self, blockIDs):
+		"""
+		Build several mapblocks, reading their binary blobs with read_many
 
-		except _sql.OperationalError as err:
-			raise MapError(err)
+		Returns a dictionary of MapBlock objects, indexed by mapblock id
+		"""
+
+		return {blockID: MapBlock(data, abspos = blockID) for blockID, data in self.read_many(blockIDs).items()}
+
+	def write(self, blockID, data):
+		self.backend.write(blockID, data)
 		logger.debug("Binary blob for mapblock {0} written".format(blockID))
 
+	def write_many(self, items):
+		"""
+		Write the binary blobs of several mapblocks with a single statement
+
+		Arguments :
+		 - items, mandatory, is either a dictionary of binary blobs indexed by mapblock id,
+		   or an iterable of (mapblock id, binary blob) tuples
+
+		Note : Like with write, changes are part of the current transaction until commit() is called
+		"""
+
+		count = self.backend.write_many(items)
+		logger.debug("Binary blobs for {0} mapblocks written".format(count))
+
+	def map_blocks(self, fn, ids = None, workers = None, reduce = None, initial = None, chunk_size = 256):
+		"""
+		Run `fn` on many mapblocks, spread over a pool of worker processes
+
+		See libminetest.parallel.map_blocks
+		"""
+
+		from .parallel import map_blocks
+		return map_blocks(self, fn, ids = ids, workers = workers, reduce = reduce, initial = initial, chunk_size = chunk_size)
+
+	def stats(self, minp = None, maxp = None, layer_height = 16, workers = None, chunk_size = 256):
+		"""
+		Compute node histograms by Y layer and mapblock statistics, for the whole map or a box of it
+
+		See libminetest.stats.map_stats
+		"""
+
+		from .stats import map_stats
+		return map_stats(self, minp, maxp, layer_height = layer_height, workers = workers, chunk_size = chunk_size)
+
 	def commit(self):
 		logger.debug("Committing on database")
-		self.conn.commit()
+		self.backend.commit()
+
+	def rollback(self):
+		logger.debug("Rolling back changes to database")
+		self.backend.rollback()
+
+	def transaction(self):
+		"""
+		Context manager committing the writes made in it, or rolling them back if an exception is raised
+		"""
+
+		return self.backend.transaction()
 
 	def remove(self, blockID):
-		try:
-			self.cur.execute("DELETE FROM `blocks` WHERE `pos` = ?", [blockID])
-		except _sql.OperationalError as err:
-			raise MapError(err)
+		self.backend.remove(blockID)
 
 	def empty_map(self):
 		"""
@@ -555,17 +985,23 @@ class MapVessel:
 		"""
 
 		logger.warning("WARNING: Emptying the entire map of its mapblocks")
-		try:
-			self.cur.execute("DELETE from `blocks` where pos or pos == 0")
-		except _sql.OperationalError as err:
-			raise MapError("Error while removing all mapblock : {0}".format(err))
+		self.backend.remove_all()
+
+class LRUCache:
+	"""
+	Mapping kept in least-recently-used order, with O(1) touch and eviction
+
+	Hits, misses and evictions are counted
+	"""
 
-class StackCache:
 	def __init__(self):
-		self.data = []
+		self.data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
 
-	def __contains__(self, val):
-		return val in self.data
+	def __contains__(self, key):
+		return key in self.data
 
 	def __delitem__(self, key):
 		self.remove(key)
@@ -573,6 +1009,9 @@ class StackCache:
 	def __getitem__(self, key):
 		return self.data[key]
 
+	def __setitem__(self, key, val):
+		self.add(key, val)
+
 	def __iter__(self):
 		return self.data.__iter__()
 
@@ -580,28 +1019,62 @@ class StackCache:
 		return len(self.data)
 
 	def __str__(self):
-		return str(self.data)
+		return str(list(self.data.keys()))
+
+	def get(self, key, default = None):
+		"""
+		Return the value stored for `key` (or `default`), marking it as the most recently used
+		"""
+
+		val = self.data.get(key)
+		if val is None:
+			self.misses += 1
+			return default
+
+		self.hits += 1
+		self.data.move_to_end(key)
+		return val
 
-	def add(self, elem):
-		while elem in self.data:
-			self.data.remove(elem)
-		self.data.append(elem)
+	def add(self, key, val):
+		self.data[key] = val
+		self.data.move_to_end(key)
 
-	def remove(self, elem):
-		while elem in self.data:
-			self.data.remove(elem)
+	def touch(self, key):
+		self.data.move_to_end(key)
+
+	def remove(self, key):
+		self.data.pop(key, None)
+
+	def oldest(self):
+		"""
+		Return the least recently used key
+		"""
+
+		return next(iter(self.data))
+
+	def evict(self):
+		"""
+		Remove the least recently used entry, and return it as a (key, value) tuple
+		"""
 
-	def flush(self, elem):
-		self.data = []
+		self.evictions += 1
+		return self.data.popitem(last = False)
+
+	def flush(self):
+		self.data.clear()
+
+	def get_stats(self):
+		return {"size": len(self.data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
 
 class MapInterface:
-	def __init__(self, datafile, backend = "sqlite3"):
+	def __init__(self, datafile, backend = "sqlite3", profile = None, readonly = False):
 		self.datafile = datafile
-		self.container = MapVessel(datafile, backend)
+		self.container = MapVessel(datafile, backend, profile, readonly = readonly)
 		self.max_cache_size = 100
-		self.mapblocks = dict()
-		self.cache_history = StackCache()
-		self.mod_cache = StackCache()
+		self.mapblocks = LRUCache()
+		self.mod_cache = set()
+		# Global content ids for this session, see get_global_ids
+		self.content = ContentRegistry()
 
 
 	# Cache stuff
@@ -609,7 +1082,7 @@ class MapInterface:
 		self.mod_cache.add(mapblockid)
 
 	def unflag_mod(self, mapblockid):
-		self.mod_cache.remove(mapblockid)
+		self.mod_cache.discard(mapblockid)
 
 	def set_maxcachesize(self, size):
 		if type(size) != type(0):
@@ -622,16 +1095,28 @@ class MapInterface:
 	def get_maxcachesize(self):
 		return self.max_cache_size
 
+	def get_cache_stats(self):
+		"""
+		Return a dictionary of the cache's size, hits, misses, evictions and number of modified mapblocks
+		"""
+
+		stats = self.mapblocks.get_stats()
+		stats["dirty"] = len(self.mod_cache)
+		return stats
+
 	def check_cache(self):
 		while len(self.mapblocks) > self.max_cache_size:
-			logger.debug("Removing mapblock {0} from cache to create space".format(self.cache_history[0]))
-			self.unload_mapblock(self.cache_history[0])
+			blockID = self.mapblocks.oldest()
+			logger.debug("Removing mapblock {0} from cache to create space".format(blockID))
+			if blockID in self.mod_cache:
+				self.save_mapblock(blockID)
+			self.mapblocks.evict()
 
 	def flush_cache(self):
 		self.save()
-		while len(self.cache_history) > 0:
-			logger.debug("Removing mapblock {id} for cache flush".format(id=self.cache_history[0]))
-			self.unload_mapblock(self.cache_history[0])
+		for blockID in list(self.mapblocks):
+			logger.debug("Removing mapblock {id} for cache flush".format(id=blockID))
+			self.unload_mapblock(blockID)
 
 	# Mapblock loading/unloading
 	def load_mapblock(self, blockID):
@@ -641,8 +1126,7 @@ class MapInterface:
 			logger.debug("Mapblock is None")
 			return False
 
-		self.mapblocks[blockID] = data
-		self.cache_history.add(blockID)
+		self.mapblocks.add(blockID, data)
 		self.check_cache()
 		return True
 
@@ -651,25 +1135,23 @@ class MapInterface:
 			logger.debug("Unloading and saving mapblock at pos {0}".format(blockID))
 			self.save_mapblock(blockID)
 
-		self.cache_history.remove(blockID)
-		del self.mapblocks[blockID]
+		self.mapblocks.remove(blockID)
 
 	def save_mapblock(self, blockID):
-		if not self.mapblocks.get(blockID):
+		if not blockID in self.mapblocks:
 			return False
 
 		logger.debug("Saving block at pos {0} {1}".format(blockID, posFromInt(blockID, 4096)))
 		self.container.write(blockID, self.mapblocks[blockID].implode())
 
-		self.mod_cache.remove(blockID)
+		self.mod_cache.discard(blockID)
 
 		return True
 
 	def init_mapblock(self, mapblockpos):
 		logger.debug("Init mapblock at {0}".format(str(mapblockpos)))
-		self.mapblocks[mapblockpos] = MapBlock(abspos = mapblockpos)
+		self.mapblocks.add(mapblockpos, MapBlock(abspos = mapblockpos))
 		self.mod_cache.add(mapblockpos)
-		self.cache_history.add(mapblockpos)
 		self.check_cache()
 
 	# Node interface stuff
@@ -679,13 +1161,27 @@ class MapInterface:
 
                 return True
 
-	def get_node(self, pos):
+	def get_node(self, pos, interned = False):
 		mapblock = determineMapBlock(pos)
 		mapblockpos = getMapBlockPos(mapblock)
 		if not self.check_for_pos(mapblockpos):
-			return Node("ignore", pos = pos)
+			return intern_node("ignore") if interned else Node("ignore", pos = pos)
+
+		return self.mapblocks[mapblockpos].get_node(Pos(pos.x % 16, pos.y % 16, pos.z % 16).getAsInt(), interned)
+
+	def get_global_ids(self, mapblockpos):
+		"""
+		Return the packed array of the global content ids (see self.content) of the nodes of a mapblock,
+		or None if it does not exist
+
+		Arguments :
+		 - mapblockpos, mandatory, is the id of the mapblock
+		"""
+
+		if not self.check_for_pos(mapblockpos):
+			return
 
-		return self.mapblocks[mapblockpos].get_node(Pos(pos.x % 16, pos.y % 16, pos.z % 16).getAsInt())
+		return self.mapblocks[mapblockpos].get_global_ids(self.content)
 
 	def set_node(self, pos, node):
                 mapblock = determineMapBlock(pos)
@@ -693,7 +1189,7 @@ class MapInterface:
                 if not self.check_for_pos(mapblockpos):
                         raise IgnoreContentReplacementError("Pos: {0}".format(pos))
 
-                node.pos = pos
+                # The node passed is left untouched : it may be shared (see intern_node)
                 self.flag_mod(mapblockpos)
 
                 return self.mapblocks[mapblockpos].set_node(Pos(pos.x % 16, pos.y % 16, pos.z % 16).getAsInt(), node)
@@ -710,6 +1206,135 @@ class MapInterface:
 
 		return self.mapblocks[mapblockpos].get_meta(pos.getAsInt())
 
+	# Bulk region stuff
+	def read_region(self, minp, maxp):
+		"""
+		Read a box of the map into a Region, mapblock by mapblock
+
+		Arguments :
+		 - minp, mandatory, is the Pos of a corner of the box, in nodes
+		 - maxp, mandatory, is the Pos of the opposite corner
+
+		Nodes of mapblocks that do not exist are left as "ignore".
+		Mapblocks that are not in the cache are read without being added to it
+
+		Returns a `libminetest.region.Region` object
+		"""
+
+		region = Region(minp, maxp)
+		blockposs = {getMapBlockPos(blockpos): blockpos for blockpos in region.mapblocks()}
+		uncached = [blockID for blockID in blockposs if not blockID in self.mapblocks]
+
+		for blockID in blockposs:
+			if blockID in self.mapblocks:
+				self._read_region_mapblock(region, blockposs[blockID], self.mapblocks[blockID])
+
+		for start in range(0, len(uncached), SQL_CHUNK_SIZE):
+			for blockID, data in self.container.read_many(uncached[start:start + SQL_CHUNK_SIZE]).items():
+				self._read_region_mapblock(region, blockposs[blockID], MapBlock(data, abspos = blockID))
+
+		return region
+
+	def _read_region_mapblock(self, region, blockpos, mapblock):
+		# Translate the mapblock's content ids into the region's palette once
+		table = [0] * (max(mapblock.name_id_mappings, default = 0) + 1)
+		for content_id, name in mapblock.name_id_mappings.items():
+			table[content_id] = region.get_content_id(name)
+		param0 = arrays.remap(mapblock.param0, table)
+
+		for block_index, region_index, length in region.block_rows(blockpos):
+			arrays.blit(region.param0, region_index, param0, block_index, length)
+			arrays.blit(region.param1, region_index, mapblock.param1, block_index, length)
+			arrays.blit(region.param2, region_index, mapblock.param2, block_index, length)
+
+	def write_region(self, region, replace = None, keep_meta = True):
+		"""
+		Write the nodes of a Region back into the map, mapblock by mapblock
+
+		Arguments :
+		 - region, mandatory, is the `libminetest.region.Region` to write
+		 - replace, optional, is a collection of node names ; when given, only the nodes of the map
+		   with one of those names are replaced
+		 - keep_meta, optional, is a boolean ; unless it is True, the metadata and timers of the nodes
+		   replaced are dropped, like set_node does. They are kept by default, like Minetest's VoxelManip does
+
+		Nodes that are "ignore" in the region are left untouched in the map. Mapblocks that do not
+		exist are initialized (filled with air, which `replace` must then hold) if the region has
+		something else than "ignore" to put in them. Only the mapblocks whose nodes actually change are flagged as modified
+
+		Returns the number of mapblocks changed
+		"""
+
+		written = 0
+		for blockpos in region.mapblocks():
+			if self._write_region_mapblock(region, blockpos, replace, keep_meta):
+				written += 1
+
+		return written
+
+	def _write_region_mapblock(self, region, blockpos, replace = None, keep_meta = True):
+		rows = list(region.block_rows(blockpos))
+		if not any(any(region.param0[start:start + length]) for _, start, length in rows):
+			return False
+
+		blockID = getMapBlockPos(blockpos)
+		mapblock = None
+		if self.check_for_pos(blockID):
+			mapblock = self.mapblocks[blockID]
+		elif replace is not None and not ("air" in replace or "ignore" in replace):
+			# A missing mapblock would be created full of air, which may not be replaced
+			return False
+
+		# Flag the content ids of the mapblock which may be replaced
+		replaceable = None
+		if mapblock is not None and replace is not None:
+			replaceable = [0] * (max(mapblock.name_id_mappings, default = 0) + 1)
+			for content_id, name in mapblock.name_id_mappings.items():
+				replaceable[content_id] = int(name in replace)
+
+		# Rows of the region, with the nodes that may not be replaced set to "ignore"
+		masked = []
+		for block_index, region_index, length in rows:
+			row = region.param0[region_index:region_index + length]
+			if replaceable is not None:
+				row = arrays.masked(row, arrays.remap(mapblock.param0[block_index:block_index + length], replaceable))
+			masked.append(row)
+
+		if not any(any(row) for row in masked):
+			return False
+
+		# New mapblocks are stored even if the nodes written match the air they are filled with
+		changed = mapblock is None
+		if mapblock is None:
+			self.init_mapblock(blockID)
+			mapblock = self.mapblocks[blockID]
+		table = [0] + [mapblock.get_content_id(name) for name in region.palette[1:]]
+
+		# Indexes of the nodes replaced, only needed to drop their metadata and timers
+		replaced = None
+		if not keep_meta and (mapblock.node_meta or mapblock.node_timers):
+			replaced = []
+
+		for (block_index, region_index, length), row in zip(rows, masked):
+			if replaced is not None:
+				replaced.extend(block_index + i for i, content_id in enumerate(row) if content_id)
+
+			for dst, src in ((mapblock.param0, arrays.remap(row, table)), (mapblock.param1, region.param1[region_index:region_index + length]),
+					(mapblock.param2, region.param2[region_index:region_index + length])):
+				before = arrays.copy(dst[block_index:block_index + length])
+				arrays.blit(dst, block_index, src, 0, length, skip = 0, key = row)
+				changed = changed or not arrays.equal(before, dst[block_index:block_index + length])
+
+		if replaced and mapblock.clear_node_data(replaced):
+			changed = True
+
+		if not changed:
+			return False
+
+		mapblock.modified = True
+		self.flag_mod(blockID)
+		return True
+
 	# The schematics stuff
 	def export_schematic(self, startpos, endpos, ignore=[], forceplace=True):
 		"""
@@ -720,94 +1345,76 @@ class MapInterface:
 		 - endpos, mandatory, is the position of the corner of the square to be exported opposed to startpos
 		 - ignore, optional, is a keyword argument which should contain a list of nodes to ignore when exporting
 		   (they will be referenced to as ignore)
+		 - forceplace, optional, is a boolean, whether the exported nodes are force-placed by Minetest
+
+		The area is read mapblock by mapblock (see read_region), both corners included.
+		Nodes of mapblocks that do not exist are exported as ignore
 
 		Returns a `libminetest.schematics.Schematic` object
 		"""
 
-		# Get the corners first
-		minpos = Pos(min(startpos.x, endpos.x), min(startpos.y, endpos.y), min(startpos.z, endpos.z))
-		maxpos = Pos(max(startpos.x, endpos.x), max(startpos.y, endpos.y), max(startpos.z, endpos.z))
-
-		schem = {}
-		schem["size"] = {"x": maxpos.x - minpos.x, "y": maxpos.y - minpos.y, "z": maxpos.z - minpos.y}
-		schem["data"] = {}
-		k = schem["size"]["x"] * schem["size"]["y"] * schem["size"]["z"]
-		for x in range(schem["size"]["x"]):
-			for y in range(schem["size"]["y"]):
-				for z in range(schem["size"]["z"]):
-					name = self.get_node(Pos(minpos.x + x, minpos.y + y, minpos.z + z)).get_name()
-					pct = (1 + z + (y * schem["size"]["z"]) + (x * schem["size"]["z"] * schem["size"]["y"])) / k * 100
-					pctstr = "[{0:3.5f}%] Getting nodes..".format(pct)
-					if name in ignore:
-						name = "ignore"
-
-					schem["data"][x + (y * schem["size"]["x"]) + (z * schem["size"]["y"] * schem["size"]["x"])] = {
-						"name": name,
-						"prob": 255,
-						"force_place": forceplace
-					}
-					logger.debug(pctstr)
+		region = self.read_region(startpos, endpos)
+
+		# Ignored nodes are sent to the region's id 0, which is "ignore"
+		table = [0 if name in ignore else content_id for content_id, name in enumerate(region.palette)]
+		param0 = arrays.remap(region.param0, table) if ignore else region.param0
 
 		sch = Schematic()
-		sch.serialize_schematic(schem)
+		sch.load_arrays(region.size, region.palette, param0,
+			arrays.full("B", region.volume, 255 if forceplace else 127), region.param2)
 
 		return sch
 
-	def import_schematic(self, pos, schematic, ignore=[], forceplace = False, stage_save=0):
-                """
+	def import_schematic(self, pos, schematic, ignore=[], forceplace = False, stage_save=0, keep_meta = False):
+		"""
 		Imports a schematic into the currently loaded map
 
 		Arguments :
 		 - pos, mandatory, is the position at which the schematic will be loaded
 		 - schematic, mandatory, is a Schematic object holding the schematic that will be loaded
 		 - ignore, optional, is a list of node names to ignore when loading the schematic ; those nodes will not be placed
-		 - forceplace, optional, is a boolean, prevent placing nodes over anything that is not air
-                 - stage_save, optional, is an interval of percentage at the end of which the current progress is saved (used for gigantic imports)
-                """
-
-                k = schematic.size["x"] * schematic.size["y"] * schematic.size["z"]
-                tenth = 0
-                for y in range(schematic.size["y"]):
-                        for x in range(schematic.size["x"]):
-                                for z in range(schematic.size["z"]):
-                                        v = Vector()
-                                        rpos = Pos(x, y, z)
-                                        pct = (1 + z + (x * schematic.size["z"]) + (y * schematic.size["z"] * schematic.size["x"])) / k * 100
-                                        node = schematic.get_node(rpos)
-                                        if node.get_name() == "ignore" or node.get_name() in ignore:
-                                                continue
-
-                                        vpos = v.add(pos, rpos)
-                                        pctstr = "[{0:3.5f}%] Placing nodes..".format(pct)
-                                        while True:
-                                                try:
-                                                        if not forceplace:
-                                                                oldnode = self.get_node(vpos)
-                                                                if oldnode.get_name() != "air" and oldnode.get_name() != "ignore":
-                                                                        break
-
-                                                        self.set_node(vpos, node)
-                                                        break
-
-                                                except IgnoreContentReplacementError:
-                                                        self.init_mapblock(getMapBlockPos(determineMapBlock(v.add(pos, rpos))))
-                                                        continue
-
-                                        logger.debug(pctstr)
-                                        if stage_save and int(pct/stage_save) != tenth:
-                                                tenth = int(pct/stage_save)
-                                                logger.debug("Saving partial import at {0:3.5f}%..".format(pct))
-                                                logger.debug("{0} mapblocks to save".format(len(self.mod_cache)))
-                                                self.save()
+		 - forceplace, optional, is a boolean ; unless it is True, nodes are only placed over air and ignore
+		 - stage_save, optional, is an interval of percentage at the end of which the current progress is saved (used for gigantic imports)
+		 - keep_meta, optional, is a boolean ; unless it is True, the metadata and timers of the nodes replaced are dropped
 
+		The schematic is cut into the mapblocks it covers, each of them being loaded (or initialized)
+		and written once. Like Minetest does, param1 (light) of the placed nodes is reset to 0
+
+		Returns the number of mapblocks written to
+		"""
+
+		region = Region(pos, Pos(pos.x + schematic.size["x"] - 1, pos.y + schematic.size["y"] - 1, pos.z + schematic.size["z"] - 1))
+
+		# Schematic palette ids are shifted by one, the region's id 0 being "ignore"
+		table = [0 if name == "ignore" or name in ignore else region.get_content_id(name) for name in schematic.nodes]
+		region.param0 = arrays.remap(schematic.param0, table)
+		region.param2 = arrays.copy(schematic.param2)
+
+		replace = None if forceplace else ("air", "ignore")
+		blocks = list(region.mapblocks())
+		written = 0
+		stage = 0
+		for done, blockpos in enumerate(blocks, 1):
+			if self._write_region_mapblock(region, blockpos, replace, keep_meta):
+				written += 1
+
+			pct = done / len(blocks) * 100
+			if stage_save and int(pct / stage_save) != stage:
+				stage = int(pct / stage_save)
+				logger.debug("Saving partial import at {0:3.5f}%..".format(pct))
+				self.save()
+
+		return written
 
 	# Method to save
 	def save(self):
 		logger.debug("Saving..")
-		while len(self.mod_cache) > 0:
-			logger.debug("{0} mapblocks left to save".format(len(self.mod_cache)))
-			u = self.mod_cache[0]
-			self.save_mapblock(u)
-			self.unload_mapblock(u)
+		modified = [blockID for blockID in self.mod_cache if blockID in self.mapblocks]
+		logger.debug("{0} mapblocks to save".format(len(modified)))
+		self.container.write_many((blockID, self.mapblocks[blockID].implode()) for blockID in modified)
+
+		for blockID in modified:
+			self.mapblocks.remove(blockID)
+		self.mod_cache.clear()
 
 		self.container.commit()
@@ -8,9 +8,44 @@
 
 from .utils import Pos
 
+# Interned nodes, indexed by (name, param1, param2)
+_interned = {}
+
+# Maximum number of interned nodes kept, the table being emptied when it is full
+INTERNED_MAX = 1 << 16
+
+def intern_node(name, param1 = 0, param2 = 0):
+    """
+    Return the shared, read-only node with the given name and params (see FrozenNode)
+
+    Identical nodes all being the same object, this saves a lot of memory when many nodes are
+    kept around. Call `copy` on the result to get a node that can be modified
+
+    Note : at most INTERNED_MAX nodes are kept. Past that, the table starts over : nodes interned
+    before stay valid, but are not the objects returned afterwards for the same name and params
+    """
+
+    key = (name, param1, param2)
+    node = _interned.get(key)
+    if node is None:
+        if len(_interned) >= INTERNED_MAX:
+            clear_interned()
+        node = _interned[key] = FrozenNode(name, param1 = param1, param2 = param2)
+
+    return node
+
+def clear_interned():
+    """
+    Forget all the interned nodes (see intern_node), eg. after a long scan
+    """
+
+    _interned.clear()
+
 class NodeTimerRef:
-    def __init__(self, pos = Pos(0, 0, 0), timeout = 0.0, elapsed = 0.0):
-        self.pos = pos
+    __slots__ = ("pos", "timeout", "elapsed", "active")
+
+    def __init__(self, pos = None, timeout = 0.0, elapsed = 0.0):
+        self.pos = pos if pos is not None else Pos(0, 0, 0)
         self.timeout = timeout
         self.elapsed = elapsed
         self.active = False
@@ -35,8 +70,10 @@ class NodeTimerRef:
         return self.active
 
 class Node:
-    def __init__(self, itemstring, param0 = 0, param1 = 0, param2 = 0, pos = Pos(0, 0, 0)):
-        self.pos = pos
+    __slots__ = ("pos", "itemstring", "param0", "param1", "param2")
+
+    def __init__(self, itemstring, param0 = 0, param1 = 0, param2 = 0, pos = None):
+        self.pos = pos if pos is not None else Pos(0, 0, 0)
         self.itemstring = itemstring
         self.param0, self.param1, self.param2 = param0, param1, param2
 
@@ -75,3 +112,25 @@ class Node:
 
     def set_pos(self, pos):
         self.pos = pos
+
+    def copy(self):
+        return Node(self.itemstring, self.param0, self.param1, self.param2, pos = self.pos)
+
+class FrozenNode(Node):
+    """
+    Read-only Node shared between all the identical nodes (see intern_node)
+
+    Interned nodes carry no position, get_pos returns None
+    """
+
+    __slots__ = ()
+
+    def __init__(self, itemstring, param0 = 0, param1 = 0, param2 = 0):
+        for name, value in (("pos", None), ("itemstring", itemstring), ("param0", param0), ("param1", param1), ("param2", param2)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Interned nodes are read-only, copy them first")
+
+    def copy(self):
+        return Node(self.itemstring, self.param0, self.param1, self.param2)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Parallel map processing for Python-MT
+##
+##
+#
+
+import multiprocessing
+from itertools import islice
+
+from .map import MapVessel, MapBlock
+from .errors import MapError
+from .logger import logger
+
+# Number of modified mapblocks written (and committed) at once
+WRITE_BATCH_SIZE = 1000
+
+# State of a worker process, set by _init_worker
+_worker = dict()
+
+def _init_worker(opener, fn):
+	_worker["vessel"] = MapVessel(None, backend = opener(), readonly = True, pool_size = 1)
+	_worker["fn"] = fn
+
+def _run_chunk(blockIDs):
+	"""
+	Decode a chunk of mapblocks and run the callback on each of them, in a worker process
+
+	Returns a list of (mapblock id, result, binary blob of the mapblock if it was modified or None) tuples
+	"""
+
+	results = []
+	for blockID, data in _worker["vessel"].read_many(blockIDs).items():
+		mapblock = MapBlock(data, abspos = blockID)
+		result = _worker["fn"](mapblock)
+		results.append((blockID, result, mapblock.implode() if mapblock.modified else None))
+
+	return results
+
+def _chunks(ids, size):
+	ids = iter(ids)
+	chunk = list(islice(ids, size))
+	while chunk:
+		yield chunk
+		chunk = list(islice(ids, size))
+
+def map_blocks(vessel, fn, ids = None, workers = None, reduce = None, initial = None, chunk_size = 256):
+	"""
+	Run `fn` on many mapblocks, spread over a pool of worker processes
+
+	Each worker opens the map read-only, decodes the mapblocks and calls `fn(mapblock)` on them.
+	Mapblocks that `fn` modified (see MapBlock.modified, set by set_node) are sent back and
+	written by this process only, through `vessel`, and committed every WRITE_BATCH_SIZE mapblocks
+
+	Arguments :
+	 - vessel, mandatory, is the MapVessel of the map to process
+	 - fn, mandatory, is the callback ran on every MapBlock. It has to be picklable (eg. a module-level function
+	   or a functools.partial of one), and so do its results
+	 - ids, optional, is an iterable of the ids of the mapblocks to process, all the mapblocks of the map by default
+	 - workers, optional, is the number of worker processes, as many as CPUs by default. With 0, everything
+	   runs in the current process, which is the only way to process maps that cannot be shared between processes
+	   (see MapBackend.opener), like in-memory ones
+	 - reduce, optional, is a function `reduce(accumulator, result)` returning the new accumulator
+	 - initial, optional, is the initial value of the accumulator
+	 - chunk_size, optional, is the number of mapblocks handed to a worker at once
+
+	Returns the final accumulator if `reduce` is provided, otherwise a dictionary of the results that are
+	not None, indexed by mapblock id
+
+	Note : with a rollback journal, readers and the writer can make each other wait, use the "WAL"
+	journal_mode (see MapVessel.configure) for jobs that modify a lot of mapblocks
+	"""
+
+	if ids is None:
+		ids = vessel.get_all_mapblock_ids()
+
+	acc = initial if reduce else dict()
+	modified = dict()
+	written = 0
+
+	opener = vessel.backend.opener()
+	if workers == 0:
+		_worker["vessel"] = vessel
+		_worker["fn"] = fn
+		chunk_results = map(_run_chunk, _chunks(ids, chunk_size))
+		pool = None
+	elif opener is None:
+		raise MapError("{0} cannot be shared with worker processes, use workers = 0".format(vessel.backend))
+	else:
+		pool = multiprocessing.Pool(workers, _init_worker, (opener, fn))
+		chunk_results = pool.imap_unordered(_run_chunk, _chunks(ids, chunk_size))
+
+	try:
+		for results in chunk_results:
+			for blockID, result, data in results:
+				if reduce:
+					acc = reduce(acc, result)
+				elif result is not None:
+					acc[blockID] = result
+
+				if data is not None:
+					modified[blockID] = data
+
+			if len(modified) >= WRITE_BATCH_SIZE:
+				written += _flush(vessel, modified)
+
+		written += _flush(vessel, modified)
+
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+		_worker.clear()
+
+	logger.debug("{0} modified mapblocks written".format(written))
+	return acc
+
+def _flush(vessel, modified):
+	if not modified:
+		return 0
+
+	if vessel.readonly:
+		raise MapError("Mapblocks were modified but the map is opened read-only")
+
+	count = len(modified)
+	vessel.write_many(modified)
+	vessel.commit()
+	modified.clear()
+	return count
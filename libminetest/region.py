@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Regions for Python-MT
+##
+##
+#
+
+from .utils import Pos, determineMapBlock
+from .nodes import Node, intern_node
+from .errors import OutOfBordersCoordinates
+from . import arrays
+
+class Region:
+	"""
+	Dense copy of a box of the map, like Minetest's VoxelManip (see MapInterface.read_region and write_region)
+
+	Nodes are stored in packed arrays indexed like Minetest's VoxelArea (x first, then y, then z).
+	param0 holds ids into `palette`, the list of node names, in which id 0 is always "ignore"
+	"""
+
+	def __init__(self, minp, maxp):
+		"""
+		Constructor for Region, filled with "ignore"
+
+		Arguments :
+		 - minp, mandatory, is the Pos of a corner of the box, in nodes
+		 - maxp, mandatory, is the Pos of the opposite corner
+		"""
+
+		self.minp = Pos(min(minp.x, maxp.x), min(minp.y, maxp.y), min(minp.z, maxp.z))
+		self.maxp = Pos(max(minp.x, maxp.x), max(minp.y, maxp.y), max(minp.z, maxp.z))
+		self.size = {
+			"x": self.maxp.x - self.minp.x + 1,
+			"y": self.maxp.y - self.minp.y + 1,
+			"z": self.maxp.z - self.minp.z + 1,
+		}
+		self.volume = self.size["x"] * self.size["y"] * self.size["z"]
+
+		self.param0 = arrays.zeros("H", self.volume)
+		self.param1 = arrays.zeros("B", self.volume)
+		self.param2 = arrays.zeros("B", self.volume)
+		self.palette = ["ignore"]
+		self._content_ids = {"ignore": 0}
+
+	def __str__(self):
+		return "region from {0} to {1}".format(self.minp, self.maxp)
+
+	def contains(self, pos):
+		return self.minp.x <= pos.x <= self.maxp.x and self.minp.y <= pos.y <= self.maxp.y and self.minp.z <= pos.z <= self.maxp.z
+
+	def index(self, pos):
+		"""
+		Return the index in the param arrays of the node at `pos` (in map coordinates)
+		"""
+
+		if not self.contains(pos):
+			raise OutOfBordersCoordinates("{0} is not in {1}".format(pos, self))
+
+		return ((pos.z - self.minp.z) * self.size["y"] + pos.y - self.minp.y) * self.size["x"] + pos.x - self.minp.x
+
+	def get_content_id(self, name):
+		"""
+		Return the id of `name` in the palette, adding it if needed
+		"""
+
+		content_id = self._content_ids.get(name)
+		if content_id is None:
+			content_id = len(self.palette)
+			self.palette.append(name)
+			self._content_ids[name] = content_id
+
+		return content_id
+
+	def get_node(self, pos, interned = False):
+		i = self.index(pos)
+		if interned:
+			return intern_node(self.palette[self.param0[i]], int(self.param1[i]), int(self.param2[i]))
+
+		return Node(self.palette[self.param0[i]], param1 = int(self.param1[i]), param2 = int(self.param2[i]), pos = pos)
+
+	def set_node(self, pos, node):
+		i = self.index(pos)
+		self.param0[i] = self.get_content_id(node.get_name())
+		self.param1[i] = node.get_param1()
+		self.param2[i] = node.get_param2()
+
+	def mapblocks(self):
+		"""
+		Generator of the positions (in mapblocks) of all the mapblocks the region covers
+		"""
+
+		minblock, maxblock = determineMapBlock(self.minp), determineMapBlock(self.maxp)
+		for z in range(minblock.z, maxblock.z + 1):
+			for y in range(minblock.y, maxblock.y + 1):
+				for x in range(minblock.x, maxblock.x + 1):
+					yield Pos(x, y, z)
+
+	def block_rows(self, blockpos):
+		"""
+		Generator of the rows (along X) shared by the region and a mapblock
+
+		Arguments :
+		 - blockpos, mandatory, is the Pos of the mapblock, in mapblocks
+
+		Yields (index in the mapblock, index in the region, length) tuples
+		"""
+
+		lo = [max(self.minp.x, blockpos.x * 16), max(self.minp.y, blockpos.y * 16), max(self.minp.z, blockpos.z * 16)]
+		hi = [min(self.maxp.x, blockpos.x * 16 + 15), min(self.maxp.y, blockpos.y * 16 + 15), min(self.maxp.z, blockpos.z * 16 + 15)]
+		length = hi[0] - lo[0] + 1
+		if length <= 0:
+			return
+
+		for z in range(lo[2], hi[2] + 1):
+			for y in range(lo[1], hi[1] + 1):
+				block_index = (z % 16) * 256 + (y % 16) * 16 + lo[0] % 16
+				region_index = ((z - self.minp.z) * self.size["y"] + y - self.minp.y) * self.size["x"] + lo[0] - self.minp.x
+				yield block_index, region_index, length
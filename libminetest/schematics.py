@@ -6,14 +6,19 @@
 ##
 #
 
-from .nodes import Node
-from .utils import readU16, readU8, readU32, writeU16, writeU8, writeU32
+from .nodes import Node, intern_node
+from .utils import Pos, BinaryReader, BinaryWriter
+from . import arrays
 from .logger import logger
-from .errors import InvalidSchematicSignature
+from .errors import SchematicError, InvalidSchematicSignature, OutOfBordersCoordinates
 
 import zlib
+import mmap
 from io import BytesIO
 
+# Size of the pieces of compressed data inflated at once
+INFLATE_CHUNK_SIZE = 1 << 16
+
 # See :
 # https://github.com/minetest/minetest/blob/master/src/mg_schematic.cpp#L339
 # https://github.com/minetest/minetest/blob/master/src/mapnode.cpp#L548
@@ -46,26 +51,80 @@ foreach size_x * size_y * size_z:
 	u8 param2
 """
 
+# param2 lookup tables used by the transforms, see Minetest's MapNode::rotateAlongYAxis
+# Facedir values after a 90 degrees rotation around Y (+X going to -Z, like Minetest's "90" schematic rotation)
+FACEDIR_ROTATE_Y = [1, 2, 3, 0, 13, 14, 15, 12, 17, 18, 19, 16, 9, 10, 11, 8, 5, 6, 7, 4, 23, 20, 21, 22]
+# Facedir values after a flip along each axis, assuming nodes are symmetrical left to right (like stairs)
+FACEDIR_FLIP = {
+	"x": [0, 3, 2, 1, 4, 7, 6, 5, 8, 11, 10, 9, 16, 19, 18, 17, 12, 15, 14, 13, 20, 23, 22, 21],
+	"y": [20, 23, 22, 21, 6, 5, 4, 7, 10, 9, 8, 11, 12, 15, 14, 13, 16, 19, 18, 17, 0, 3, 2, 1],
+	"z": [2, 1, 0, 3, 10, 9, 8, 11, 6, 5, 4, 7, 14, 13, 12, 15, 18, 17, 16, 19, 22, 21, 20, 23],
+}
+# Same for wallmounted values (0 = +Y, 1 = -Y, 2 = +X, 3 = -X, 4 = +Z, 5 = -Z)
+WALLMOUNTED_ROTATE_Y = [0, 1, 5, 4, 2, 3, 6, 7]
+WALLMOUNTED_FLIP = {
+	"x": [0, 1, 3, 2, 4, 5, 6, 7],
+	"y": [1, 0, 2, 3, 4, 5, 6, 7],
+	"z": [0, 1, 2, 3, 5, 4, 6, 7],
+}
+
 # Definitions
 
+def _inflate_into(data, targets):
+	"""
+	Inflate the zlib stream `data` piece by piece, filling the writable memoryviews of `targets` one after the other
+	"""
+
+	inflater = zlib.decompressobj()
+	pieces = iter(range(0, len(data), INFLATE_CHUNK_SIZE))
+	chunk = b""
+	for target in targets:
+		filled = 0
+		while filled < len(target):
+			if not chunk:
+				# unconsumed_tail is left as is once the end of the stream is reached
+				if inflater.eof:
+					raise SchematicError("Bulk node data is too short")
+				elif inflater.unconsumed_tail:
+					piece = inflater.unconsumed_tail
+				else:
+					start = next(pieces, None)
+					if start is None:
+						raise SchematicError("Bulk node data is truncated")
+					piece = data[start:start + INFLATE_CHUNK_SIZE]
+
+				try:
+					chunk = inflater.decompress(piece, INFLATE_CHUNK_SIZE)
+				except zlib.error as err:
+					raise SchematicError("Bulk node data is corrupted : {0}".format(err))
+
+			length = min(len(chunk), len(target) - filled)
+			target[filled:filled + length] = chunk[:length]
+			chunk = chunk[length:]
+			filled += length
+
+		target.release()
+
+
 class Schematic:
 	"""
 	Class representing a schematic (loaded from a file, built from an import, etc),
 	made to manage the said schematic (import from and export to a file, map)
 	"""
-	def __init__(self, filename = None):
+	def __init__(self, filename = None, header_only = False):
 		"""
 		Initialization function for the Schematic object
 
 		Arguments :
 		 - filename, optional, is a path to a file to load the schematic from (if provided)
+		 - header_only, optional, is a boolean, only read the header of the file (see load_from_file)
 		"""
 
 		self.filename = filename
 		self.loaded = False
 		self._init_data()
 		if self.filename:
-			self.load_from_file(filename)
+			self.load_from_file(filename, header_only)
 
 	def _init_data(self):
 		"""
@@ -76,59 +135,77 @@ class Schematic:
 		self.size = {}
 		self.y_slice_probs = {}
 		self.nodes = []
-		self.data = {}
+		self._content_ids = {}
+
+		# Node params, param0 holding indexes in self.nodes
+		self.param0 = arrays.zeros("H", 0)
+		self.param1 = arrays.zeros("B", 0)
+		self.param2 = arrays.zeros("B", 0)
 
 	def load(self, data):
-                """
-	        Load a schematic from a provided BytesIO object
+		"""
+		Load a schematic from a provided BytesIO object
 
-	        Arguments :
-	         - data, mandatory, is the BytesIO object from which to load the schematic
+		Arguments :
+		 - data, mandatory, is the BytesIO object from which to load the schematic
 		"""
 
-                self._init_data()
-                self.loaded = False
+		self._load_buffer(data.read())
 
-                try:
-                        assert(data.read(4) == b"MTSM")
-                except AssertionError:
-                        logger.error("{0} : Couldn't load schematic from data : invalid signature".format(self))
-                        data.seek(0)
-                        raise InvalidSchematicSignature("First 4 bytes read are : {}".format(data.read(4)))
+	def _load_buffer(self, buffer, header_only = False):
+		self._init_data()
+		self.loaded = False
 
-                self.version = readU16(data)
-                self.size = {"x": readU16(data), "y": readU16(data), "z": readU16(data)}
+		data = BinaryReader(buffer)
+		try:
+			self._load_header(data)
+			if header_only:
+				return
+
+			nodecount = self.size["x"] * self.size["y"] * self.size["z"]
+			logger.debug("Which makes {0} nodes to read".format(nodecount))
+
+			# The bulk data is inflated piece by piece straight into the arrays
+			self.param0 = arrays.zeros("H", nodecount)
+			self.param1 = arrays.zeros("B", nodecount)
+			self.param2 = arrays.zeros("B", nodecount)
+			targets = [arrays.byteview(self.param0), arrays.byteview(self.param1), arrays.byteview(self.param2)]
+			bulk = data.view_bytes(data.remaining())
+			try:
+				_inflate_into(bulk, targets)
+			finally:
+				bulk.release()
+			arrays.from_big_endian(self.param0)
+			logger.debug("Nodes read")
+		finally:
+			data.view.release()
 
-                logger.debug("Read size : ({0}, {1}, {2})".format(self.size["x"], self.size["y"], self.size["z"]))
+		self.loaded = True
 
-                for i in range(self.size["y"]):
-                        p = readU8(data)
-                        if p < 127:
-                                self.y_slice_probs[i] = p
+	def _load_header(self, data):
+		"""
+		Read everything before the bulk node data, leaving the BinaryReader `data` at the start of it
+		"""
 
-                for _ in range(readU16(data)):
-                        nodename = ""
-                        for _ in range(readU16(data)):
-                                nodename += chr(readU8(data))
-                        self.nodes.append(nodename)
+		signature = bytes(data.view[:4])
+		if signature != b"MTSM":
+			logger.error("{0} : Couldn't load schematic from data : invalid signature".format(self))
+			raise InvalidSchematicSignature("First 4 bytes read are : {}".format(signature))
 
-                bulk = BytesIO(zlib.decompress(data.read()))
-                nodecount = self.size["x"] * self.size["y"] * self.size["z"]
-                self.data = {}
-                logger.debug("Which makes {0} nodes to read".format(nodecount))
-                for i in range(nodecount):
-                        self.data[i] = Node(self.nodes[readU16(bulk)])
-                logger.debug("Nodes read")
+		data.seek(4)
+		self.version = data.readU16()
+		self.size = {"x": data.readU16(), "y": data.readU16(), "z": data.readU16()}
 
-                for i in range(nodecount):
-                        self.data[i].set_param1(readU8(bulk))
-                logger.debug("Param1 read")
+		logger.debug("Read size : ({0}, {1}, {2})".format(self.size["x"], self.size["y"], self.size["z"]))
 
-                for i in range(nodecount):
-                        self.data[i].set_param2(readU8(bulk))
-                logger.debug("Param2 read")
+		for i in range(self.size["y"]):
+			p = data.readU8()
+			if p < 127:
+				self.y_slice_probs[i] = p
 
-                self.loaded = True
+		for _ in range(data.readU16()):
+			self.nodes.append(data.readString16())
+		self._content_ids = {name: content_id for content_id, name in enumerate(self.nodes)}
 
 	def export(self):
 		"""
@@ -138,50 +215,47 @@ class Schematic:
 		if not self.loaded:
 			return
 
-		data = BytesIO(b"")
+		data = BinaryWriter()
 
 		data.write(b"MTSM")
-		writeU16(data, self.version)
+		data.writeU16(self.version)
 
-		writeU16(data, self.size["x"])
-		writeU16(data, self.size["y"])
-		writeU16(data, self.size["z"])
+		data.writeU16(self.size["x"])
+		data.writeU16(self.size["y"])
+		data.writeU16(self.size["z"])
 
 		for u in range(self.size["y"]):
 			p = self.y_slice_probs.get(u) or 127
-			writeU8(data, p)
-
-		writeU16(data, len(self.nodes))
-		for node in self.nodes:
-			writeU16(data, len(node))
-			for c in node:
-				writeU8(data, ord(c))
-
-		bulk = BytesIO(b"")
-		nodecount = self.size["x"] * self.size["y"] * self.size["z"]
-		for i in range(nodecount):
-			writeU16(bulk, self.nodes.index(self.data[i].get_name()))
+			data.writeU8(p)
 
-		for i in range(nodecount):
-			writeU8(bulk, self.data[i].get_param1())
+		# Leave the unused names out of the palette
+		nodes, param0 = self.nodes, self.param0
+		used = arrays.unique(param0)
+		if len(used) != len(nodes):
+			table = [0] * len(nodes)
+			for content_id, old_id in enumerate(used):
+				table[old_id] = content_id
+			nodes, param0 = [nodes[old_id] for old_id in used], arrays.remap(param0, table)
 
-		for i in range(nodecount):
-			writeU8(bulk, self.data[i].get_param2())
+		data.writeU16(len(nodes))
+		for node in nodes:
+			data.writeString16(node)
 
-		bulk.seek(0)
-		data.write(zlib.compress(bulk.read()))
-		data.seek(0)
+		data.write(zlib.compress(arrays.tobytes(param0) + arrays.tobytes(self.param1) + arrays.tobytes(self.param2)))
 
-		return data
+		return BytesIO(data.getvalue())
 
-	def load_from_file(self, filename):
+	def load_from_file(self, filename, header_only = False):
 		"""
 		Load a schematic from a file (which path is provided as argument)
 
 		Arguments :
 		 - filename, mandatory, is the path to the file which to read and load data from
+		 - header_only, optional, is a boolean ; when True, only the version, size, Y slice probabilities
+		   and palette (self.nodes) are read, without inflating the node data, and the schematic is left
+		   unloaded
 
-		Note : This method gets a BytesIO object from `open` and passes it to self.load
+		Note : The file is memory-mapped, and its node data is inflated in chunks straight into the node arrays
 		"""
 
 		try:
@@ -190,7 +264,15 @@ class Schematic:
 			logger.error("{0} : Couldn't open file {1} : {2}".format(self, filename, err))
 			return
 
-		self.load(ifile)
+		with ifile:
+			try:
+				mapped = mmap.mmap(ifile.fileno(), 0, access = mmap.ACCESS_READ)
+			except ValueError:
+				# Empty file, which cannot be mapped
+				return self._load_buffer(ifile.read(), header_only)
+
+			with mapped:
+				self._load_buffer(mapped, header_only)
 
 	def export_to_file(self, filename):
 		"""
@@ -249,31 +331,241 @@ class Schematic:
 			for prob in schemtab["y_slice_probs"]:
 				self.y_slice_probs[prob[0]] = prob[1]
 
+		nodecount = self.size["x"] * self.size["y"] * self.size["z"]
+		self.param0 = arrays.zeros("H", nodecount)
+		self.param1 = arrays.zeros("B", nodecount)
+		self.param2 = arrays.zeros("B", nodecount)
+
 		for index in schemtab["data"]:
 			entry = schemtab["data"][index]
 
-			if not entry["name"] in self.nodes:
-				self.nodes.append(entry["name"])
-
-			self.data[index] = Node(entry["name"], param1 = entry["prob"], param2 = entry.get("param2") or 0)
+			self.param0[index] = self.get_content_id(entry["name"])
+			self.param1[index] = entry["prob"]
+			self.param2[index] = entry.get("param2") or 0
 			if not entry.get("force_place"):
-				self.data[index].set_param1(int(entry["prob"] / 2))
+				self.param1[index] = int(entry["prob"] / 2)
 
 		self.loaded = True
 
-	def get_node(self, pos):
+	def load_arrays(self, size, nodes, param0, param1, param2, y_slice_probs = None):
+		"""
+		Load a schematic from packed arrays of node params
+
+		Arguments :
+		 - size, mandatory, is a dictionary of the "x", "y" and "z" sizes of the schematic
+		 - nodes, mandatory, is the list of node names param0 refers to
+		 - param0, param1, param2, mandatory, are packed arrays (see libminetest.arrays) of size["x"] * size["y"] * size["z"]
+		   node params, ordered like in schematic files (x first, then y, then z)
+		 - y_slice_probs, optional, is a dictionary of probabilities indexed by Y slice
+		"""
+
+		self._init_data()
+
+		self.version = 4
+		self.size = dict(size)
+		self.y_slice_probs = dict(y_slice_probs or {})
+		self.nodes = list(nodes)
+		self._content_ids = {name: content_id for content_id, name in enumerate(self.nodes)}
+		self.param0, self.param1, self.param2 = param0, param1, param2
+
+		self.loaded = True
+
+	def get_content_id(self, name):
+		"""
+		Return the index of `name` in the palette (self.nodes), adding it if needed
+		"""
+
+		content_id = self._content_ids.get(name)
+		if content_id is None:
+			content_id = len(self.nodes)
+			self.nodes.append(name)
+			self._content_ids[name] = content_id
+
+		return content_id
+
+	def _index(self, pos):
+		if not (0 <= pos.x < self.size["x"] and 0 <= pos.y < self.size["y"] and 0 <= pos.z < self.size["z"]):
+			return
+
+		return pos.x + (pos.y * self.size["x"]) + (pos.z * self.size["y"] * self.size["x"])
+
+	def get_node(self, pos, interned = False):
 		"""
 		Return a node at the provided pos in the current schematic
 
 		Arguments :
 		 - pos, mandatory, is a Pos object refering to the node to get in the currently loaded schematic
+		 - interned, optional, is a boolean, return the shared read-only node (see `libminetest.nodes.intern_node`)
+
+		The Node returned is a copy, see set_node to modify the schematic
+		"""
+
+		if not self.loaded:
+			return
+
+		abspos = self._index(pos)
+		if abspos is None:
+			return
+
+		if interned:
+			return intern_node(self.nodes[self.param0[abspos]], int(self.param1[abspos]), int(self.param2[abspos]))
+
+		return Node(self.nodes[self.param0[abspos]], param1 = int(self.param1[abspos]), param2 = int(self.param2[abspos]))
+
+	def set_node(self, pos, node):
+		"""
+		Set the node at the provided pos in the current schematic
+
+		Arguments :
+		 - pos, mandatory, is a Pos object refering to the node to set in the currently loaded schematic
+		 - node, mandatory, is the Node to place there (its param1 being the probability byte of the schematic)
+		"""
+
+		abspos = self._index(pos)
+		if not self.loaded or abspos is None:
+			return
+
+		self.param0[abspos] = self.get_content_id(node.get_name())
+		self.param1[abspos] = node.get_param1()
+		self.param2[abspos] = node.get_param2()
+
+	def copy(self):
+		"""
+		Return a copy of the current schematic, which can be transformed without altering this one
+		"""
+
+		schem = Schematic()
+		schem.load_arrays(self.size, self.nodes, arrays.copy(self.param0), arrays.copy(self.param1),
+			arrays.copy(self.param2), self.y_slice_probs)
+		schem.version, schem.loaded = self.version, self.loaded
+		return schem
+
+	def _permute(self, size, start, steps):
+		"""
+		Rebuild the node arrays with the given size, the node at (x, y, z) being taken
+		from index start + x * steps[0] + y * steps[1] + z * steps[2] of the current arrays
+		"""
+
+		count = size["x"] * size["y"] * size["z"]
+		width, step = size["x"], steps[0]
+		for name in ("param0", "param1", "param2"):
+			src = getattr(self, name)
+			dst = arrays.zeros(arrays.typecode(src), count)
+			i = 0
+			for z in range(size["z"]):
+				for y in range(size["y"]):
+					# Copy whole rows through (possibly reversed) extended slices
+					row = start + y * steps[1] + z * steps[2]
+					stop = row + width * step
+					dst[i:i + width] = src[row:(stop if stop >= 0 else None):step]
+					i += width
+			setattr(self, name, dst)
+
+		self.size = dict(size)
+
+	def _remap_param2(self, names, table, mask):
+		"""
+		Remap the param2 of the nodes whose name is in `names` through `table`, only changing the bits of `mask`
+		"""
+
+		flags = [int(name in names) for name in self.nodes]
+		if not any(flags):
+			return
+
+		lut = [(p & ~mask) | table[(p & mask) % len(table)] for p in range(256)]
+		self.param2 = arrays.where(arrays.remap(self.param0, flags), arrays.remap(self.param2, lut), self.param2)
+
+	def rotate_y(self, turns = 1, facedir = (), wallmounted = ()):
+		"""
+		Rotate the schematic around the Y axis, in place
+
+		Arguments :
+		 - turns, optional, is the number of 90 degrees rotations to apply (+X going to -Z, like
+		   Minetest's "90" rotation when placing schematics)
+		 - facedir, optional, is a collection of the names of nodes whose param2 is a facedir
+		 - wallmounted, optional, is a collection of the names of nodes whose param2 is wallmounted
+
+		The param2 of those nodes is rotated along, like Minetest does
+		"""
+
+		turns %= 4
+		if not self.loaded or not turns:
+			return
+
+		sx, sy, sz = self.size["x"], self.size["y"], self.size["z"]
+		if turns == 1:
+			self._permute({"x": sz, "y": sy, "z": sx}, sx - 1, (sx * sy, sx, -1))
+		elif turns == 2:
+			self._permute(self.size, (sz - 1) * sx * sy + sx - 1, (-1, sx, -sx * sy))
+		else:
+			self._permute({"x": sz, "y": sy, "z": sx}, (sz - 1) * sx * sy, (-sx * sy, sx, 1))
+
+		fdtable, wmtable = list(range(24)), list(range(8))
+		for _ in range(turns):
+			fdtable = [FACEDIR_ROTATE_Y[v] for v in fdtable]
+			wmtable = [WALLMOUNTED_ROTATE_Y[v] for v in wmtable]
+		self._remap_param2(facedir, fdtable, 31)
+		self._remap_param2(wallmounted, wmtable, 7)
+
+	def flip(self, axis, facedir = (), wallmounted = ()):
+		"""
+		Mirror the schematic along an axis, in place
+
+		Arguments :
+		 - axis, mandatory, is one of "x", "y" or "z"
+		 - facedir, wallmounted, optional, are collections of node names whose param2 is remapped (see rotate_y)
 		"""
 
 		if not self.loaded:
 			return
 
-		if pos.x > self.size["x"] or pos.y > self.size["y"] or pos.z > self.size["z"]:
+		sx, sy, sz = self.size["x"], self.size["y"], self.size["z"]
+		if axis == "x":
+			self._permute(self.size, sx - 1, (-1, sx, sx * sy))
+		elif axis == "y":
+			self._permute(self.size, (sy - 1) * sx, (1, -sx, sx * sy))
+			self.y_slice_probs = {sy - 1 - y: prob for y, prob in self.y_slice_probs.items()}
+		elif axis == "z":
+			self._permute(self.size, (sz - 1) * sx * sy, (1, sx, -sx * sy))
+		else:
+			raise ValueError("Unknown axis : {0}".format(axis))
+
+		self._remap_param2(facedir, FACEDIR_FLIP[axis], 31)
+		self._remap_param2(wallmounted, WALLMOUNTED_FLIP[axis], 7)
+
+	def crop(self, minp, maxp):
+		"""
+		Reduce the schematic to the box between two of its positions (both included), in place
+
+		Arguments :
+		 - minp, mandatory, is the Pos of a corner of the box, in the schematic
+		 - maxp, mandatory, is the Pos of the opposite corner
+		"""
+
+		if not self.loaded:
 			return
 
-		abspos = pos.x + (pos.y * self.size["x"]) + (pos.z * self.size["y"] * self.size["x"])
-		return self.data[abspos]
+		lo = Pos(min(minp.x, maxp.x), min(minp.y, maxp.y), min(minp.z, maxp.z))
+		hi = Pos(max(minp.x, maxp.x), max(minp.y, maxp.y), max(minp.z, maxp.z))
+		if self._index(lo) is None or self._index(hi) is None:
+			raise OutOfBordersCoordinates("{0} to {1} is not in the schematic".format(lo, hi))
+
+		sx, sy = self.size["x"], self.size["y"]
+		self._permute({"x": hi.x - lo.x + 1, "y": hi.y - lo.y + 1, "z": hi.z - lo.z + 1}, self._index(lo), (1, sx, sx * sy))
+		self.y_slice_probs = {y - lo.y: prob for y, prob in self.y_slice_probs.items() if lo.y <= y <= hi.y}
+
+	def replace_nodes(self, names):
+		"""
+		Rename nodes of the schematic, in place
+
+		Arguments :
+		 - names, mandatory, is a dictionary of the new names indexed by the names to replace
+
+		Only the palette is rewritten ; node ids are merged if several names end up being the same
+		"""
+
+		nodes = [names.get(name, name) for name in self.nodes]
+		self.nodes, self._content_ids = [], {}
+		table = [self.get_content_id(name) for name in nodes]
+		if len(self.nodes) != len(nodes):
+			self.param0 = arrays.remap(self.param0, table)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+###########################
+## Map statistics for Python-MT
+##
+##
+#
+
+import csv
+import json
+import functools
+
+from .utils import Pos, getIntegerAsBlock
+from .logger import logger
+from . import arrays
+
+# Y coordinate (in the mapblock) of every node index, see Pos.getAsInt
+_NODE_Y = arrays.fromlist("I", [(i >> 4) & 15 for i in range(4096)])
+
+# Value given to the nodes outside of the box, dropped from the histograms
+_OUTSIDE = 0xFFFFFFFF
+
+def _sizeBucket(size):
+	# Smallest power of two holding `size`
+	return 1 << max(0, size - 1).bit_length()
+
+def _ratioBucket(ratio):
+	# Compression ratios are rounded down to 5%
+	return int(ratio * 20) / 20
+
+def _boxMask(minp, maxp, blockpos):
+	# Packed array of the nodes of a mapblock inside the box, set to 1
+	lo = [max(minp[i], blockpos[i] * 16) - blockpos[i] * 16 for i in range(3)]
+	hi = [min(maxp[i], blockpos[i] * 16 + 15) - blockpos[i] * 16 for i in range(3)]
+	mask = arrays.zeros("B", 4096)
+	length = hi[0] - lo[0] + 1
+	if length <= 0:
+		return mask
+
+	row = arrays.full("B", length, 1)
+	for z in range(lo[2], hi[2] + 1):
+		for y in range(lo[1], hi[1] + 1):
+			start = z * 256 + y * 16 + lo[0]
+			mask[start:start + length] = row
+
+	return mask
+
+def _addCounts(dst, src):
+	for key, count in src.items():
+		dst[key] = dst.get(key, 0) + count
+
+class MapStats:
+	"""
+	Statistics gathered over mapblocks, mergeable so that they can be computed in parallel (see map_stats)
+
+	Attributes :
+	 - blocks, the number of mapblocks counted
+	 - layer_height, the height of the Y layers of the node histograms
+	 - nodes, a dictionary of node histograms ({name: count}) indexed by the Y coordinate of the bottom of their layer
+	 - versions, the number of mapblocks of every format version
+	 - blob_bytes, the total size of the mapblocks' binary blobs
+	 - blob_sizes, the number of blobs by size, rounded up to powers of two
+	 - compression_ratios, the number of mapblocks by compressed/uncompressed size ratio, rounded down to 5%
+	 - node_meta, static_objects, node_timers, the number of mapblocks by count of those in them
+	"""
+
+	FIELDS = ("versions", "blob_sizes", "compression_ratios", "node_meta", "static_objects", "node_timers")
+
+	def __init__(self, layer_height = 16):
+		self.blocks = 0
+		self.layer_height = layer_height
+		self.blob_bytes = 0
+		self.nodes = dict()
+		for field in self.FIELDS:
+			setattr(self, field, dict())
+
+	def add_mapblock(self, mapblock, box = None):
+		"""
+		Count a mapblock in
+
+		Arguments :
+		 - mapblock, mandatory, is the MapBlock to count (read with its id, see MapBlock.abspos). Blob sizes are
+		   those of MapBlock.get_blob
+		 - box, optional, is a (minp, maxp) tuple of Pos ; nodes outside of it are left out of the node histograms
+		"""
+
+		blockpos = getIntegerAsBlock(mapblock.abspos)
+		blob = mapblock.get_blob()
+
+		self.blocks += 1
+		self.blob_bytes += len(blob)
+		for field, key in (("versions", mapblock.version), ("blob_sizes", _sizeBucket(len(blob))),
+				("compression_ratios", _ratioBucket(len(blob) / mapblock.get_inflated_size())), ("node_meta", len(mapblock.node_meta)),
+				("static_objects", mapblock.static_object_count), ("node_timers", mapblock.timer_counts)):
+			counts = getattr(self, field)
+			counts[key] = counts.get(key, 0) + 1
+
+		# Histogram of (content id, Y in the mapblock) pairs
+		keys = arrays.combine("I", (mapblock.param0, _NODE_Y), (16, 1))
+		if box is not None:
+			keys = arrays.masked(keys, _boxMask(box[0], box[1], blockpos), _OUTSIDE)
+
+		for key, count in arrays.counts(keys).items():
+			if key == _OUTSIDE:
+				continue
+
+			name = mapblock.name_id_mappings.get(key >> 4, "unknown")
+			layer = (blockpos.y * 16 + (key & 15)) // self.layer_height * self.layer_height
+			histogram = self.nodes.setdefault(layer, dict())
+			histogram[name] = histogram.get(name, 0) + count
+
+	def merge(self, other):
+		"""
+		Add the statistics of `other` (with the same layer_height) to these ones, and return self
+		"""
+
+		self.blocks += other.blocks
+		self.blob_bytes += other.blob_bytes
+		for field in self.FIELDS:
+			_addCounts(getattr(self, field), getattr(other, field))
+		for layer, histogram in other.nodes.items():
+			_addCounts(self.nodes.setdefault(layer, dict()), histogram)
+
+		return self
+
+	def get_totals(self):
+		"""
+		Return the histogram of the node names over all the layers
+		"""
+
+		totals = dict()
+		for histogram in self.nodes.values():
+			_addCounts(totals, histogram)
+
+		return totals
+
+	def as_dict(self):
+		"""
+		Return the statistics as a dictionary which can be serialized to JSON
+		"""
+
+		result = {"blocks": self.blocks, "layer_height": self.layer_height, "blob_bytes": self.blob_bytes}
+		result["nodes"] = {str(layer): dict(sorted(self.nodes[layer].items())) for layer in sorted(self.nodes)}
+		for field in self.FIELDS:
+			counts = getattr(self, field)
+			result[field] = {str(key): counts[key] for key in sorted(counts)}
+
+		return result
+
+	def to_json(self, ofile):
+		"""
+		Write the statistics as JSON to the file object `ofile`
+		"""
+
+		json.dump(self.as_dict(), ofile, indent = 1)
+
+	def to_csv(self, ofile):
+		"""
+		Write the statistics as CSV to the file object `ofile`, one "table,key,name,count" row per value
+
+		Node histograms are in the "nodes" table, keyed by layer ; the other tables have an empty name column
+		"""
+
+		writer = csv.writer(ofile)
+		writer.writerow(("table", "key", "name", "count"))
+		writer.writerow(("blocks", "", "", self.blocks))
+		writer.writerow(("blob_bytes", "", "", self.blob_bytes))
+		for layer in sorted(self.nodes):
+			for name, count in sorted(self.nodes[layer].items()):
+				writer.writerow(("nodes", layer, name, count))
+
+		for field in self.FIELDS:
+			counts = getattr(self, field)
+			for key in sorted(counts):
+				writer.writerow((field, key, "", counts[key]))
+
+def _block_stats(layer_height, box, mapblock):
+	# Ran in worker processes
+	stats = MapStats(layer_height)
+	stats.add_mapblock(mapblock, box)
+	return stats
+
+def map_stats(vessel, minp = None, maxp = None, layer_height = 16, workers = None, chunk_size = 256):
+	"""
+	Compute the statistics of a map, or of a box of it, in parallel (see libminetest.parallel.map_blocks)
+
+	Arguments :
+	 - vessel, mandatory, is the MapVessel of the map
+	 - minp, maxp, optional, are the Pos of two opposite corners of the box (in nodes). The whole map is
+	   counted when they are not provided. Mapblocks partly in the box count in full, except in the node histograms
+	 - layer_height, optional, is the height of the Y layers the node histograms are split into
+	 - workers, chunk_size, optional, are passed to map_blocks
+
+	Returns a MapStats object
+	"""
+
+	from .parallel import map_blocks
+
+	box = None
+	ids = None
+	if minp is not None and maxp is not None:
+		box = (Pos(min(minp.x, maxp.x), min(minp.y, maxp.y), min(minp.z, maxp.z)),
+			Pos(max(minp.x, maxp.x), max(minp.y, maxp.y), max(minp.z, maxp.z)))
+		# Looked up on the primary key, see MapVessel.blocks_in_area
+		ids = [blockID for blockID, _ in vessel.blocks_in_area(box[0], box[1])]
+
+	stats = map_blocks(vessel, functools.partial(_block_stats, layer_height, box), ids = ids, workers = workers,
+		reduce = MapStats.merge, initial = MapStats(layer_height), chunk_size = chunk_size)
+
+	logger.debug("Statistics of {0} mapblocks computed".format(stats.blocks))
+	return stats
@@ -6,8 +6,10 @@
 ##
 #
 
-from io import BytesIO
-from math import floor
+from collections import namedtuple
+import struct
+
+from . import arrays
 
 def posFromInt(pos, blocksize):
     posx, posy = 0, 0
@@ -34,11 +36,35 @@ def getMapBlockPos(pos):
 
 
 def determineMapBlock(pos):
-	posx = floor(pos.x / 16)
-	posy = floor(pos.y / 16)
-	posz = floor(pos.z / 16)
+	return Pos(pos.x // 16, pos.y // 16, pos.z // 16)
+
+def getMapBlockRanges(minblock, maxblock):
+    """
+    Return the mapblock id ranges covering a box of mapblocks
+
+    Mapblock ids are consecutive along X, so every (y, z) row of the box is a single range,
+    and rows spanning the whole X axis merge with the next ones
+
+    Arguments :
+     - minblock, mandatory, is the Pos of the box's corner with the lowest coordinates (in mapblocks)
+     - maxblock, mandatory, is the Pos of the opposite corner
+
+    Returns a list of (first id, last id) tuples, bounds included, in increasing order
+    """
+
+    lo = [max(-2048, min(minblock.x, maxblock.x)), max(-2048, min(minblock.y, maxblock.y)), max(-2048, min(minblock.z, maxblock.z))]
+    hi = [min(2047, max(minblock.x, maxblock.x)), min(2047, max(minblock.y, maxblock.y)), min(2047, max(minblock.z, maxblock.z))]
 
-	return Pos(posx, posy, posz)
+    ranges = []
+    for z in range(lo[2], hi[2] + 1):
+        for y in range(lo[1], hi[1] + 1):
+            base = z * 4096 * 4096 + y * 4096
+            if ranges and ranges[-1][1] + 1 == base + lo[0]:
+                ranges[-1] = (ranges[-1][0], base + hi[0])
+            else:
+                ranges.append((base + lo[0], base + hi[0]))
+
+    return ranges
 
 def getIntegerAsBlock(i):
     x = unsignedToSigned(i % 4096, 2048)
@@ -55,20 +81,58 @@ def unsignedToSigned(i, max_positive):
     else:
         return i - 2*max_positive
 
-class Pos:
-    def __init__(self, x, y, z):
-        self.x = x
-        self.y = y
-        self.z = z
+def _components(other):
+    # Pos-like objects and 3-sequences are used component-wise, numbers for every component
+    if isinstance(other, (int, float)):
+        return other, other, other
+
+    return other[0], other[1], other[2]
+
+class Pos(namedtuple("Pos", ("x", "y", "z"))):
+    """
+    Immutable, hashable position
+
+    Supports +, - (with a Pos, a 3-tuple or a number), *, // and % (with a number or component-wise)
+    """
+
+    __slots__ = ()
 
     def __str__(self):
         return "({0}, {1}, {2})".format(self.x, self.y, self.z)
 
     def __repr__(self):
-	    return str(self)
+        return str(self)
 
-    def __eq__(self, other):
-        return self.x == other.x and self.y == other.y and self.z == other.z
+    def __add__(self, other):
+        x, y, z = _components(other)
+        return Pos(self.x + x, self.y + y, self.z + z)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        x, y, z = _components(other)
+        return Pos(self.x - x, self.y - y, self.z - z)
+
+    def __rsub__(self, other):
+        x, y, z = _components(other)
+        return Pos(x - self.x, y - self.y, z - self.z)
+
+    def __mul__(self, other):
+        x, y, z = _components(other)
+        return Pos(self.x * x, self.y * y, self.z * z)
+
+    __rmul__ = __mul__
+
+    def __floordiv__(self, other):
+        x, y, z = _components(other)
+        return Pos(self.x // x, self.y // y, self.z // z)
+
+    def __mod__(self, other):
+        x, y, z = _components(other)
+        return Pos(self.x % x, self.y % y, self.z % z)
+
+    def __neg__(self):
+        return Pos(-self.x, -self.y, -self.z)
 
     def getAsInt(self, max_val = 16):
         return self.z * max_val * max_val + self.y * max_val + self.x
@@ -76,69 +140,282 @@ class Pos:
     def getAsTuple(self):
         return (self.x, self.y, self.z)
 
-    def fromTuple(self, tup):
+    @classmethod
+    def fromTuple(cls, tup):
         if len(tup) < 3:
             return False
 
-        self.x, self.y, self.z = tup[0], tup[1], tup[2]
-        return self
+        return cls(tup[0], tup[1], tup[2])
+
+class PosArray:
+    """
+    Batch of positions stored as three packed arrays of signed 32 bits integers (see libminetest.arrays)
+
+    Operations work on the whole batch at once, which is much faster than on many Pos objects
+    """
+
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        """
+        Constructor for PosArray
+
+        Arguments :
+         - x, y, z, mandatory, are the packed arrays (typecode "i") of the coordinates, of the same length
+        """
+
+        self.x, self.y, self.z = x, y, z
+
+    @classmethod
+    def from_positions(cls, positions):
+        """
+        Build a PosArray from an iterable of Pos (or 3-tuples)
+        """
+
+        positions = list(positions)
+        return cls(*(arrays.fromlist("i", [pos[axis] for pos in positions]) for axis in range(3)))
+
+    @classmethod
+    def from_block_ids(cls, ids):
+        """
+        Build the PosArray of the mapblock positions (in mapblocks) of an iterable of mapblock ids
+        """
+
+        return cls.from_positions(getIntegerAsBlock(i) for i in ids)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, i):
+        return Pos(int(self.x[i]), int(self.y[i]), int(self.z[i]))
+
+    def __iter__(self):
+        return map(Pos, map(int, self.x), map(int, self.y), map(int, self.z))
+
+    def __add__(self, other):
+        """
+        Add a Pos (or a number) to every position, or another PosArray position by position
+        """
+
+        if isinstance(other, PosArray):
+            return PosArray(arrays.add(self.x, other.x), arrays.add(self.y, other.y), arrays.add(self.z, other.z))
+
+        x, y, z = _components(other)
+        return PosArray(arrays.add(self.x, x), arrays.add(self.y, y), arrays.add(self.z, z))
+
+    def __floordiv__(self, divisor):
+        return PosArray(arrays.floordiv(self.x, divisor), arrays.floordiv(self.y, divisor), arrays.floordiv(self.z, divisor))
+
+    def __mod__(self, divisor):
+        return PosArray(arrays.mod(self.x, divisor), arrays.mod(self.y, divisor), arrays.mod(self.z, divisor))
+
+    def mapblocks(self):
+        """
+        Return the PosArray of the mapblocks (in mapblocks) the positions are in
+        """
+
+        return self // 16
+
+    def block_ids(self):
+        """
+        Return the packed array (typecode "q") of the mapblock ids of the positions, which must be in mapblocks
+        (see getMapBlockPos)
+        """
+
+        return arrays.combine("q", (self.x, self.y, self.z), (1, 4096, 4096 * 4096))
+
+    def in_block_offsets(self):
+        """
+        Return the packed array (typecode "H") of the indexes of the positions inside their mapblock
+        (see Pos.getAsInt)
+        """
+
+        local = self % 16
+        return arrays.astype(arrays.combine("i", (local.x, local.y, local.z), (1, 16, 256)), "H")
+
+# Precompiled formats, big-endian
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_S8 = struct.Struct(">b")
+_S16 = struct.Struct(">h")
+_S32 = struct.Struct(">i")
 
 # Thanks to @gravgun/ElementW for those.
 # Big-endian!!!
 def readU8(strm):
-    return (ord(strm.read(1)))
+    return _U8.unpack(strm.read(1))[0]
 
 def readU16(strm):
-	#return (ord(strm.read(1)) << 16) + (ord(strm.read(1)))
-	return (ord(strm.read(1)) << 8) + (ord(strm.read(1)))
+    return _U16.unpack(strm.read(2))[0]
 
 def readU32(strm):
-	return (ord(strm.read(1)) << 24) + (ord(strm.read(1)) << 16) + (ord(strm.read(1)) << 8) + (ord(strm.read(1)))
+    return _U32.unpack(strm.read(4))[0]
 
 # Works with eight-bit two's complement
 def readS8(strm):
-    u = readU8(strm)
-    if u & pow(2,7): # Negative
-        return -pow(2,7) + (u-pow(2,7))
-    else:
-        return u
+    return _S8.unpack(strm.read(1))[0]
 
 def readS16(strm):
-    u = readU16(strm)
-    if u & pow(2,15): # Negative
-        return -pow(2,15) + (u-pow(2,15))
-    else:
-        return u
+    return _S16.unpack(strm.read(2))[0]
 
 def readS32(strm):
-    u = readU32(strm)
-    if u & pow(2,31): # Negative
-        return -pow(2,31) + (u-pow(2,31))
-    else:
-        return u
+    return _S32.unpack(strm.read(4))[0]
 
 def writeU8(strm, val):
-    strm.write(bytes([val]))#bytes(chr(val), encoding = 'utf8'))
+    strm.write(_U8.pack(val))
 
 def writeU16(strm, val):
-    vals = []
-    for _ in range(2):
-        k = val % 256
-        vals.insert(0, int(k))
-        val -= k
-        val /= 256
-
-    strm.write(bytes(vals))
+    strm.write(_U16.pack(int(val) & 0xFFFF))
 
 def writeU32(strm, val):
-	vals = []
-	for _ in range(4):
-		k = val % 256
-		vals.insert(0, int(k))
-		val -= k
-		val /= 256
+    strm.write(_U32.pack(int(val) & 0xFFFFFFFF))
+
+class BinaryReader:
+    """
+    Cursor reading big-endian values from a bytes-like object, without copying it
+    """
+
+    def __init__(self, data, offset = 0):
+        """
+        Constructor for BinaryReader
+
+        Arguments :
+         - data, mandatory, is the bytes-like object to read from
+         - offset, optional, is the position at which reading starts
+        """
+
+        self.buffer = data
+        self.view = memoryview(data)
+        self.pos = offset
+
+    def __len__(self):
+        return len(self.view)
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def remaining(self):
+        return len(self.view) - self.pos
+
+    def _unpack(self, fmt):
+        val = fmt.unpack_from(self.view, self.pos)[0]
+        self.pos += fmt.size
+        return val
+
+    def readU8(self):
+        return self._unpack(_U8)
+
+    def readU16(self):
+        return self._unpack(_U16)
+
+    def readU32(self):
+        return self._unpack(_U32)
+
+    def readS8(self):
+        return self._unpack(_S8)
+
+    def readS16(self):
+        return self._unpack(_S16)
+
+    def readS32(self):
+        return self._unpack(_S32)
+
+    def view_bytes(self, length):
+        """
+        Return a memoryview over the next `length` bytes, and move past them
+        """
+
+        if self.pos + length > len(self.view):
+            raise EOFError("Tried to read {0} bytes with only {1} left".format(length, self.remaining()))
+
+        view = self.view[self.pos:self.pos + length]
+        self.pos += length
+        return view
+
+    def read(self, length = -1):
+        """
+        Return the next `length` bytes (or all the remaining ones) as a bytes object
+        """
+
+        if length < 0:
+            length = self.remaining()
+        return self.view_bytes(length).tobytes()
+
+    def readString16(self):
+        """
+        Read a string prefixed by its u16 length
+        """
+
+        return self.view_bytes(self.readU16()).tobytes().decode("latin-1")
+
+    def readString32(self):
+        """
+        Read a string prefixed by its u32 length
+        """
+
+        return self.view_bytes(self.readU32()).tobytes().decode("latin-1")
+
+    def find(self, sub):
+        """
+        Return the position of the next occurence of `sub`, or -1
+        """
+
+        if hasattr(self.buffer, "find"):
+            return self.buffer.find(sub, self.pos)
+
+        found = self.view[self.pos:].tobytes().find(sub)
+        return found if found < 0 else found + self.pos
+
+class BinaryWriter:
+    """
+    Buffer accumulating big-endian values
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+
+    def writeU8(self, val):
+        self.buffer += _U8.pack(val)
+
+    def writeU16(self, val):
+        self.buffer += _U16.pack(int(val) & 0xFFFF)
+
+    def writeU32(self, val):
+        self.buffer += _U32.pack(int(val) & 0xFFFFFFFF)
+
+    def writeS32(self, val):
+        self.buffer += _S32.pack(int(val))
+
+    def writeString16(self, val):
+        """
+        Write a string prefixed by its u16 length
+        """
+
+        data = val.encode("latin-1")
+        self.writeU16(len(data))
+        self.buffer += data
+
+    def writeString32(self, val):
+        """
+        Write a string prefixed by its u32 length
+        """
+
+        data = val.encode("latin-1")
+        self.writeU32(len(data))
+        self.buffer += data
 
-	strm.write(bytes(vals))
+    def getvalue(self):
+        return bytes(self.buffer)
 
 class Vector:
 	def add(self, pos1, pos2):
@@ -151,7 +428,7 @@ class Vector:
 		return Pos(pos.x * lmbd, pos.y * lmbd, pos.z * lmbd)
 
 	def div(self, pos, lmbd):
-		return self.mult(self, pos, 1/lmbd)
+		return self.mult(pos, 1/lmbd)
 
 	def round(self, pos):
 		return Pos(round(pos.x), round(pos.y), round(pos.z))
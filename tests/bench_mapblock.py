@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+############################
+## MapBlock decoding benchmark for Python-MT
+##
+## args :
+## ./bench_mapblock.py [path to sqlite file]
+##
+## Without a map file, synthetic mapblocks of typical sizes are used
+##
+
+import libminetest.map
+import libminetest.nodes
+
+import random
+import time
+import sys
+import zlib
+
+from io import BytesIO
+
+ROUNDS = 20
+BYTEWISE_ROUNDS = 2 # The old decoder is far too slow for more
+
+def syntheticBlobs():
+	"""
+	Build mapblocks ranging from the tiny all-air ones to noisy, badly compressible ones
+	"""
+
+	names = ["default:stone", "default:dirt", "default:dirt_with_grass", "default:water_source",
+		"default:gravel", "default:sand", "default:stone_with_coal", "default:tree"]
+
+	blobs = {}
+	for label, fill, noise in (("air", 0, False), ("stone", 1, False), ("terrain", 4, False), ("noisy", 8, True)):
+		mapb = libminetest.map.MapBlock()
+		for i in range(4096):
+			if not fill:
+				break
+
+			node = libminetest.nodes.Node(names[random.randrange(fill)])
+			if noise:
+				node.set_param1(random.randrange(256))
+				node.set_param2(random.randrange(24))
+			elif i >= 2048:
+				continue
+
+			mapb.set_node(i, node)
+
+		blobs[label] = mapb.implode()
+
+	return blobs
+
+def mapBlobs(map, count = 50):
+	"""
+	Sample blobs from a real map, picking the smallest, median and largest ones
+	"""
+
+	vessel = libminetest.map.MapVessel(map)
+	ids = vessel.get_all_mapblock_ids()
+	blobs = sorted((vessel.read(i) for i in random.sample(ids, min(count, len(ids)))), key = len)
+	vessel.close()
+	if not blobs:
+		return {}
+
+	return {"smallest": blobs[0], "median": blobs[len(blobs) // 2], "largest": blobs[-1]}
+
+def inflateBytewise(data):
+	# The decoder explode used to rely on, kept for comparison
+	k = b""
+	while True:
+		k += data.read(1)
+		try:
+			return zlib.decompress(k)
+		except zlib.error:
+			continue
+
+def benchBlob(label, blob):
+	s = time.time()
+	for _ in range(ROUNDS):
+		libminetest.map.MapBlock(blob).decode_all()
+	full = (time.time() - s) / ROUNDS * 1000
+
+	s = time.time()
+	for _ in range(ROUNDS):
+		libminetest.map.MapBlock(blob).name_id_mappings
+	names = (time.time() - s) / ROUNDS * 1000
+
+	s = time.time()
+	for _ in range(BYTEWISE_ROUNDS):
+		data = BytesIO(blob)
+		data.seek(libminetest.map.MapBlock(blob)._body_offset)
+		inflateBytewise(data)
+		inflateBytewise(data)
+	bytewise = (time.time() - s) / BYTEWISE_ROUNDS * 1000
+
+	print("  -> {0:10s} {1:7d} bytes : {2:8.4f}ms full decode, {3:8.4f}ms name-id mappings, {4:10.4f}ms bytewise inflate".format(label, len(blob), full, names, bytewise))
+
+def main(map = None):
+	print("=> MapBlock decoding ({0} rounds per blob)".format(ROUNDS))
+	blobs = mapBlobs(map) if map else syntheticBlobs()
+	for label in blobs:
+		benchBlob(label, blobs[label])
+
+
+if __name__ == "__main__":
+	main(sys.argv[1] if len(sys.argv) >= 2 else None)
@@ -4,8 +4,10 @@ def main(map):
 	vessel = libminetest.map.MapVessel(map)
 	minpos = None
 	maxpos = None
-	for block in vessel.get_all_mapblock_ids():
+	dimens = 0
+	for block in vessel.iter_mapblock_ids():
 		print(block)
+		dimens += 1
 		pos = libminetest.utils.getIntegerAsBlock(block)
 		if minpos is None:
 			minpos = pos
@@ -17,7 +19,6 @@ def main(map):
 	print(minpos)
 	print(maxpos)
 
-	dimens = len(vessel.get_all_mapblock_ids())
 	print("There are {0} blocks currently generated and stored".format(dimens))
 	vessel.close()
 
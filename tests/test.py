@@ -7,14 +7,26 @@
 import libminetest
 import libminetest.map
 import libminetest.config
+import libminetest.nodes
+import libminetest.metadata
+import libminetest.content
+import libminetest.index
+import libminetest.stats
+import libminetest.backends
+import libminetest.region
 from libminetest.schematics import Schematic
 
+import concurrent.futures
 import random
 import time
 import os
 import sys
+import json
+import shutil
+import tempfile
+import zlib
 
-from io import BytesIO
+from io import BytesIO, StringIO
 
 def testMapBlockLoad(map):
 	file = libminetest.map.MapVessel(map)
@@ -29,6 +41,493 @@ def testMapBlockLoad(map):
 	print("  -> There are in total {0} mapblocks in the map".format(len(file.get_all_mapblock_ids())), end = (' ' * 25) + '\n')
 	print(" --> Test successful")
 
+def testBatchedBlocks(map):
+	file = libminetest.map.MapVessel(map)
+	ids = file.get_all_mapblock_ids()
+	missing = max(ids) + 1
+	blobs = file.read_many(ids + [missing])
+	assert(sorted(blobs) == sorted(ids) and all(blobs[i] == file.read(i) for i in ids))
+	print("  -> read_many matches read, {0} mapblocks".format(len(blobs)))
+
+	loaded = file.load_many(ids[:10])
+	assert(all(loaded[i].abspos == i for i in ids[:10]))
+
+	directory = tempfile.mkdtemp()
+	shutil.copy(map, os.path.join(directory, "map.sqlite"))
+	copy = libminetest.map.MapVessel(os.path.join(directory, "map.sqlite"))
+	copy.write_many(blobs)
+	copy.write_many([(missing, blobs[ids[0]])])
+	copy.commit()
+	assert(copy.read_many(ids) == blobs and copy.read(missing) == blobs[ids[0]])
+	print("  -> write_many from a dictionary and from tuples")
+
+	# More mapblocks than fit in a single query
+	empty = libminetest.map.MapBlock().implode()
+	many = {(1 << 24) + i: empty for i in range(libminetest.backends.SQL_CHUNK_SIZE * 2 + 1)}
+	copy.write_many(many)
+	copy.commit()
+	assert(copy.read_many(many) == many)
+	print("  -> {0} mapblocks written and read back in chunks".format(len(many)))
+	copy.close()
+	shutil.rmtree(directory)
+	print(" --> Test successful")
+
+def testProfiles(map):
+	directory = tempfile.mkdtemp()
+	shutil.copy(map, os.path.join(directory, "map.sqlite"))
+	file = libminetest.map.MapVessel(os.path.join(directory, "map.sqlite"), profile = "bulk")
+	settings = file.get_settings()
+	assert(settings["synchronous"] == "OFF" and settings["journal_mode"] == "memory" and settings["temp_store"] == "MEMORY")
+	assert(settings["cache_size"] == libminetest.backends.SQLITE_PROFILES["bulk"]["cache_size"])
+	print("  -> Bulk profile : {0}".format(settings))
+
+	journal = settings["journal_mode"]
+	applied = file.configure("live")
+	assert(not "journal_mode" in applied and file.get_setting("journal_mode") == journal)
+	assert(applied["synchronous"] == "FULL" and applied["busy_timeout"] == 10000)
+	assert(file.configure("live", synchronous = "NORMAL")["synchronous"] == "NORMAL")
+	print("  -> Live profile, with an override")
+
+	for profile, settings in (("fast", {}), (None, {"page_size": 4096}), (None, {"cache_size": "1; DROP TABLE blocks"}),
+			(None, {"journal_mode": "WAL --"})):
+		try:
+			file.configure(profile, **settings)
+			assert(False)
+		except libminetest.errors.MapError as err:
+			print("  -> {0}".format(err))
+
+	assert(file.read_many(file.get_all_mapblock_ids()))
+	print("  -> Invalid profiles and settings rejected")
+	file.close()
+	shutil.rmtree(directory)
+	print(" --> Test successful")
+
+def testReadOnly(map):
+	source = libminetest.map.MapVessel(map)
+	blobs = source.read_many(source.get_all_mapblock_ids())
+	source.close()
+	file = libminetest.map.MapVessel(map, readonly = True, pool_size = 3)
+	blockID = next(iter(blobs))
+	for write in (lambda: file.write(blockID, b""), lambda: file.write_many({blockID: b""}), lambda: file.remove(blockID)):
+		try:
+			write()
+			assert(False)
+		except libminetest.errors.MapError as err:
+			print("  -> {0}".format(err))
+	assert(file.read(blockID) == blobs[blockID])
+	print("  -> Writes are refused")
+
+	def check(ids):
+		return all(file.read(i) == blobs[i] for i in ids) and file.read_many(ids) == {i: blobs[i] for i in ids}
+
+	ids = list(blobs)
+	with concurrent.futures.ThreadPoolExecutor(8) as executor:
+		assert(all(executor.map(check, [ids[i::16] for i in range(16)] * 4)))
+	assert(1 <= len(file.backend.pool.connections) <= 3)
+	print("  -> Concurrent reads over {0} pooled connections".format(len(file.backend.pool.connections)))
+	file.close()
+
+	file = libminetest.map.MapVessel(map, immutable = True)
+	assert(file.readonly and file.read_many(ids) == blobs)
+	file.close()
+	print(" --> Test successful")
+
+def testAreaQueries(map):
+	Pos = libminetest.utils.Pos
+	for minblock, maxblock in ((Pos(-3, -2, -5), Pos(1, 0, -4)), (Pos(2, 3, 4), Pos(-2, -3, -4)), (Pos(-2050, 0, 0), Pos(-2040, 0, 0))):
+		ranges = libminetest.utils.getMapBlockRanges(minblock, maxblock)
+		ids = set(i for lo, hi in ranges for i in range(lo, hi + 1))
+		expected = set(libminetest.utils.getMapBlockPos(Pos(x, y, z))
+			for x in range(max(-2048, min(minblock.x, maxblock.x)), max(minblock.x, maxblock.x) + 1)
+			for y in range(min(minblock.y, maxblock.y), max(minblock.y, maxblock.y) + 1)
+			for z in range(min(minblock.z, maxblock.z), max(minblock.z, maxblock.z) + 1))
+		assert(ids == expected and ranges == sorted(ranges))
+	print("  -> Ranges match the mapblocks of the box, negative coordinates included")
+
+	ranges = libminetest.utils.getMapBlockRanges(Pos(-2048, -1, -2), Pos(2047, 1, -1))
+	assert(len(ranges) == 2 and ranges[0] == (libminetest.utils.getMapBlockPos(Pos(-2048, -1, -2)),
+		libminetest.utils.getMapBlockPos(Pos(2047, 1, -2))))
+	print("  -> Rows spanning the whole X axis are merged")
+
+	memory = libminetest.map.MapVessel(None, backend = "memory")
+	libminetest.backends.migrate(libminetest.map.MapVessel(map), memory)
+	blob = libminetest.map.MapBlock().implode()
+	memory.write_many({libminetest.utils.getMapBlockPos(Pos(random.randint(-8, 8), random.randint(-8, 8), random.randint(-8, 8))): blob
+		for _ in range(500)})
+	found = 0
+	for file in (libminetest.map.MapVessel(map), memory):
+		for _ in range(20):
+			minp = Pos(random.randint(-150, 150), random.randint(-150, 150), random.randint(-150, 150))
+			maxp = Pos(random.randint(-150, 150), random.randint(-150, 150), random.randint(-150, 150))
+			lo = libminetest.utils.determineMapBlock(Pos(min(minp.x, maxp.x), min(minp.y, maxp.y), min(minp.z, maxp.z)))
+			hi = libminetest.utils.determineMapBlock(Pos(max(minp.x, maxp.x), max(minp.y, maxp.y), max(minp.z, maxp.z)))
+			expected = [i for i in sorted(file.get_all_mapblock_ids()) if
+				all(lo[k] <= libminetest.utils.getIntegerAsBlock(i)[k] <= hi[k] for k in range(3))]
+			assert(sorted(blockID for blockID, _ in file.blocks_in_area(minp, maxp, batch_size = 7)) == expected)
+			found += len(expected)
+	print("  -> blocks_in_area matches a filter over every mapblock ({0} found)".format(found))
+	print(" --> Test successful")
+
+def testMapBlockNodes():
+	mapb = libminetest.map.MapBlock()
+	assert(mapb.get_node(0).get_name() == "air")
+	print("  -> Fresh mapblock is filled with air")
+
+	mapb.set_node(42, libminetest.nodes.Node("default:stone", param1 = 12, param2 = 3))
+	node = mapb.get_node(42)
+	assert((node.get_name(), node.get_param1(), node.get_param2()) == ("default:stone", 12, 3))
+	print("  -> set_node/get_node: OK")
+
+	mapb = libminetest.map.MapBlock(mapb.implode())
+	node = mapb.get_node(42)
+	assert((node.get_name(), node.get_param1(), node.get_param2()) == ("default:stone", 12, 3))
+	assert(mapb.get_node(41).get_name() == "air")
+	print("  -> implode/explode: OK")
+
+	pos = libminetest.utils.Pos(10, 2, 3)
+	mapb.node_meta[pos.getAsInt()] = libminetest.metadata.NodeMetaRef(pos)
+	mapb.node_meta[pos.getAsInt()].set_string("infotext", "chest")
+	mapb.node_timers[pos.getAsTuple()] = libminetest.nodes.NodeTimerRef(pos, 5, 1)
+	mapb.node_timers[(1, 1, 1)] = libminetest.nodes.NodeTimerRef(libminetest.utils.Pos(1, 1, 1), 5, 1)
+	mapb = libminetest.map.MapBlock(mapb.implode())
+	assert(len(mapb.node_meta) == 1 and len(mapb.node_timers) == 2)
+	mapb.set_node(pos.getAsInt(), libminetest.nodes.Node("air"))
+	assert(len(mapb.node_meta) == 0 and list(mapb.node_timers) == [(1, 1, 1)])
+	print("  -> set_node drops metadata and timers")
+
+	print(" --> Test successful")
+
+def testStaticObjects():
+	mapb = libminetest.map.MapBlock(abspos = libminetest.utils.getMapBlockPos(libminetest.utils.Pos(-3, 7, -1200)))
+	raw = [[random.randint(-1 << 20, 1 << 20) for _ in range(3)] for _ in range(2000)]
+	for x, y, z in raw:
+		pos = libminetest.utils.Pos(x / 10000 + mapb.mapblockpos.x, y / 10000 + mapb.mapblockpos.y, z / 10000 + mapb.mapblockpos.z)
+		mapb.static_objects.append({"type": 7, "pos": pos, "data": "x"})
+	mapb.static_object_count = len(mapb.static_objects)
+
+	for _ in range(3):
+		mapb = libminetest.map.MapBlock(mapb.implode(), abspos = mapb.abspos)
+		for (x, y, z), obj in zip(raw, mapb.static_objects):
+			assert(obj["pos"] == (x / 10000 + mapb.mapblockpos.x, y / 10000 + mapb.mapblockpos.y, z / 10000 + mapb.mapblockpos.z))
+	print("  -> {0} static object positions survive implode/explode".format(len(raw)))
+	print(" --> Test successful")
+
+def testMapBlockLazy():
+	def fields(mapb, section):
+		# Comparable values of the attributes of a section
+		values = dict()
+		for field in libminetest.map.LAZY_SECTIONS[section]:
+			value = getattr(mapb, field)
+			if field in ("param0", "param1", "param2"):
+				value = list(value)
+			elif field == "node_meta":
+				value = {key: meta.get_string("infotext") for key, meta in value.items()}
+			elif field == "node_timers":
+				value = {key: (timer.timeout, timer.elapsed) for key, timer in value.items()}
+			elif field == "static_objects":
+				value = [(obj["type"], tuple(obj["pos"]), obj["data"]) for obj in value]
+			values[field] = value
+		return values
+
+	mapb = libminetest.map.MapBlock()
+	mapb.set_node(7, libminetest.nodes.Node("default:dirt", param1 = 3, param2 = 5))
+	pos = libminetest.utils.Pos(7, 0, 0)
+	mapb.node_meta[pos.getAsInt()] = libminetest.metadata.NodeMetaRef(pos)
+	mapb.node_meta[pos.getAsInt()].set_string("infotext", "dirt")
+	mapb.node_timers[pos.getAsTuple()] = libminetest.nodes.NodeTimerRef(pos, 5, 1)
+	mapb.static_objects.append({"type": 7, "pos": libminetest.utils.Pos(1.5, 2, 3), "data": "x"})
+	mapb.static_object_count = 1
+	blob = mapb.implode()
+
+	eager = libminetest.map.MapBlock(blob)
+	eager.decode_all()
+	sections = list(libminetest.map.LAZY_SECTIONS)
+	expected = {section: fields(eager, section) for section in sections}
+	assert(expected["meta"]["node_meta"] and expected["tail"]["node_timers"] and expected["tail"]["static_objects"])
+
+	for _ in range(6):
+		random.shuffle(sections)
+		mapb = libminetest.map.MapBlock(blob)
+		for section in sections:
+			mapb.decode_section(section)
+			assert(fields(mapb, section) == expected[section])
+		assert(mapb.get_blob() == blob)
+	print("  -> Sections decoded in any order match an eager decode")
+
+	mapb = libminetest.map.MapBlock(blob)
+	assert(mapb.get_node(7).get_name() == "default:dirt")
+	before = {section: fields(mapb, section) for section in sections}
+	mapb.decode_all()
+	assert(before == expected and {section: fields(mapb, section) for section in sections} == expected)
+	print("  -> Attributes read before and after decode_all match an eager decode")
+
+	mapb = libminetest.map.MapBlock(blob)
+	mapb.timestamp = 42
+	mapb.decode_all()
+	assert(mapb.timestamp == 42 and fields(mapb, "nodes") == expected["nodes"])
+	print("  -> Attributes set before decoding are kept")
+	print(" --> Test successful")
+
+def testInternedNodes():
+	a, b = libminetest.nodes.Node("default:dirt"), libminetest.nodes.Node("default:dirt")
+	assert(a.get_pos() is not b.get_pos())
+
+	node = libminetest.nodes.intern_node("default:stone", 0, 3)
+	assert(node is libminetest.nodes.intern_node("default:stone", 0, 3))
+	try:
+		node.set_param2(1)
+		assert(False)
+	except AttributeError:
+		pass
+
+	copy = node.copy()
+	copy.set_param2(1)
+	assert(copy.get_param2() == 1 and node.get_param2() == 3)
+	print("  -> Interned nodes are shared and read-only")
+
+	mapb = libminetest.map.MapBlock()
+	mapb.set_node(3, libminetest.nodes.Node("default:stone", param2 = 3))
+	assert(mapb.get_node(3, interned = True) is node)
+
+	libminetest.nodes.clear_interned()
+	assert(libminetest.nodes.intern_node("default:stone", 0, 3) is not node)
+	size = libminetest.nodes.INTERNED_MAX
+	for param2 in range(size // 256 + 1):
+		for param1 in range(256):
+			libminetest.nodes.intern_node("default:stone", param1, param2)
+	assert(len(libminetest.nodes._interned) <= size)
+	print("  -> Interned nodes are bounded")
+	print(" --> Test successful")
+
+def testContentRegistry():
+	registry = libminetest.content.ContentRegistry(["air", "default:stone"])
+	mapb = libminetest.map.MapBlock()
+	mapb.set_node(5, libminetest.nodes.Node("default:dirt"))
+	mapb.set_node(6, libminetest.nodes.Node("default:stone"))
+
+	ids = mapb.get_global_ids(registry)
+	assert(registry.names == ["air", "default:stone", "default:dirt"])
+	assert(ids[0] == 0 and ids[5] == 2 and ids[6] == 1)
+	assert(sum(registry.isin(ids, ["default:stone", "default:dirt"])) == 2)
+	print("  -> Global content ids : OK")
+	print(" --> Test successful")
+
+def testScanMapBlock():
+	mapb = libminetest.map.MapBlock()
+	mapb.set_node(12, libminetest.nodes.Node("default:mese"))
+	blob = mapb.implode()
+
+	summary = libminetest.map.scan_mapblock(blob)
+	full = libminetest.map.MapBlock(blob)
+	assert(summary["name_id_mappings"] == full.name_id_mappings)
+	assert(summary["timestamp"] == full.timestamp and summary["timer_count"] == full.timer_counts)
+	print("  -> Palette : {0}".format(summary["name_id_mappings"]))
+	print(" --> Test successful")
+
+def testLRUCache():
+	cache = libminetest.map.LRUCache()
+	for i in range(5):
+		cache.add(i, str(i))
+
+	assert(cache.get(0) == "0")
+	assert(cache.get(42) is None)
+	assert(cache.oldest() == 1)
+	print("  -> Least recently used is {0}".format(cache.oldest()))
+
+	assert(cache.evict() == (1, "1"))
+	assert(len(cache) == 4 and not 1 in cache)
+	print("  -> Eviction: OK")
+
+	assert(cache.get_stats() == {"size": 4, "hits": 1, "misses": 1, "evictions": 1})
+	print("  -> Stats: {0}".format(cache.get_stats()))
+	print(" --> Test successful")
+
+def testIterBlocks(map):
+	file = libminetest.map.MapVessel(map)
+	count = 0
+	for i, blob in file.iter_blocks(batch_size = 64):
+		assert(blob == file.read(i))
+		count += 1
+
+	assert(count == len(file.get_all_mapblock_ids()))
+	print("  -> {0} mapblocks streamed".format(count))
+	print(" --> Test successful")
+
+def testMapIndex(map):
+	if os.path.exists("test.index"):
+		os.remove("test.index")
+
+	file = libminetest.map.MapVessel(map)
+	index = libminetest.index.MapIndex("test.index")
+	s = time.time()
+	count = index.update(file)
+	print("  -> Indexed {0} mapblocks in {1:.4f}s".format(count, time.time() - s))
+	assert(count == len(file.get_all_mapblock_ids()))
+	assert(index.update(file) == 0)
+	print("  -> Unchanged mapblocks are skipped")
+
+	names = index.get_names()
+	assert(sum(names.values()) == count * 4096)
+	print("  -> {0} node names found".format(len(names)))
+	index.close()
+	print(" --> Test successful")
+
+def testMapStats(map):
+	file = libminetest.map.MapVessel(map)
+	count = len(file.get_all_mapblock_ids())
+	stats = file.stats()
+	assert(stats.blocks == count and sum(stats.versions.values()) == count)
+	assert(sum(stats.get_totals().values()) == count * 4096)
+	print("  -> Counted {0} mapblocks over {1} layers".format(stats.blocks, len(stats.nodes)))
+
+	minp, maxp = libminetest.utils.Pos(-20, -20, -20), libminetest.utils.Pos(20, 20, 20)
+	region = libminetest.map.MapInterface(map).read_region(minp, maxp)
+	boxed = file.stats(minp, maxp, workers = 0)
+	assert(boxed.get_totals().get("air", 0) == sum(1 for v in region.param0 if region.palette[v] == "air"))
+	print("  -> Box histogram matches read_region")
+
+	blockID = file.get_all_mapblock_ids()[0]
+	decoded = file.load(blockID)
+	decoded.decode_all()
+	assert(not decoded.__dict__.get("_blob"))
+	single = libminetest.stats.MapStats()
+	for mapb in (libminetest.map.MapBlock(), decoded):
+		single.add_mapblock(mapb)
+	assert(single.blocks == 2 and single.blob_bytes == len(libminetest.map.MapBlock().implode()) + len(decoded.implode()))
+	for mapb in (file.load(blockID), decoded, libminetest.map.MapBlock()):
+		blob = mapb.get_blob()
+		offset = 6 if blob[0] >= 27 else 4
+		nodes = zlib.decompressobj()
+		size = offset + len(nodes.decompress(blob[offset:]))
+		meta = zlib.decompressobj()
+		size += len(meta.decompress(nodes.unused_data)) + len(meta.unused_data)
+		assert(mapb.get_inflated_size() == size)
+	assert(libminetest.index._index_mapblock({}, libminetest.map.MapBlock())[1] == {"air": 4096})
+	assert(sum(libminetest.index._index_mapblock({}, decoded)[1].values()) == 4096)
+	print("  -> Fresh and decoded mapblocks counted")
+
+	ofile = StringIO()
+	stats.to_csv(ofile)
+	assert(ofile.getvalue().startswith("table,key,name,count"))
+	ofile = StringIO()
+	stats.to_json(ofile)
+	assert(json.loads(ofile.getvalue())["blocks"] == count)
+	print(" --> Test successful")
+
+def testBackends(map):
+	file = libminetest.map.MapVessel(map)
+	blobs = dict(file.iter_blocks())
+	memory = libminetest.map.MapVessel(None, backend = "memory")
+	assert(libminetest.backends.migrate(file, memory, batch_size = 16) == len(blobs))
+	assert(dict(memory.iter_blocks()) == blobs)
+	print("  -> Migrated {0} mapblocks to memory".format(len(blobs)))
+
+	blockID = next(iter(blobs))
+	try:
+		with memory.transaction():
+			memory.write(blockID, b"")
+			memory.remove(blockID)
+			raise KeyboardInterrupt
+	except KeyboardInterrupt:
+		pass
+	assert(memory.read(blockID) == blobs[blockID])
+	print("  -> Transaction rolled back")
+
+	class Incomplete(libminetest.backends.MapBackend):
+		def read_many(self, blockIDs):
+			return dict()
+	try:
+		Incomplete()
+		assert(False)
+	except TypeError as err:
+		print("  -> {0}".format(err))
+
+	shards = tempfile.mkdtemp()
+	sharded = libminetest.map.MapVessel.create(shards, backend = "sharded")
+	libminetest.backends.migrate(memory, sharded)
+	assert(sharded.read_many(blobs) == blobs)
+	assert(sorted(sharded.get_all_mapblock_ids()) == sorted(blobs))
+	print("  -> Migrated to {0} shards".format(len(sharded.backend.shards)))
+	sharded.close()
+	shutil.rmtree(shards)
+	print(" --> Test successful")
+
+def testRegion(map):
+	db = libminetest.map.MapInterface(map)
+	minp, maxp = libminetest.utils.Pos(-20, -20, -20), libminetest.utils.Pos(20, 20, 20)
+	s = time.time()
+	region = db.read_region(minp, maxp)
+	print("  -> Read {0} nodes in {1:.4f}s".format(region.volume, time.time() - s))
+
+	for _ in range(500):
+		pos = libminetest.utils.Pos(random.randint(-20, 20), random.randint(-20, 20), random.randint(-20, 20))
+		assert(region.get_node(pos).get_name() == db.get_node(pos).get_name())
+	print("  -> Region matches get_node")
+	print(" --> Test successful")
+
+def testRegionWrite(map):
+	directory = tempfile.mkdtemp()
+	mapfile = os.path.join(directory, "map.sqlite")
+	shutil.copy(map, mapfile)
+	Pos = libminetest.utils.Pos
+	minp, maxp = Pos(-21, -3, -18), Pos(18, 19, 5)
+
+	db = libminetest.map.MapInterface(mapfile)
+	region = db.read_region(minp, maxp)
+	assert(db.write_region(region) == 0 and len(db.mod_cache) == 0)
+	print("  -> Writing back an unchanged region changes no mapblock")
+
+	original = libminetest.map.MapInterface(map).read_region(minp, maxp)
+	changed = dict()
+	for _ in range(2000):
+		pos = Pos(random.randint(minp.x, maxp.x), random.randint(minp.y, maxp.y), random.randint(minp.z, maxp.z))
+		changed[pos.getAsTuple()] = random.choice(["default:glass", "default:mese", "air"])
+		region.set_node(pos, libminetest.nodes.Node(changed[pos.getAsTuple()], param2 = 2))
+	# Mapblocks are only written when one of their nodes changes (or when they are created)
+	touched = set(libminetest.utils.determineMapBlock(Pos(*pos)).getAsTuple() for pos, name in changed.items()
+		if (original.get_node(Pos(*pos)).get_name(), original.get_node(Pos(*pos)).get_param2()) != (name, 2))
+	assert(db.write_region(region) == len(touched))
+	db.save()
+	print("  -> Region written to {0} mapblocks out of {1}".format(len(touched), len(list(region.mapblocks()))))
+
+	written = libminetest.map.MapInterface(mapfile).read_region(minp, maxp)
+	for z in range(minp.z, maxp.z + 1):
+		for y in range(minp.y, maxp.y + 1):
+			for x in range(minp.x, maxp.x + 1):
+				pos = Pos(x, y, z)
+				node = written.get_node(pos)
+				if (x, y, z) in changed:
+					assert((node.get_name(), node.get_param2()) == (changed[(x, y, z)], 2))
+				elif original.get_node(pos).get_name() != "ignore":
+					assert(node.get_name() == original.get_node(pos).get_name())
+	print("  -> {0} nodes changed across mapblock edges, the others untouched".format(len(changed)))
+
+	glass = libminetest.region.Region(minp, maxp)
+	for i in range(glass.volume):
+		glass.param0[i] = glass.get_content_id("default:obsidian")
+	db = libminetest.map.MapInterface(mapfile)
+	db.write_region(glass, replace = {"default:glass"})
+	for pos, name in changed.items():
+		assert(db.get_node(Pos(*pos)).get_name() == ("default:obsidian" if name == "default:glass" else name))
+	print("  -> Only the nodes to replace are replaced")
+
+	db.save()
+	count = len(db.container.get_all_mapblock_ids())
+	assert(db.write_region(glass, replace = {"default:unobtainium"}) == 0 and len(db.mod_cache) == 0)
+	far = libminetest.region.Region(Pos(1008, 1008, 1008), Pos(1071, 1071, 1071))
+	for i in range(far.volume):
+		far.param0[i] = far.get_content_id("default:obsidian")
+	assert(db.write_region(far, replace = {"default:glass"}) == 0)
+	db.save()
+	assert(len(db.container.get_all_mapblock_ids()) == count)
+	print("  -> Mapblocks with nothing to replace are left out")
+	assert(db.write_region(far, replace = {"air"}) == 64)
+	db.save()
+	assert(len(db.container.get_all_mapblock_ids()) == count + 64)
+	print("  -> Missing mapblocks are created when air may be replaced")
+	shutil.rmtree(directory)
+	print(" --> Test successful")
+
 def testEndians():
 	assert(libminetest.utils.readS8(BytesIO(b"\xf8")) == -8)
 	print("  -> readS8: OK")
@@ -47,6 +546,23 @@ def testEndians():
 	print(" --> Test successful")
 
 
+def testPos():
+	a = libminetest.utils.Pos(1, -2, 35)
+	assert(a + libminetest.utils.Pos(1, 1, 1) == libminetest.utils.Pos(2, -1, 36))
+	assert(a // 16 == libminetest.utils.determineMapBlock(a) and a % 16 == libminetest.utils.Pos(1, 14, 3))
+	assert({a: True}.get(libminetest.utils.Pos(1, -2, 35)))
+	print("  -> Pos arithmetic and hashing : OK")
+
+	positions = [libminetest.utils.Pos(random.randint(-30000, 30000), random.randint(-30000, 30000), random.randint(-30000, 30000)) for _ in range(1000)]
+	batch = libminetest.utils.PosArray.from_positions(positions)
+	blocks = batch.mapblocks()
+	assert(list(blocks) == [libminetest.utils.determineMapBlock(pos) for pos in positions])
+	assert(list(blocks.block_ids()) == [libminetest.utils.getMapBlockPos(pos // 16) for pos in positions])
+	assert(list(batch.in_block_offsets()) == [(pos % 16).getAsInt() for pos in positions])
+	assert(list(batch + a) == [pos + a for pos in positions])
+	print("  -> PosArray : OK")
+	print(" --> Test successful")
+
 def testGetNode(map):
 	db = libminetest.map.MapInterface(map)
 
@@ -86,6 +602,14 @@ def testSetNode(map):
 		except libminetest.errors.IgnoreContentReplacementError:
 			pass
 
+	# In a mapblock of the map, which may not hold (0, 0, 0)
+	blockpos = libminetest.utils.getIntegerAsBlock(db.container.get_all_mapblock_ids()[0])
+	pos = libminetest.utils.Pos(blockpos.x * 16, blockpos.y * 16, blockpos.z * 16)
+	frozen = db.get_node(pos, interned = True)
+	db.set_node(libminetest.utils.Pos(pos.x + 1, pos.y, pos.z), frozen)
+	assert(db.get_node(libminetest.utils.Pos(pos.x + 1, pos.y, pos.z), interned = True) is frozen and frozen.get_pos() is None)
+	print("  -> Interned nodes can be placed")
+
 	print("  -> {0} nyan cats placed".format(u))
 	print("  -> {0}ms per call to set_node".format((time.time()-s)/u*1000))
 	s = time.time()
@@ -122,6 +646,11 @@ def testSchematics(map):
 	print("  ~~> File export : {0}s".format(time.time()-s))
 	assert(open("test.mts"))
 
+	# Header only
+	header = libminetest.schematics.Schematic("test.mts", header_only = True)
+	assert(header.size == schem.size and header.nodes == schem.nodes and not header.loaded)
+	print("  -> Header-only load : OK")
+
 	# Map export
 	db = libminetest.map.MapInterface(map)
 	s = time.time()
@@ -135,6 +664,7 @@ def testSchematics(map):
 	# Get node
 	node = schem.get_node(libminetest.utils.Pos(0, 0, 0)).get_name()
 	assert(node != "")
+	assert(node == db.get_node(libminetest.utils.Pos(-100, 0, 0)).get_name())
 	print("  -> Node in (0,0,0) is {0}".format(node))
 
 	# Import
@@ -148,6 +678,113 @@ def testSchematics(map):
 	print("  -> Saving took {0}s".format(time.time() - s))
 	print(" --> Test successful")
 
+def testSchematicArrays():
+	size = {"x": 20, "y": 10, "z": 30}
+	names = ["air", "default:stone", "default:wood"]
+	data = {}
+	for i in range(size["x"] * size["y"] * size["z"]):
+		data[i] = {"name": names[i % 3], "prob": 254, "param2": i % 4, "force_place": True}
+
+	schem = Schematic()
+	s = time.time()
+	schem.serialize_schematic({"size": size, "data": data})
+	print("  -> Serialized {0} nodes in {1:.4f}s".format(len(data), time.time() - s))
+
+	pos = libminetest.utils.Pos(3, 4, 5)
+	schem.set_node(pos, libminetest.nodes.Node("default:mese", param1 = 255, param2 = 3))
+
+	reloaded = Schematic()
+	reloaded.load(schem.export())
+	for _ in range(500):
+		p = libminetest.utils.Pos(random.randrange(size["x"]), random.randrange(size["y"]), random.randrange(size["z"]))
+		a, b = schem.get_node(p), reloaded.get_node(p)
+		assert((a.get_name(), a.get_param1(), a.get_param2()) == (b.get_name(), b.get_param1(), b.get_param2()))
+	assert(reloaded.get_node(pos).get_name() == "default:mese")
+	assert(reloaded.get_node(libminetest.utils.Pos(size["x"], 0, 0)) is None)
+	print("  -> Export/load round trip : OK")
+	print(" --> Test successful")
+
+def testSchematicTruncated():
+	size = {"x": 64, "y": 16, "z": 64}
+	volume = size["x"] * size["y"] * size["z"]
+	schem = Schematic()
+	schem.load_arrays(size, ["air"], libminetest.arrays.zeros("H", volume), libminetest.arrays.full("B", volume, 127), libminetest.arrays.zeros("B", volume))
+	blob = schem.export().read()
+	reader = libminetest.utils.BinaryReader(blob)
+	Schematic()._load_header(reader)
+	header = blob[:reader.tell()]
+	reader.view.release()
+
+	# A complete stream holding too few nodes, followed by garbage, a stream cut short, then a corrupted one
+	corrupted = bytearray(zlib.compress(bytes(range(256)) * (4 * volume // 256)))
+	corrupted[2:12] = b"\xff" * 10
+	for bulk, message in ((zlib.compress(bytes(volume + 1000)) + b"garbage", "too short"), (zlib.compress(bytes(4 * volume))[:200], "truncated"),
+			(bytes(corrupted), "corrupted")):
+		try:
+			Schematic().load(BytesIO(header + bulk))
+			assert(False)
+		except libminetest.errors.SchematicError as err:
+			assert(message in str(err))
+		print("  -> Bulk data {0} : SchematicError".format(message))
+	print(" --> Test successful")
+
+def testSchematicImportMeta():
+	schem = Schematic()
+	schem.serialize_schematic({"size": {"x": 2, "y": 1, "z": 1}, "data": {
+		0: {"name": "default:stone", "prob": 254, "param2": 0, "force_place": True},
+		1: {"name": "default:dirt", "prob": 254, "param2": 0, "force_place": True},
+	}})
+
+	for forceplace, keep_meta, kept in ((True, False, 0), (True, True, 2), (False, False, 1)):
+		db = libminetest.map.MapInterface(None, backend = "memory")
+		db.init_mapblock(0)
+		mapb = db.mapblocks[0]
+		mapb.set_node(1, libminetest.nodes.Node("default:chest"))
+		for pos in (libminetest.utils.Pos(0, 0, 0), libminetest.utils.Pos(1, 0, 0)):
+			mapb.node_meta[pos.getAsInt()] = libminetest.metadata.NodeMetaRef(pos)
+			mapb.node_timers[pos.getAsTuple()] = libminetest.nodes.NodeTimerRef(pos, 5, 1)
+
+		db.import_schematic(libminetest.utils.Pos(0, 0, 0), schem, forceplace = forceplace, keep_meta = keep_meta)
+		assert(len(mapb.node_meta) == kept and len(mapb.node_timers) == kept)
+		assert(db.get_node(libminetest.utils.Pos(1, 0, 0)).get_name() == ("default:dirt" if forceplace else "default:chest"))
+	print("  -> Metadata and timers of replaced nodes are dropped")
+	print(" --> Test successful")
+
+def testSchematicTransforms():
+	size = {"x": 6, "y": 3, "z": 4}
+	data = {}
+	for i in range(size["x"] * size["y"] * size["z"]):
+		data[i] = {"name": ["air", "stairs:stair_wood", "default:stone"][i % 3], "prob": 254, "param2": i % 4, "force_place": True}
+
+	schem = Schematic()
+	schem.serialize_schematic({"size": size, "data": data})
+
+	rotated = schem.copy()
+	rotated.rotate_y(1, facedir = ["stairs:stair_wood"])
+	assert(rotated.size == {"x": 4, "y": 3, "z": 6})
+	node, rnode = schem.get_node(libminetest.utils.Pos(5, 0, 0)), rotated.get_node(libminetest.utils.Pos(0, 0, 0))
+	assert(node.get_name() == rnode.get_name())
+	for _ in range(3):
+		rotated.rotate_y(1, facedir = ["stairs:stair_wood"])
+	assert(list(rotated.param0) == list(schem.param0) and list(rotated.param2) == list(schem.param2))
+	print("  -> Rotations : OK")
+
+	flipped = schem.copy()
+	flipped.flip("x")
+	assert(flipped.get_node(libminetest.utils.Pos(0, 1, 2)).get_name() == schem.get_node(libminetest.utils.Pos(5, 1, 2)).get_name())
+	print("  -> Flip : OK")
+
+	cropped = schem.copy()
+	cropped.crop(libminetest.utils.Pos(1, 1, 1), libminetest.utils.Pos(2, 2, 3))
+	assert(cropped.size == {"x": 2, "y": 2, "z": 3})
+	assert(cropped.get_node(libminetest.utils.Pos(0, 0, 0)).get_name() == schem.get_node(libminetest.utils.Pos(1, 1, 1)).get_name())
+	print("  -> Crop : OK")
+
+	schem.replace_nodes({"stairs:stair_wood": "default:stone"})
+	assert(schem.nodes == ["air", "default:stone"])
+	print("  -> Node replacement : OK")
+	print(" --> Test successful")
+
 def testMapBlockInit(map):
 	# Open the db
 	db = libminetest.map.MapInterface(map)
@@ -274,11 +911,91 @@ def main(map):
 	testMapBlockLoad(map)
 	print("  => Test took {0:.10f}s".format(time.time()-s))
 
+	print("=> MapBlock streaming")
+	s = time.time()
+	testIterBlocks(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Map index")
+	s = time.time()
+	testMapIndex(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Map statistics")
+	s = time.time()
+	testMapStats(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Storage backends")
+	s = time.time()
+	testBackends(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Batched reads and writes")
+	s = time.time()
+	testBatchedBlocks(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Connection profiles")
+	s = time.time()
+	testProfiles(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Read-only maps")
+	s = time.time()
+	testReadOnly(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Area queries")
+	s = time.time()
+	testAreaQueries(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> MapBlock nodes")
+	s = time.time()
+	testMapBlockNodes()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Static objects")
+	s = time.time()
+	testStaticObjects()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> MapBlock lazy decoding")
+	s = time.time()
+	testMapBlockLazy()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> LRU cache")
+	s = time.time()
+	testLRUCache()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> MapBlock palette scan")
+	s = time.time()
+	testScanMapBlock()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Content registry")
+	s = time.time()
+	testContentRegistry()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Interned nodes")
+	s = time.time()
+	testInternedNodes()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
 	print("=> Unsigned Big Endians")
 	s = time.time()
 	testEndians()
 	print("  => Test took {0:.10f}s".format(time.time()-s))
 
+	print("=> Positions")
+	s = time.time()
+	testPos()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
 	print("=> get_node Test")
 	s = time.time()
 	testGetNode(map)
@@ -289,6 +1006,16 @@ def main(map):
 	testSetNode(map)
 	print("  => Test took {0:.10f}s".format(time.time()-s))
 
+	print("=> Region read")
+	s = time.time()
+	testRegion(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Region write")
+	s = time.time()
+	testRegionWrite(map)
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
 	print("=> Lighting Complete Set/Get")
 	s = time.time()
 	testLightingDone(map)
@@ -304,6 +1031,26 @@ def main(map):
 	testSchematics(map)
 	print("  => Test took {0:.10f}s".format(time.time()-s))
 
+	print("=> Schematic arrays")
+	s = time.time()
+	testSchematicArrays()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Truncated schematics")
+	s = time.time()
+	testSchematicTruncated()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Schematic import metadata")
+	s = time.time()
+	testSchematicImportMeta()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
+	print("=> Schematic transforms")
+	s = time.time()
+	testSchematicTransforms()
+	print("  => Test took {0:.10f}s".format(time.time()-s))
+
 	print("=> MapBlock init")
 	s = time.time()
 	testMapBlockInit(map)